@@ -0,0 +1,148 @@
+# Calibration.py: Persistent calibration of the servos of a robot in MicroPython
+# Copyright (C) 2022 Vincent Mistler (YouMakeTech)
+#
+# Stores the calibration of each servo (servoMin, servoCenter, servoMax,
+# trim, position limits and lookup table resolution) in a compact binary
+# file, read in one go at startup and applied before the first pulse.
+# Another robot only needs another calibration file, not another program.
+#
+# >>> Calibration.fromServos(ravenms.lowerBodyServos).save('ravenms.cal')
+# ...
+# >>> Calibration.load('ravenms.cal').apply(servos)
+#
+# File format (little-endian):
+#     4 bytes  magic b'CALB'
+#     1 byte   format version (1)
+#     1 byte   number of servos
+#     then 14 bytes per servo:
+#     1 byte   servo id
+#     1 byte   lookup table entries per degree (0: no lookup table)
+#     2 bytes  servoMin in µs
+#     2 bytes  servoCenter in µs, without the trim
+#     2 bytes  servoMax in µs
+#     2 bytes  trim in µs (signed)
+#     2 bytes  positionMin in 1/100 degree
+#     2 bytes  positionMax in 1/100 degree
+
+import struct
+
+_MAGIC=b'CALB'
+_VERSION=1
+_HEADER='<4sBB'
+_HEADER_SIZE=6
+_RECORD='<BBHHHhHH'
+_RECORD_SIZE=14
+
+class Calibration:
+    # Calibration(data=None)
+    # data is the content of a calibration file, None for an empty calibration
+    def __init__(self,data=None):
+        if data is None:
+            data=struct.pack(_HEADER,_MAGIC,_VERSION,0)
+        magic,version,count=struct.unpack_from(_HEADER,data,0)
+        if magic!=_MAGIC or version!=_VERSION:
+            raise ValueError('Calibration: not a version '+str(_VERSION)+' calibration')
+        if len(data)!=_HEADER_SIZE+count*_RECORD_SIZE:
+            raise ValueError('Calibration: expected '+str(count)+' servos')
+        self._data=bytearray(data) # packed records, as in the file
+
+    def __len__(self):
+        return self._data[5]
+
+    # calibration=Calibration.fromServos(servos)
+    # captures the current calibration of a list of servos
+    @staticmethod
+    def fromServos(servos):
+        calibration=Calibration()
+        for servo in servos:
+            calibration.set(servo)
+        return calibration
+
+    # set(servo)
+    # adds or replaces the calibration of a servo
+    def set(self,servo):
+        record=struct.pack(_RECORD,servo.id,servo._lutSteps,servo.servoMin,servo.servoCenter-servo.servoTrim, \
+                           servo.servoMax,servo.servoTrim,int(servo.positionMin*100+0.5),int(servo.positionMax*100+0.5))
+        offset=self._find(servo.id)
+        if offset<0:
+            self._data+=record
+            self._data[5]+=1
+        else:
+            self._data[offset:offset+_RECORD_SIZE]=record
+
+    # (servoMin,servoCenter,servoMax,servoTrim,positionMin,positionMax,lutSteps)=get(id)
+    # returns the calibration of the servo with the given id, None if unknown
+    def get(self,id):
+        offset=self._find(id)
+        if offset<0:
+            return None
+        id,lutSteps,servoMin,servoCenter,servoMax,servoTrim,positionMin,positionMax= \
+            struct.unpack_from(_RECORD,self._data,offset)
+        return (servoMin,servoCenter,servoMax,servoTrim,positionMin/100,positionMax/100,lutSteps)
+
+    # count=apply(servos)
+    # calibrates the servos found in the calibration, the others keep their settings
+    # the lookup tables and the conversion coefficients are computed here,
+    # once, such that nothing is recomputed when the servos move
+    # returns the number of servos calibrated
+    def apply(self,servos):
+        count=0
+        for servo in servos:
+            values=self.get(servo.id)
+            if values is not None:
+                servoMin,servoCenter,servoMax,servoTrim,positionMin,positionMax,lutSteps=values
+                servo.calibrate(servoMin,servoCenter,servoMax,positionMin,positionMax,servoTrim, \
+                                1/lutSteps if lutSteps>0 else None)
+                count+=1
+        return count
+
+    # save(filename)
+    # writes the calibration to a file
+    def save(self,filename):
+        with open(filename,'wb') as f:
+            f.write(self._data)
+
+    # calibration=Calibration.load(filename)
+    # reads a calibration file in one read
+    # raises OSError if the file does not exist
+    @staticmethod
+    def load(filename):
+        with open(filename,'rb') as f:
+            return Calibration(f.read())
+
+    # returns the offset of the record of a servo in self._data, -1 if not found
+    def _find(self,id):
+        data=self._data
+        offset=_HEADER_SIZE
+        while offset<len(data):
+            if data[offset]==id:
+                return offset
+            offset+=_RECORD_SIZE
+        return -1
+
+if __name__ == "__main__":
+    import os
+    from Hal import Hal
+    from Log import Log
+    from Servo import Servo
+    Log.setLevel(Log.OFF)
+    Hal.simulate()
+    servo=Servo(3,positionMin=10,positionMax=170.5)
+    servo.setServoMin(600)
+    servo.trim(-20)
+    servo.enableLUT(0.5)
+    calibration=Calibration.fromServos([servo,Servo(4)])
+    assert(len(calibration)==2)
+    calibration.save('test.cal')
+    assert(os.stat('test.cal')[6]==_HEADER_SIZE+2*_RECORD_SIZE)
+
+    # applied to lazy servos before their first pulse
+    calibration=Calibration.load('test.cal')
+    os.remove('test.cal')
+    assert(calibration.get(3)==(600,1500,2400,-20,10,170.5,2))
+    servos=[Servo(3,lazy=True),Servo(5,lazy=True)]
+    assert(calibration.apply(servos)==1)
+    assert(servos[0].servoCenter==1480 and servos[0].lutEnabled())
+    assert(servos[1].servoMin==640) # not in the calibration
+    servos[0].write(90)
+    assert(servos[0].pin.timeline==[(Hal.clock.ticks_us(),1480000)]) # first pulse trimmed
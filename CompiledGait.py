@@ -0,0 +1,218 @@
+# CompiledGait.py: Precompiled per-tick pulse streams for servo gaits in MicroPython
+# Copyright (C) 2022 Vincent Mistler (YouMakeTech)
+#
+# A gait such as RavenMS.walk is compiled once into a flat buffer holding
+# the pulse width of every servo at every tick: the angle limits, the
+# conversion to pulse widths and the motion profiles are all evaluated by
+# the compiler. Playing the gait is then a timed loop of duty_ns() writes
+# with integer math only and no allocation.
+#
+# >>> gait=CompiledGait.fromKeyframes(WALK,ravenms.lowerBodyGroup)
+# >>> gait.save('walk.gait')
+# ...
+# >>> gait=CompiledGait.load('walk.gait') # fast startup: no compilation
+# >>> gait.play(ravenms.lowerBodyGroup)
+#
+# File format (little-endian, as on the RP2040):
+#     4 bytes  magic b'GAIT'
+#     1 byte   format version (1)
+#     1 byte   number of servos
+#     2 bytes  tick period in ms
+#     4 bytes  number of ticks
+#     then one unsigned 16-bit pulse width in µs per servo per tick
+# The pulse widths are stored in µs rather than ns to halve the size
+# of the buffer, duty_ns() receiving 1000 times the stored value.
+
+from array import array
+import struct
+from Hal import Hal
+from Instrumentation import Instrumentation
+
+_MAGIC=b'GAIT'
+_VERSION=1
+_HEADER='<4sBBHI'
+_HEADER_SIZE=12
+
+class CompiledGait:
+    # CompiledGait(servoCount,period_ms,tickCount)
+    # allocates an empty gait of tickCount ticks of period_ms for servoCount servos
+    def __init__(self,servoCount,period_ms,tickCount):
+        self.servoCount=servoCount
+        self.period_ms=period_ms
+        self.tickCount=tickCount
+        # tickCount rows of servoCount pulse widths in µs
+        self.pulses=array('H',(0 for i in range(servoCount*tickCount)))
+
+    # duration_ms=duration()
+    # returns the duration of the gait in ms
+    def duration(self):
+        return self.period_ms*self.tickCount
+
+    # gait=CompiledGait.fromKeyframes(keyframes,group,period_ms=20,profile=None)
+    # compiles a keyframe sequence for the servos of a ServoGroup
+    # profile=None snaps the servos to each pose like Keyframes.play(),
+    # otherwise the poses are blended with the profile like Keyframes.blend(),
+    # starting from the current position of the servos
+    # the frames begin on the tick nearest to their start time
+    @staticmethod
+    def fromKeyframes(keyframes,group,period_ms=20,profile=None):
+        servos=group.servos
+        servoCount=len(servos)
+        totalDuration=keyframes.totalDuration()
+        tickCount=(totalDuration+period_ms-1)//period_ms
+        gait=CompiledGait(servoCount,period_ms,tickCount)
+        pulses=gait.pulses
+        startPulses=[servo.microseconds if servo.enabled else servo.positionToMicroseconds(servo.initialPosition) for servo in servos]
+        endPulses=[0]*servoCount
+        frameStart=0
+        for frame in range(keyframes.frameCount()):
+            duration=keyframes.getDuration(frame)
+            for i in range(servoCount):
+                endPulses[i]=servos[i].positionToMicroseconds(keyframes.getAngle(frame,i))
+            shape=profile(0.0,1.0,duration) if profile is not None and duration>0 else None
+            frameEnd=frameStart+duration
+            tick=(frameStart+period_ms//2)//period_ms
+            endTick=(frameEnd+period_ms//2)//period_ms
+            if endTick>tickCount:
+                endTick=tickCount
+            while tick<endTick:
+                t=tick*period_ms-frameStart
+                fraction=1.0 if shape is None or t>=duration else shape.valueAt(t if t>0 else 0)
+                for i in range(servoCount):
+                    pulses[tick*servoCount+i]=int(startPulses[i]+(endPulses[i]-startPulses[i])*fraction+0.5)
+                tick+=1
+            for i in range(servoCount):
+                startPulses[i]=endPulses[i]
+            frameStart=frameEnd
+        return gait
+
+    # play(group)
+    # play the gait on the servos of a ServoGroup, one row of pulse widths every period_ms
+    def play(self,group):
+        clock=Hal.clock
+        servoCount=self.servoCount
+        pulses=self.pulses
+        period_ms=self.period_ms
+        push=group._push
+        row=0
+        end=servoCount*self.tickCount
+        nextTick=clock.ticks_ms()
+        lastTick=-1
+        while row<end:
+            if Instrumentation.enabled:
+                lastTick=Instrumentation.tick(lastTick)
+            push(pulses,row)
+            row+=servoCount
+            nextTick=clock.ticks_add(nextTick,period_ms)
+            wait=clock.ticks_diff(nextTick,clock.ticks_ms())
+            if wait>0:
+                clock.sleep_ms(wait)
+            elif wait<=-period_ms:
+                # late by one period or more: resume from now instead of
+                # sending the missed rows back to back
+                if Instrumentation.enabled:
+                    Instrumentation.late(-1000*wait)
+                nextTick=clock.ticks_ms()
+
+    # save(filename)
+    # write the gait to a binary file
+    def save(self,filename):
+        with open(filename,'wb') as f:
+            f.write(struct.pack(_HEADER,_MAGIC,_VERSION,self.servoCount,self.period_ms,self.tickCount))
+            f.write(self.pulses)
+
+    # gait=CompiledGait.load(filename)
+    # read a gait written by save()
+    # the pulse widths are read straight into the preallocated buffer
+    @staticmethod
+    def load(filename):
+        with open(filename,'rb') as f:
+            magic,version,servoCount,period_ms,tickCount=struct.unpack(_HEADER,f.read(_HEADER_SIZE))
+            if magic!=_MAGIC or version!=_VERSION:
+                raise ValueError('CompiledGait: '+filename+' is not a version '+str(_VERSION)+' gait file')
+            gait=CompiledGait(servoCount,period_ms,tickCount)
+            if f.readinto(gait.pulses)!=2*len(gait.pulses):
+                raise ValueError('CompiledGait: '+filename+' is truncated')
+        return gait
+
+# benchmark(ticks)
+# compares the time to send one pose of the walk cycle with
+# ServoGroup.write() and with the compiled gait
+def benchmark(ticks=1000):
+    from Log import Log
+    from RavenMS import RavenMS, WALK
+    from servoBenchmark import BenchmarkPWM
+    level=Log.level
+    Log.setLevel(Log.OFF)
+    ravenms=RavenMS()
+    group=ravenms.lowerBodyGroup
+    for servo in group:
+        servo.pin=BenchmarkPWM()
+    gait=CompiledGait.fromKeyframes(WALK,group)
+    angles=WALK.angles
+    frameCount=WALK.frameCount()
+    t0=Hal.clock.ticks_us()
+    for k in range(ticks):
+        group.write(angles,(k%frameCount)*WALK.jointCount)
+    write_us=Hal.clock.ticks_diff(Hal.clock.ticks_us(),t0)
+    pulses=gait.pulses
+    push=group._push
+    t0=Hal.clock.ticks_us()
+    for k in range(ticks):
+        push(pulses,(k%gait.tickCount)*gait.servoCount)
+    push_us=Hal.clock.ticks_diff(Hal.clock.ticks_us(),t0)
+    print('ServoGroup.write: '+str(int(1000*write_us/ticks))+' ns/pose, compiled gait: ' \
+          +str(int(1000*push_us/ticks))+' ns/pose')
+    for servo in group:
+        servo.detach()
+    Log.setLevel(level)
+
+if __name__ == "__main__":
+    from Log import Log
+    from RavenMS import RavenMS, WALK
+    Log.setLevel(Log.OFF)
+    hostClock=Hal.clock
+    clock=Hal.simulate()
+    ravenms=RavenMS()
+    group=ravenms.lowerBodyGroup
+
+    # a 50ms period divides all the frame durations:
+    # the compiled walk sends the same pulses at the same times as RavenMS.walk()
+    gait=CompiledGait.fromKeyframes(WALK,group,period_ms=50)
+    assert(gait.duration()==WALK.totalDuration())
+    foot=ravenms.rightFoot
+    start_us=clock.ticks_us()
+    gait.play(group)
+    assert(clock.ticks_us()-start_us==1000*WALK.totalDuration())
+    t=start_us
+    for frame in range(WALK.frameCount()):
+        expected=1000*foot.positionToMicroseconds(WALK.getAngle(frame,0))
+        for time_us,ns in foot.pin.timeline:
+            if time_us>=t and time_us<t+1000*WALK.getDuration(frame):
+                assert(ns==expected)
+        t+=1000*WALK.getDuration(frame)
+
+    # after a stalled tick, the next rows keep their period
+    class StalledGroup:
+        def __init__(self,group):
+            self.group=group
+            self.times=[]
+        def _push(self,pulses,row):
+            self.times.append(clock.ticks_ms())
+            self.group._push(pulses,row)
+            if len(self.times)==2:
+                clock.sleep_ms(200)
+    stalled=StalledGroup(group)
+    gait.play(stalled)
+    assert(stalled.times[2]-stalled.times[1]==200)
+    assert(stalled.times[3]-stalled.times[2]==50)
+
+    # save and load
+    gait.save('walk.gait')
+    loaded=CompiledGait.load('walk.gait')
+    assert(loaded.pulses==gait.pulses and loaded.period_ms==50)
+    import os
+    os.remove('walk.gait')
+
+    Hal.setClock(hostClock)
+    benchmark()
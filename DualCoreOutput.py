@@ -0,0 +1,164 @@
+# DualCoreOutput.py: Servo output loop on the second core of the RP2040 in MicroPython
+# Copyright (C) 2022 Vincent Mistler (YouMakeTech)
+#
+# The servo loop runs on core 1 (started with _thread) and sends the latest
+# pose to a ServoGroup every period_ms, on a ticks_us deadline.
+# Core 0 only posts poses with setPose() and returns immediately:
+# the behaviors, the sensors and the communications running on core 0
+# never delay the pulses.
+#
+# The pose is double-buffered: setPose() converts the angles to pulse widths
+# in µs into the back buffer and the loop swaps the buffers at its next tick.
+# The limits, the calibration and the logs are handled on core 0: core 1 only
+# sends integer pulse widths. The lock only guards
+# the copy and the swap, and core 1 never waits for it: when core 0 holds it,
+# the swap is retried at the next tick.
+#
+# >>> output=DualCoreOutput(ravenms.lowerBodyGroup)
+# >>> output.start()
+# >>> output.setPose((90,90,90,90,90,90,90,90,90,90))
+# ...
+# >>> output.stop()
+#
+# The loop allocates no memory, such that core 1 does not trigger
+# garbage collections (they stop both cores).
+#
+# Hal.disable_irq() only masks the interrupts of the core calling it, so core 1
+# must be the only one switching the shared PWM channels: start() stops the timer
+# of the multiplexer given to the loop, which then refreshes it itself. While the
+# loop runs, core 0 neither writes the servos of the group (only setPose())
+# nor attaches or detaches servos on the channels of the multiplexer.
+# Under CPython, _thread runs the loop in a thread, e.g. with the fake PWM of Hal.
+
+import _thread
+from array import array
+from Hal import Hal
+from Log import Log
+from Instrumentation import Instrumentation
+
+class DualCoreOutput:
+    # DualCoreOutput(group,period_ms=20,multiplexer=None)
+    # group is the ServoGroup driven by core 1
+    # period_ms is the period of the servo loop (20ms=50Hz)
+    # multiplexer is an optional PWMMultiplexer refreshed by the loop instead of its timer
+    def __init__(self,group,period_ms=20,multiplexer=None):
+        self.group=group
+        self.period_ms=period_ms
+        self.multiplexer=multiplexer
+        self.ticks=0 # number of ticks of the loop
+        self.poses=0 # number of poses sent to the servos
+
+        # internal variables
+        pose=[servo.positionToMicroseconds(servo.read()) for servo in group.servos]
+        self._buffers=(array('H',pose),array('H',pose)) # pulse widths in µs: front (sent by core 1) and back (written by core 0)
+        self._front=0
+        self._pending=False # True when the back buffer holds a pose not sent yet
+        self._lock=_thread.allocate_lock()
+        self._running=False
+        self._stopped=True
+
+    # start()
+    # start the servo loop on the second core
+    # the timer of the multiplexer is stopped: core 1 becomes its only writer
+    def start(self):
+        if not self._stopped:
+            return
+        if Log.level>=Log.INFO:
+            print('DualCoreOutput.start()')
+        if self.group._lazy:
+            self.group._attachLazyServos() # on core 0, before the loop
+        if self.multiplexer is not None:
+            self.multiplexer.stop()
+        self._running=True
+        self._stopped=False
+        _thread.start_new_thread(self._loop,())
+
+    # stop()
+    # stop the servo loop and wait for its end
+    # the servos hold their last position
+    def stop(self):
+        self._running=False
+        while not self._stopped:
+            Hal.clock.sleep_ms(1)
+
+    # setPose(angles)
+    # post the angles of the servos of the group, sent at the next tick
+    # a pose posted before the previous one was sent replaces it
+    # the angles are limited and converted to pulse widths here, on core 0
+    def setPose(self,angles):
+        servos=self.group.servos
+        self._lock.acquire()
+        back=self._buffers[1-self._front]
+        for i in range(len(back)):
+            back[i]=servos[i].positionToMicroseconds(angles[i])
+        self._pending=True
+        self._lock.release()
+
+    # servo loop of core 1
+    def _loop(self):
+        clock=Hal.clock
+        group=self.group
+        multiplexer=self.multiplexer
+        lock=self._lock
+        period_us=1000*self.period_ms
+        nextTick=clock.ticks_us()
+        lastTick=-1
+        try:
+            while self._running:
+                if Instrumentation.enabled:
+                    lastTick=Instrumentation.tick(lastTick)
+                if self._pending and lock.acquire(0):
+                    self._front=1-self._front
+                    self._pending=False
+                    lock.release()
+                    group._push(self._buffers[self._front])
+                    self.poses+=1
+                if multiplexer is not None:
+                    multiplexer.refresh()
+                self.ticks+=1
+                nextTick=clock.ticks_add(nextTick,period_us)
+                wait=clock.ticks_diff(nextTick,clock.ticks_us())
+                if wait>0:
+                    clock.sleep_us(wait)
+                elif wait<=-period_us:
+                    # late by one period or more: skip the missed ticks
+                    if Instrumentation.enabled:
+                        Instrumentation.late(-wait)
+                    nextTick=clock.ticks_us()
+        finally:
+            self._stopped=True
+
+if __name__ == "__main__":
+    from Hal import HostClock
+    from RavenMS import RavenMS
+    from Servo import Servo
+    from Instrumentation import Instrumentation # the class used by the servo loop
+    Log.setLevel(Log.OFF)
+    clock=Hal.simulate(HostClock()) # fake pins, real time for the threads
+    ravenms=RavenMS()
+    multiplexer=Servo.defaultBackend.multiplexer
+    multiplexer.start()
+    output=DualCoreOutput(ravenms.lowerBodyGroup,period_ms=10,multiplexer=multiplexer)
+    Instrumentation.enable(period_us=10000)
+    output.start()
+    assert(multiplexer._timer is None) # refreshed by core 1 only
+
+    # core 0 keeps busy and posts poses faster than the loop sends them
+    foot=ravenms.rightFoot
+    pose=array('f',ravenms.lowerBodyGroup.read())
+    start_ms=clock.ticks_ms()
+    angle=0
+    while clock.ticks_diff(clock.ticks_ms(),start_ms)<300:
+        angle=(angle+1)%60
+        pose[0]=30+angle
+        output.setPose(pose)
+        sum(range(1000))
+    clock.sleep_ms(30)
+    output.stop()
+    assert(output._stopped)
+    assert(output.ticks>=20)
+    assert(0<output.poses<=output.ticks)
+    assert(foot.microseconds==foot.positionToMicroseconds(30+angle)) # the last pose is sent
+    # one pulse width per pose at most, sent by the loop only
+    assert(len(foot.pin.timeline)<=output.poses+1)
+    Instrumentation.dump()
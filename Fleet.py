@@ -0,0 +1,201 @@
+# Fleet.py: Synchronized motions of several robots driven from one host with asyncio
+# Copyright (C) 2022 Vincent Mistler (YouMakeTech)
+#
+# Each robot runs a RemoteServer (see RemoteControl.py) on its serial link.
+# The host measures the clock offset of each robot, then sends the same
+# keyframes to all of them as timed poses (POSE_AT) with a shared start time,
+# converted to the clock of each robot: the robots send each pose to their
+# servos at the same time, whatever the latency of their link.
+#
+# >>> import asyncio, serial
+# >>> fleet=Fleet([serial.Serial(port,115200,timeout=0) for port in ('/dev/ttyACM0','/dev/ttyACM1')])
+# >>> async def main():
+# ...     await fleet.synchronize()
+# ...     await fleet.walk()
+# >>> asyncio.run(main())
+#
+# The poses are sent lead_ms before their time, such that they are queued
+# on the robots before they are due. synchronize() again before a long
+# choreography to follow the drift of the clocks.
+#
+# The robots do not check the timed poses: give the Fleet a SafetyChecker
+# to refuse the unsafe motions on the host, e.g. with a model of the robot:
+# >>> Hal.simulate()
+# >>> fleet=Fleet(streams,safety=RavenMS(lazy=True).setSafety())
+
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+from Hal import Hal
+from Log import Log
+from RemoteControl import RemoteClient, ACK, CLOCK, TIME, STOP, OK, _HEADER_SIZE, _getTime
+from RavenMSAsync import sleep_ms
+from RavenMS import WALK, LB_TRANSFORM_HUMAN_HELI, LB_TRANSFORM_HELI_HUMAN
+
+_TICKS_PERIOD=1<<30 # the ticks_ms() of MicroPython wrap around
+
+class Fleet:
+    # Fleet(streams,lead_ms=100,timeout_ms=100,safety=None)
+    # streams are the non-blocking serial links of the robots
+    # lead_ms is how long before its time a pose is sent
+    # timeout_ms is the max. time to wait for a reply
+    # safety is the SafetyChecker of the motions, None to play them unchecked
+    def __init__(self,streams,lead_ms=100,timeout_ms=100,safety=None):
+        self.clients=[RemoteClient(stream,timeout_ms) for stream in streams]
+        self.lead_ms=lead_ms
+        self.safety=safety
+        self.offsets=[0]*len(streams)    # ticks_ms() of each robot minus ticks_ms() of the host
+        self.roundTrips=[-1]*len(streams) # best round trip of the clock measurements in ms
+        self.rejected=[0]*len(streams)   # commands answered with another status than OK
+
+    def __len__(self):
+        return len(self.clients)
+
+    # offsets=await synchronize(samples=8)
+    # measure the clock offset of all the robots at once and return the offsets
+    # each offset is taken from the exchange of samples with the shortest round trip
+    # raises OSError if a robot does not answer
+    async def synchronize(self,samples=8):
+        await asyncio.gather(*[self._synchronize(i,samples) for i in range(len(self.clients))])
+        if Log.level>=Log.INFO:
+            print('Fleet.synchronize(): offsets '+str(self.offsets)+' ms, round trips '+str(self.roundTrips)+' ms')
+        return self.offsets
+
+    # rejected=await play(keyframes,delay_ms=200)
+    # play a keyframe sequence on all the robots, starting delay_ms from now,
+    # and return once it is over with the number of poses rejected by each robot
+    # raises ValueError if self.safety refuses the sequence, before sending anything
+    async def play(self,keyframes,delay_ms=200):
+        if self.safety is not None and not self.safety.isSafe(keyframes):
+            raise ValueError('Fleet.play(): unsafe motion, see SafetyChecker.report()')
+        clock=Hal.clock
+        jointCount=keyframes.jointCount
+        pose=[0]*jointCount
+        rejected=list(self.rejected)
+        t=clock.ticks_add(clock.ticks_ms(),delay_ms) # on the clock of the host
+        for k in range(keyframes.frameCount()):
+            wait=clock.ticks_diff(t,clock.ticks_ms())-self.lead_ms
+            if wait>0:
+                await sleep_ms(wait)
+            for joint in range(jointCount):
+                pose[joint]=keyframes.getAngle(k,joint)
+            for i in range(len(self.clients)):
+                self.clients[i].setPoseAt((t+self.offsets[i])%_TICKS_PERIOD,pose)
+            t=clock.ticks_add(t,keyframes.getDuration(k))
+        await asyncio.gather(*[self._reply(i,ACK,self.clients[i].sequence) for i in range(len(self.clients))])
+        wait=clock.ticks_diff(t,clock.ticks_ms())
+        if wait>0:
+            await sleep_ms(wait)
+        return [self.rejected[i]-rejected[i] for i in range(len(self.clients))]
+
+    # await stop()
+    # stop the motions and drop the queued poses of all the robots
+    async def stop(self):
+        for client in self.clients:
+            client.stop()
+        await asyncio.gather(*[self._reply(i,ACK,self.clients[i].sequence) for i in range(len(self.clients))])
+
+    async def walk(self):
+        if Log.level>=Log.INFO:
+            print('Fleet.walk()')
+        return await self.play(WALK)
+
+    async def lb_transform_human_heli(self):
+        return await self.play(LB_TRANSFORM_HUMAN_HELI)
+
+    async def lb_transform_heli_human(self):
+        return await self.play(LB_TRANSFORM_HELI_HUMAN)
+
+    async def _synchronize(self,i,samples):
+        clock=Hal.clock
+        client=self.clients[i]
+        self.roundTrips[i]=-1
+        for k in range(samples):
+            t0=clock.ticks_ms()
+            if not await self._reply(i,CLOCK,client._send(TIME,0)):
+                continue
+            roundTrip=clock.ticks_diff(clock.ticks_ms(),t0)
+            if self.roundTrips[i]<0 or roundTrip<self.roundTrips[i]:
+                # the robot read its clock halfway through the round trip
+                self.roundTrips[i]=roundTrip
+                self.offsets[i]=_getTime(client.parser.frame)-clock.ticks_add(t0,roundTrip//2)
+        if self.roundTrips[i]<0:
+            raise OSError('Fleet: robot '+str(i)+' does not answer')
+
+    # wait for the reply of a given type to a command of robot i
+    # counts the ACK received meanwhile with another status than OK
+    async def _reply(self,i,type,sequence):
+        clock=Hal.clock
+        client=self.clients[i]
+        parser=client.parser
+        start=clock.ticks_ms()
+        while True:
+            while parser.receive(client.stream):
+                if parser.type()==ACK and parser.frame[_HEADER_SIZE]!=OK:
+                    self.rejected[i]+=1
+                if parser.type()==type and parser.sequence()==sequence:
+                    return True
+            if clock.ticks_diff(clock.ticks_ms(),start)>=client.timeout_ms:
+                return False
+            await sleep_ms(1)
+
+if __name__ == "__main__":
+    from Hal import OffsetClock
+    from RavenMS import RavenMS
+    from PWMBackend import PWMBackend
+    from RemoteControl import RemoteServer, LoopbackStream
+    from Keyframes import Keyframes
+    Log.setLevel(Log.OFF)
+    clock=Hal.simulate()
+    # three simulated robots started at different times
+    offsets=(0,123456,7777)
+    servers=[]
+    links=[]
+    for offset in offsets:
+        host,device=LoopbackStream.pair()
+        ravenms=RavenMS(backend=PWMBackend()) # its own pins
+        servers.append(RemoteServer(ravenms,device,clock=OffsetClock(clock,offset)))
+        links.append(host)
+    fleet=Fleet(links)
+
+    # each robot polls its link every ms
+    async def robot(server):
+        while True:
+            server.poll()
+            await sleep_ms(1)
+
+    async def main():
+        tasks=[asyncio.create_task(robot(server)) for server in servers]
+        await fleet.synchronize()
+        for i in range(len(offsets)):
+            assert(abs(fleet.offsets[i]-offsets[i])<=1)
+        first=[len(server.ravenms.rightFoot.pin.timeline) for server in servers]
+        start_ms=clock.ticks_ms()
+        assert(await fleet.walk()==[0,0,0])
+        assert(clock.ticks_ms()-start_ms>=200+WALK.totalDuration())
+        # the same pulses within 2ms on all the robots
+        timelines=[servers[i].ravenms.rightFoot.pin.timeline[first[i]:] for i in range(len(servers))]
+        assert(len(timelines[0])>=WALK.frameCount()//2)
+        for k in range(len(timelines[0])):
+            times=[timeline[k][0] for timeline in timelines]
+            assert(max(times)-min(times)<=2000)
+            assert(timelines[1][k][1]==timelines[0][k][1] and timelines[2][k][1]==timelines[0][k][1])
+        await fleet.stop()
+
+        # the unsafe motions are refused before any pose is sent
+        fleet.safety=servers[0].ravenms.setSafety()
+        stand=[WALK.getAngle(0,joint) for joint in range(10)]
+        fast=list(stand)
+        fast[2]=60 # right upper leg: 70 degrees in 50ms
+        sequence=fleet.clients[0].sequence
+        try:
+            await fleet.play(Keyframes(10,stand+[50]+fast+[500]))
+            assert(False)
+        except ValueError:
+            pass
+        assert(fleet.clients[0].sequence==sequence)
+        for task in tasks:
+            task.cancel()
+
+    asyncio.run(main())
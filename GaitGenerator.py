@@ -0,0 +1,197 @@
+# GaitGenerator.py: Parametric walk cycle generator for the Raven MS robot in MicroPython
+# Copyright (C) 2022 Vincent Mistler (YouMakeTech)
+#
+# Synthesizes the walk from a few parameters instead of a stored table:
+#     stepLength  distance covered by a foot during a step in mm
+#     stepHeight  height of the foot at the middle of the swing in mm
+#     lean        sideways shift of the body over the supporting foot in mm
+#     cadence     steps per minute (two steps per walk cycle)
+#     height      height of the hips above the feet in mm (knees slightly bent)
+# The foot trajectories are converted to joint angles by LegKinematics.
+#
+# The frames are produced on demand by a generator, one per period_ms,
+# in a single reused pose: the memory used does not depend on how long
+# the robot walks. The parameters can be changed at any time, e.g. to walk
+# faster, and apply from the next frame without discontinuity.
+#
+# >>> gait=GaitGenerator(ravenms)
+# >>> gait.play(5000)          # walk for 5s
+# >>> gait.cadence=180         # faster, even from another task while playing
+
+from math import sin, cos, pi
+from array import array
+from Hal import Hal
+from Instrumentation import Instrumentation
+
+class GaitGenerator:
+    # GaitGenerator(ravenms,stepLength=20,stepHeight=10,lean=8,cadence=120,height=80,period_ms=20)
+    def __init__(self,ravenms,stepLength=20,stepHeight=10,lean=8,cadence=120,height=80,period_ms=20):
+        self.ravenms=ravenms
+        self.stepLength=stepLength
+        self.stepHeight=stepHeight
+        self.lean=lean
+        self.cadence=cadence
+        self.height=height
+        self.period_ms=period_ms
+        self.unreachable=0 # number of foot targets out of reach or beyond the servo limits
+
+        # internal variables
+        self._phase=0.0 # position in the walk cycle, from 0 to 1
+        # lower body pose, in the order of RavenMS.lowerBodyServos
+        self._pose=array('f',(servo.initialPosition for servo in ravenms.lowerBodyServos))
+
+    # frames()
+    # generator of the poses of the walk, one every period_ms, forever
+    # the same array is yielded each time, updated in place
+    # the right leg swings during the first half of each cycle, the left one during the second half
+    def frames(self):
+        pose=self._pose
+        rightLeg=self.ravenms.rightLeg
+        leftLeg=self.ravenms.leftLeg
+        while True:
+            # two steps per cycle
+            self._phase+=self.period_ms*self.cadence/120000
+            if self._phase>=1.0:
+                self._phase-=1.0
+            phase=self._phase
+
+            # shift the body over the supporting foot
+            # the hips only roll inwards: each side is leaned by one hip
+            y=-self.lean*sin(2*pi*phase)
+            self._placeFoot(rightLeg,phase,y if y>0 else 0.0,pose,3,2,1,0)
+            self._placeFoot(leftLeg,phase+0.5 if phase<0.5 else phase-0.5,y if y<0 else 0.0,pose,4,5,6,7)
+            yield pose
+
+    # play(duration_ms)
+    # walk for duration_ms on the lower body servos, one frame every period_ms
+    def play(self,duration_ms):
+        clock=Hal.clock
+        group=self.ravenms.lowerBodyGroup
+        frames=self.frames()
+        end=clock.ticks_add(clock.ticks_ms(),duration_ms)
+        nextFrame=clock.ticks_ms()
+        lastTick=-1
+        while clock.ticks_diff(end,nextFrame)>0:
+            if Instrumentation.enabled:
+                lastTick=Instrumentation.tick(lastTick)
+            group.write(next(frames))
+            nextFrame=clock.ticks_add(nextFrame,self.period_ms)
+            wait=clock.ticks_diff(nextFrame,clock.ticks_ms())
+            if wait>0:
+                clock.sleep_ms(wait)
+            elif wait<=-self.period_ms:
+                # late by one period or more: resume from now instead of
+                # sending the missed frames back to back
+                if Instrumentation.enabled:
+                    Instrumentation.late(-1000*wait)
+                nextFrame=clock.ticks_ms()
+
+    # reset()
+    # restart the walk cycle from its beginning
+    def reset(self):
+        self._phase=0.0
+
+    # writes the angles of a leg to the pose at the given indices
+    # phase 0 to 0.5: swing forward, 0.5 to 1: on the ground, pushing backward
+    def _placeFoot(self,leg,phase,y,pose,hip,upperLeg,lowerLeg,foot):
+        halfStep=0.5*self.stepLength
+        if phase<0.5:
+            s=2*phase
+            x=-halfStep*cos(pi*s)                     # smooth swing from -halfStep to +halfStep
+            z=self.height-self.stepHeight*sin(pi*s)
+        else:
+            x=halfStep*(3-4*phase)                    # constant speed from +halfStep to -halfStep
+            z=self.height
+        angles=leg.inverse(x,y,z)
+        if angles is None:
+            self.unreachable+=1 # hold the previous angles
+            return
+        pose[hip]=angles[0]
+        pose[upperLeg]=angles[1]
+        pose[lowerLeg]=angles[2]
+        pose[foot]=angles[3]
+
+# benchmark(frames)
+# measures the number of frames generated per second,
+# with an empty and with a warm inverse kinematics cache
+def benchmark(frameCount=2000):
+    from Log import Log
+    from RavenMS import RavenMS
+    level=Log.level
+    Log.setLevel(Log.OFF)
+    gait=GaitGenerator(RavenMS(lazy=True))
+    for name in ('cold','warm'):
+        gait.ravenms.rightLeg.clearCache()
+        gait.ravenms.leftLeg.clearCache()
+        if name=='warm':
+            frames=gait.frames()
+            for k in range(100): # fill the caches with one walk cycle
+                next(frames)
+        gait.reset()
+        frames=gait.frames()
+        t0=Hal.clock.ticks_us()
+        if name=='cold':
+            # clear the caches at every frame such that each target is solved
+            for k in range(frameCount):
+                gait.ravenms.rightLeg.clearCache()
+                gait.ravenms.leftLeg.clearCache()
+                next(frames)
+        else:
+            for k in range(frameCount):
+                next(frames)
+        elapsed=Hal.clock.ticks_diff(Hal.clock.ticks_us(),t0)
+        print('GaitGenerator '+name+' cache: '+str(int(frameCount*1000000/elapsed))+' frames/s')
+    Log.setLevel(level)
+
+if __name__ == "__main__":
+    from Log import Log
+    from RavenMS import RavenMS
+    Log.setLevel(Log.OFF)
+    hostClock=Hal.clock
+    clock=Hal.simulate()
+    ravenms=RavenMS()
+    gait=GaitGenerator(ravenms)
+    frames=gait.frames()
+
+    # one cycle of 50 frames at 120 steps/min and 20ms per frame
+    first=array('f',next(frames))
+    for k in range(49):
+        pose=next(frames)
+    assert(gait.unreachable==0)
+    pose=next(frames)
+    for i in range(len(pose)):
+        assert(abs(pose[i]-first[i])<1e-3) # back to the start of the cycle
+    # the swinging foot is lifted
+    assert(ravenms.rightLeg.forward((pose[3],pose[2],pose[1],pose[0]))[2]<gait.height)
+
+    # faster while walking: half the frames per cycle
+    gait.cadence=240
+    start=gait._phase
+    for k in range(25):
+        next(frames)
+    assert(abs(gait._phase-start)<1e-6)
+
+    start_ms=clock.ticks_ms()
+    gait.play(2000)
+    assert(clock.ticks_ms()-start_ms==2000)
+    assert(ravenms.rightFoot.writesIssued+ravenms.rightFoot.writesSuppressed>=100)
+
+    # after a stalled write, the next frames keep their period
+    class StalledGroup:
+        def __init__(self,group):
+            self.group=group
+            self.times=[]
+        def write(self,angles):
+            self.times.append(clock.ticks_ms())
+            self.group.write(angles)
+            if len(self.times)==2:
+                clock.sleep_ms(100)
+    group=ravenms.lowerBodyGroup
+    stalled=StalledGroup(group)
+    ravenms.lowerBodyGroup=stalled
+    gait.play(200)
+    ravenms.lowerBodyGroup=group
+    assert(stalled.times[2]-stalled.times[1]==100)
+    assert(stalled.times[3]-stalled.times[2]==gait.period_ms)
+    Hal.setClock(hostClock)
+    benchmark()
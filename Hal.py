@@ -0,0 +1,399 @@
+# Hal.py: Hardware abstraction layer with injectable clock and PWM
+# Copyright (C) 2022 Vincent Mistler (YouMakeTech)
+#
+# The other modules read the time and create their pins through Hal:
+#     Hal.clock.ticks_ms(), Hal.clock.sleep(s), Hal.Pin(id), Hal.PWM(pin),
+#     Hal.Timer(id), state=Hal.disable_irq() ... Hal.enable_irq(state)
+# On the board, Hal.clock is the time module and Hal.Pin/Hal.PWM/Hal.Timer come from machine.
+# Under CPython, Hal.clock follows the host clock and the pins and timers are fakes,
+# such that the code can run and be benchmarked off-device.
+#
+# Hal.simulate() replaces the clock with a deterministic SimClock,
+# fires the timers while the SimClock sleeps
+# and records every pulse width sent to a FakePWM:
+# >>> from Hal import Hal
+# >>> clock=Hal.simulate()
+# >>> from RavenMS import RavenMS
+# >>> ravenms=RavenMS()
+# >>> ravenms.walk()                     # returns immediately
+# >>> clock.ticks_ms()                   # 5500 simulated ms later
+# >>> ravenms.rightFoot.pin.timeline     # [(time_us,duty_ns),...]
+
+import time
+
+try:
+    import machine
+except ImportError:
+    machine=None
+
+# Clock of the host under CPython, with the MicroPython time API
+class HostClock:
+    def ticks_ms(self):
+        return time.monotonic_ns()//1000000
+
+    def ticks_us(self):
+        return time.monotonic_ns()//1000
+
+    def ticks_diff(self,ticks1,ticks2):
+        return ticks1-ticks2
+
+    def ticks_add(self,ticks,delta):
+        return ticks+delta
+
+    def sleep(self,seconds):
+        time.sleep(seconds)
+
+    def sleep_ms(self,ms):
+        time.sleep(ms/1000)
+
+    def sleep_us(self,us):
+        time.sleep(us/1000000)
+
+    # await asleep_ms(ms)
+    # non-blocking sleep for asyncio tasks
+    async def asleep_ms(self,ms):
+        import asyncio
+        await asyncio.sleep(ms/1000)
+
+# Deterministic simulated clock
+# the time only moves when the program sleeps or calls advance_us()/advance_ms(),
+# plus step_us on every read to emulate the execution time of busy loops
+# asyncio tasks sleeping with asleep_ms() wake up in the order of their
+# wake-up times, the clock jumping to the earliest one once all tasks wait
+# the FakeTimers started on the clock fire at their time while it sleeps
+class SimClock:
+    def __init__(self,start_us=0,step_us=0):
+        self._us=start_us
+        self.step_us=step_us
+        self._wakes=[] # wake-up times of the tasks in asleep_ms()
+        self._timers=[] # FakeTimers running on this clock
+
+    def ticks_ms(self):
+        self._us+=self.step_us
+        return self._us//1000
+
+    def ticks_us(self):
+        self._us+=self.step_us
+        return self._us
+
+    def ticks_diff(self,ticks1,ticks2):
+        return ticks1-ticks2
+
+    def ticks_add(self,ticks,delta):
+        return ticks+delta
+
+    def sleep(self,seconds):
+        self._advance(int(seconds*1000000))
+
+    def sleep_ms(self,ms):
+        self._advance(int(ms*1000))
+
+    def sleep_us(self,us):
+        self._advance(int(us))
+
+    # await asleep_ms(ms)
+    # non-blocking sleep for asyncio tasks, in simulated time
+    async def asleep_ms(self,ms):
+        import asyncio
+        wake=self._us+int(ms*1000)
+        self._wakes.append(wake)
+        try:
+            while True:
+                await asyncio.sleep(0) # let the other tasks run up to their next sleep
+                if self._us>=wake:
+                    return
+                if wake==min(self._wakes):
+                    self._advance(wake-self._us)
+                    return
+        finally:
+            self._wakes.remove(wake)
+
+    def advance_ms(self,ms):
+        self.sleep_ms(ms)
+
+    def advance_us(self,us):
+        self.sleep_us(us)
+
+    # move the time forward by us, firing the timers due meanwhile at their time
+    def _advance(self,us):
+        end=self._us+us
+        while len(self._timers)>0:
+            timer=self._timers[0]
+            for other in self._timers:
+                if other._due<timer._due:
+                    timer=other
+            if timer._due>end:
+                break
+            if timer._due>self._us:
+                self._us=timer._due
+            timer._fire()
+        if end>self._us:
+            self._us=end
+
+# Clock shifted by offset_ms from another clock, e.g. to simulate
+# several boards started at different times on the same SimClock
+class OffsetClock:
+    def __init__(self,clock,offset_ms):
+        self.clock=clock
+        self.offset_ms=offset_ms
+
+    def ticks_ms(self):
+        return self.clock.ticks_ms()+self.offset_ms
+
+    def ticks_us(self):
+        return self.clock.ticks_us()+1000*self.offset_ms
+
+    def ticks_diff(self,ticks1,ticks2):
+        return self.clock.ticks_diff(ticks1,ticks2)
+
+    def ticks_add(self,ticks,delta):
+        return self.clock.ticks_add(ticks,delta)
+
+    def sleep(self,seconds):
+        self.clock.sleep(seconds)
+
+    def sleep_ms(self,ms):
+        self.clock.sleep_ms(ms)
+
+    def sleep_us(self,us):
+        self.clock.sleep_us(us)
+
+# Stand-in for machine.Pin
+class FakePin:
+    IN=0
+    OUT=1
+    ALT=3
+    ALT_PWM=4
+
+    def __init__(self,id,mode=-1,value=None):
+        self.id=id
+        self.mode=mode
+        self._value=value
+
+    def init(self,mode=-1,value=None,alt=-1):
+        self.mode=mode
+        self.alt=alt
+        if value is not None:
+            self._value=value
+
+    def value(self,value=None):
+        if value is None:
+            return self._value
+        self._value=value
+
+# Stand-in for machine.PWM recording the pulse widths it receives
+# timeline is a list of (time_us,duty_ns), time_us being read from Hal.clock
+class FakePWM:
+    def __init__(self,pin,record=True):
+        self.pin=pin
+        self.record=record
+        self.timeline=[]
+        self._freq=0
+        self._duty_ns=0
+        self.enabled=True
+
+    def freq(self,freq=None):
+        if freq is None:
+            return self._freq
+        self._freq=freq
+
+    def duty_ns(self,ns=None):
+        if ns is None:
+            return self._duty_ns
+        self._duty_ns=ns
+        if self.record:
+            self.timeline.append((Hal.clock.ticks_us(),ns))
+
+    def deinit(self):
+        self.enabled=False
+
+# Stand-in for machine.Timer
+# on a SimClock, the callback is called by the clock when it sleeps past its time,
+# otherwise from a thread (like an interrupt, in the middle of the main program)
+class FakeTimer:
+    ONE_SHOT=0
+    PERIODIC=1
+
+    def __init__(self,id=-1):
+        self.id=id
+        self.mode=FakeTimer.PERIODIC
+        self.period=-1
+        self.callback=None
+        self._clock=None # SimClock firing the timer
+        self._due=0      # time of the next call on the SimClock in µs
+
+    def init(self,mode=PERIODIC,period=-1,callback=None,freq=-1):
+        self.deinit()
+        if freq>0:
+            period=1000/freq
+        self.mode=mode
+        self.period=period
+        self.callback=callback
+        clock=Hal.clock
+        if hasattr(clock,'_timers'):
+            self._clock=clock
+            self._due=clock._us+int(1000*period)
+            clock._timers.append(self)
+        else:
+            import threading
+            thread=threading.Thread(target=self._run,args=(callback,),daemon=True)
+            thread.start()
+
+    def deinit(self):
+        self.callback=None
+        if self._clock is not None:
+            self._clock._timers.remove(self)
+            self._clock=None
+
+    # call the callback on the SimClock and schedule the next call
+    def _fire(self):
+        if self.mode==FakeTimer.ONE_SHOT:
+            callback=self.callback
+            self.deinit()
+        else:
+            callback=self.callback
+            self._due+=int(1000*self.period)
+        callback(self)
+
+    # thread of a timer on the host clock, until deinit() or init() again
+    def _run(self,callback):
+        while self.callback is callback:
+            time.sleep(self.period/1000)
+            if self.callback is not callback:
+                break
+            if self.mode==FakeTimer.ONE_SHOT:
+                self.callback=None
+            callback(self)
+
+# Stand-ins for machine.disable_irq/enable_irq: no interrupt to mask off-device
+def fakeDisableIrq():
+    return 0
+
+def fakeEnableIrq(state):
+    pass
+
+# Fake I2C bus counting transactions and bytes
+class FakeI2C:
+    def __init__(self):
+        self.memory={} # (address,register) -> last written value
+        self.transactions=0
+        self.bytes=0
+
+    def writeto_mem(self,address,register,buffer):
+        self.transactions+=1
+        self.bytes+=len(buffer)
+        for i in range(len(buffer)):
+            self.memory[(address,register+i)]=buffer[i]
+
+class Hal:
+    # clock with the API of the MicroPython time module:
+    # ticks_ms, ticks_us, ticks_diff, ticks_add, sleep, sleep_ms, sleep_us
+    clock=time if hasattr(time,'ticks_ms') else HostClock()
+    Pin=machine.Pin if machine is not None else FakePin
+    PWM=machine.PWM if machine is not None else FakePWM
+    Timer=machine.Timer if machine is not None else FakeTimer
+    mem32=getattr(machine,'mem32',None) # RP2040 registers, None off-device
+    # mask the interrupts, e.g. the timer of PWMMultiplexer, around a short critical section
+    disable_irq=machine.disable_irq if machine is not None else fakeDisableIrq
+    enable_irq=machine.enable_irq if machine is not None else fakeEnableIrq
+
+    # setClock(clock)
+    # use another clock, e.g. a SimClock
+    @staticmethod
+    def setClock(clock):
+        Hal.clock=clock
+
+    # setHardware(Pin,PWM,mem32=None,Timer=FakeTimer)
+    # use other pin, PWM and timer classes, e.g. FakePin and FakePWM
+    @staticmethod
+    def setHardware(Pin,PWM,mem32=None,Timer=FakeTimer):
+        Hal.Pin=Pin
+        Hal.PWM=PWM
+        Hal.mem32=mem32
+        Hal.Timer=Timer
+
+    # clock=simulate(clock=None)
+    # run on a simulated clock (a new SimClock by default) with fake timers
+    # and fake pins recording their pulses, and return the clock
+    @staticmethod
+    def simulate(clock=None):
+        if clock is None:
+            clock=SimClock()
+        Hal.setClock(clock)
+        Hal.setHardware(FakePin,FakePWM)
+        return clock
+
+# benchmark()
+# runs RavenMS.walk() on the simulated clock and prints how much faster
+# than real time it runs and the number of recorded pulse width changes
+def benchmark(cycles=10):
+    from Log import Log
+    from RavenMS import RavenMS
+    level=Log.level
+    Log.setLevel(Log.OFF)
+    hostClock=Hal.clock
+    Pin,PWM,mem32,Timer=Hal.Pin,Hal.PWM,Hal.mem32,Hal.Timer
+    t0=hostClock.ticks_us()
+    clock=Hal.simulate()
+    ravenms=RavenMS()
+    for i in range(cycles):
+        ravenms.walk()
+    simulated_us=clock.ticks_us()
+    Hal.setClock(hostClock)
+    Hal.setHardware(Pin,PWM,mem32,Timer)
+    elapsed_us=hostClock.ticks_diff(hostClock.ticks_us(),t0)
+    changes=sum([len(servo.pin.timeline) for servo in ravenms.lowerBodyServos])
+    print('RavenMS.walk() x'+str(cycles)+': '+str(simulated_us//1000)+' simulated ms in ' \
+          +str(elapsed_us//1000)+' ms, '+str(simulated_us//max(elapsed_us,1))+'x real time, ' \
+          +str(changes)+' pulse widths recorded')
+    Log.setLevel(level)
+
+if __name__ == "__main__":
+    # the Hal seen by the other modules is the one of the Hal module, not of __main__
+    from Hal import Hal, benchmark
+    from Log import Log
+    from RavenMS import RavenMS, WALK
+    Log.setLevel(Log.OFF)
+    hostClock=Hal.clock
+    clock=Hal.simulate()
+    ravenms=RavenMS()
+    start_us=clock.ticks_us()
+    ravenms.walk()
+    assert(clock.ticks_us()-start_us==1000*WALK.totalDuration())
+    # one pulse width at the time of each frame changing the position of the foot
+    foot=ravenms.rightFoot
+    timeline=dict(foot.pin.timeline[1:]) # skip the initial position
+    t=start_us
+    previous=foot.pin.timeline[0][1]
+    for frame in range(WALK.frameCount()):
+        ns=1000*foot.positionToMicroseconds(WALK.getAngle(frame,0))
+        if ns!=previous:
+            assert(timeline.pop(t)==ns)
+        previous=ns
+        t+=1000*WALK.getDuration(frame)
+    assert(len(timeline)==0)
+    assert(clock.ticks_ms()==5500)
+
+    # the timers fire at their time while the simulated clock sleeps
+    calls=[]
+    timer=Hal.Timer(-1)
+    timer.init(mode=Hal.Timer.PERIODIC,period=20,callback=lambda t: calls.append(clock.ticks_ms()))
+    start_ms=clock.ticks_ms()
+    clock.sleep_ms(70)
+    timer.deinit()
+    clock.sleep_ms(100)
+    assert(calls==[start_ms+20,start_ms+40,start_ms+60])
+
+    # RavenMS with its upper body runs its PWMMultiplexer from a timer:
+    # the servos sharing a PWM channel take turns
+    from Servo import Servo
+    multiplexer=Servo.defaultBackend.multiplexer
+    RavenMS(upperBody=True)
+    shared=multiplexer._channels[multiplexer._shared[0]]
+    counts=[len(servo.pin.timeline) for servo in shared]
+    clock.sleep_ms(100)
+    multiplexer.stop()
+    for i in range(len(shared)):
+        assert(len(shared[i].pin.timeline)>=counts[i]+2)
+    Hal.setClock(hostClock)
+    benchmark()
@@ -0,0 +1,227 @@
+# Instrumentation.py: Timing histograms of the servo control loops in MicroPython
+# Copyright (C) 2022 Vincent Mistler (YouMakeTech)
+#
+# Measures with Hal.clock.ticks_us() and counts in preallocated histograms:
+#     period   time between two ticks of a control loop
+#     jitter   difference between the period and the nominal period
+#     overrun  lateness of the ticks starting one period or more after their deadline,
+#              i.e. when a loop fell a whole tick behind and skips the missed ticks
+#     write    time spent sending the pulse widths (duty_ns) of a servo or a pose
+#     gc       duration of the garbage collections run by collect()
+# Recording allocates nothing, so measuring does not disturb the loop.
+# Call sites test Instrumentation.enabled first, like Log.events:
+# >>> from Instrumentation import Instrumentation
+# >>> Instrumentation.enable(period_us=20000)
+# >>> scheduler.start()   # or any loop calling Instrumentation.tick(lastTick)
+# Each loop keeps the time of its own previous tick, such that several loops
+# (e.g. a MotionScheduler and a CompiledGait) do not measure each other:
+# >>> lastTick=-1
+# >>> while True:
+# ...     if Instrumentation.enabled:
+# ...         lastTick=Instrumentation.tick(lastTick)
+# ...
+# >>> Instrumentation.dump()                 # over serial
+# >>> with open('timing.csv','w') as f:      # or to a file for the host
+# ...     Instrumentation.dump(f)
+
+import gc
+from array import array
+from Hal import Hal
+
+# print a line, or write it to a stream
+def _output(stream,line):
+    if stream is None:
+        print(line)
+    else:
+        stream.write(line+'\n')
+
+class Histogram:
+    # Histogram(name,binWidth_us,binCount)
+    # binCount bins of binWidth_us, the last one also counts the larger values
+    def __init__(self,name,binWidth_us,binCount):
+        self.name=name
+        self.binWidth_us=binWidth_us
+        self.bins=array('I',(0 for i in range(binCount)))
+        self.clear()
+
+    # clear()
+    # forget all the recorded values
+    def clear(self):
+        bins=self.bins
+        for i in range(len(bins)):
+            bins[i]=0
+        self.count=0
+        self.min=-1
+        self.max=-1
+
+    # add(value_us)
+    # count a value, without allocating memory
+    def add(self,value_us):
+        i=value_us//self.binWidth_us
+        if i<0:
+            i=0
+        elif i>=len(self.bins):
+            i=len(self.bins)-1
+        self.bins[i]+=1
+        if self.count==0 or value_us<self.min:
+            self.min=value_us
+        if value_us>self.max:
+            self.max=value_us
+        self.count+=1
+
+    # value_us=percentile(p)
+    # returns the upper bound of the bin reaching p percent of the values
+    def percentile(self,p):
+        target=self.count*p/100
+        n=0
+        for i in range(len(self.bins)):
+            n+=self.bins[i]
+            if n>=target and n>0:
+                return (i+1)*self.binWidth_us
+        return 0
+
+    # dump(stream=None)
+    # print the non-empty bins, or write them to a stream such as a file:
+    # histogram,bin_us,count
+    def dump(self,stream=None):
+        for i in range(len(self.bins)):
+            if self.bins[i]>0:
+                _output(stream,self.name+','+str(i*self.binWidth_us)+','+str(self.bins[i]))
+
+class Instrumentation:
+    enabled=False # True when the control loops record their timing
+    period_us=20000 # nominal period of the control loop
+
+    # histograms, allocated by enable()
+    period=None
+    jitter=None
+    overrun=None
+    write=None
+    gc=None
+
+    # enable(period_us=20000,binWidth_us=100,binCount=64)
+    # allocate the histograms and start recording
+    # the period uses bins of 8*binWidth_us, the overruns of 4*binWidth_us,
+    # the garbage collections of binWidth_us, the jitter and the writes of binWidth_us/10
+    @staticmethod
+    def enable(period_us=20000,binWidth_us=100,binCount=64):
+        Instrumentation.period_us=period_us
+        Instrumentation.period=Histogram('period',8*binWidth_us,binCount)
+        Instrumentation.jitter=Histogram('jitter',binWidth_us//10 or 1,binCount)
+        Instrumentation.overrun=Histogram('overrun',4*binWidth_us,binCount)
+        Instrumentation.write=Histogram('write',binWidth_us//10 or 1,binCount)
+        Instrumentation.gc=Histogram('gc',binWidth_us,binCount)
+        Instrumentation.enabled=True
+
+    # disable()
+    # stop recording and free the histograms
+    @staticmethod
+    def disable():
+        Instrumentation.enabled=False
+        Instrumentation.period=None
+        Instrumentation.jitter=None
+        Instrumentation.overrun=None
+        Instrumentation.write=None
+        Instrumentation.gc=None
+
+    # clear()
+    # forget all the recorded values
+    @staticmethod
+    def clear():
+        for histogram in Instrumentation.histograms():
+            histogram.clear()
+
+    # histograms=histograms()
+    # returns the list of the histograms
+    @staticmethod
+    def histograms():
+        return [Instrumentation.period,Instrumentation.jitter,Instrumentation.overrun, \
+                Instrumentation.write,Instrumentation.gc]
+
+    # lastTick=tick(lastTick)
+    # called by a control loop at each tick: records the period and the jitter
+    # lastTick is the value returned at the previous tick of the same loop, -1 at its first tick
+    @staticmethod
+    def tick(lastTick):
+        now=Hal.clock.ticks_us()
+        if lastTick<0:
+            return now
+        period=Hal.clock.ticks_diff(now,lastTick)
+        Instrumentation.period.add(period)
+        jitter=period-Instrumentation.period_us
+        Instrumentation.jitter.add(jitter if jitter>=0 else -jitter)
+        return now
+
+    # late(late_us)
+    # called by a control loop whose tick starts late_us after its deadline,
+    # late_us being one period or more: the loop skips the missed ticks
+    @staticmethod
+    def late(late_us):
+        Instrumentation.overrun.add(late_us)
+
+    # written(start_us)
+    # called after sending pulse widths, start_us being ticks_us() before sending them
+    @staticmethod
+    def written(start_us):
+        Instrumentation.write.add(Hal.clock.ticks_diff(Hal.clock.ticks_us(),start_us))
+
+    # collect()
+    # run the garbage collector and record its duration
+    # e.g. from the idle time of a loop, instead of a collection at a random time
+    @staticmethod
+    def collect():
+        t0=Hal.clock.ticks_us()
+        gc.collect()
+        if Instrumentation.enabled:
+            Instrumentation.gc.add(Hal.clock.ticks_diff(Hal.clock.ticks_us(),t0))
+
+    # dump(stream=None)
+    # print the histograms (e.g. over USB serial), or write them to a stream
+    # such as a file, as CSV: histogram,bin_us,count
+    # followed by one line per histogram: summary,name,count,min_us,max_us
+    @staticmethod
+    def dump(stream=None):
+        _output(stream,'histogram,bin_us,count')
+        for histogram in Instrumentation.histograms():
+            histogram.dump(stream)
+        for histogram in Instrumentation.histograms():
+            _output(stream,'summary,'+histogram.name+','+str(histogram.count)+','+str(histogram.min) \
+                    +','+str(histogram.max))
+
+if __name__ == "__main__":
+    from Instrumentation import Instrumentation # the class used by the control loops
+    from Log import Log
+    from RavenMS import RavenMS
+    from MotionScheduler import MotionScheduler
+    Log.setLevel(Log.OFF)
+    clock=Hal.simulate()
+    Instrumentation.enable(period_us=20000)
+    ravenms=RavenMS()
+    scheduler=MotionScheduler(period_ms=20)
+    for servo in ravenms.lowerBodyServos:
+        scheduler.move(servo,90,duration_ms=1000)
+    while scheduler.moveInProgress():
+        scheduler.update()
+        clock.sleep_ms(1)
+    assert(Instrumentation.period.count>=49)
+    assert(Instrumentation.jitter.max<1000) # ticks on the ms
+    assert(Instrumentation.write.count>=50)
+    # a late tick is recorded as an overrun
+    clock.sleep_ms(70)
+    scheduler.move(ravenms.rightFoot,50,duration_ms=100)
+    scheduler.update()
+    assert(Instrumentation.overrun.count==1 and Instrumentation.overrun.min>=40000)
+    # two loops ticking alternately each measure their own period
+    first=MotionScheduler(period_ms=20)
+    second=MotionScheduler(period_ms=20)
+    Instrumentation.clear()
+    for i in range(10):
+        first.tick()
+        clock.sleep_ms(5)
+        second.tick()
+        clock.sleep_ms(15)
+    assert(Instrumentation.period.count==18)
+    assert(Instrumentation.period.min==20000 and Instrumentation.period.max==20000)
+    Instrumentation.collect()
+    assert(Instrumentation.gc.count==1)
+    Instrumentation.dump()
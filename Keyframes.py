@@ -0,0 +1,176 @@
+# Keyframes.py: Compact keyframe pose tables for servo motions in MicroPython
+# Copyright (C) 2022 Vincent Mistler (YouMakeTech)
+
+from array import array
+from Hal import Hal
+
+# servo current model used by peakCurrent(), typical of MG90S class servos
+SERVO_IDLE_MA=10      # holding a position without load
+SERVO_MAX_DPS=600     # max. speed in degrees/s (0.1s/60 degrees)
+SERVO_MA_PER_DPS=0.4  # additional current per degree/s (250mA at full speed)
+
+class Keyframes:
+    # Keyframes(jointCount,frames)
+    # jointCount is the number of servos driven by each frame
+    # frames is a flat sequence with one row per frame:
+    # jointCount angles in degrees followed by the frame duration in ms
+    def __init__(self,jointCount,frames):
+        rowLength=jointCount+1
+        if len(frames)%rowLength!=0:
+            raise ValueError('Keyframes: expected '+str(rowLength)+' values per frame')
+        frameCount=len(frames)//rowLength
+        self.jointCount=jointCount
+        # frameCount rows of jointCount angles in degrees
+        self.angles=array('f',(frames[frame*rowLength+joint] \
+                               for frame in range(frameCount) for joint in range(jointCount)))
+        # duration of each frame in ms
+        self.durations=array('H',(frames[frame*rowLength+jointCount] for frame in range(frameCount)))
+
+    # n=frameCount()
+    # returns the number of frames in the sequence
+    def frameCount(self):
+        return len(self.durations)
+
+    # angle=getAngle(frame,joint)
+    # returns the angle in degrees of a joint in a frame
+    def getAngle(self,frame,joint):
+        return self.angles[frame*self.jointCount+joint]
+
+    # ms=getDuration(frame)
+    # returns the duration of a frame in ms
+    def getDuration(self,frame):
+        return self.durations[frame]
+
+    # duration_ms=totalDuration()
+    # returns the duration of the whole sequence in ms
+    def totalDuration(self):
+        return sum(self.durations)
+
+    # play(group,delay)
+    # play the whole sequence
+    # group is a ServoGroup of jointCount servos
+    # delay(ms) is called after each frame to hold the pose
+    def play(self,group,delay):
+        row=0
+        for duration in self.durations:
+            group.write(self.angles,row)
+            row+=self.jointCount
+            delay(duration)
+
+    # blend(group,period_ms=20,profile=None)
+    # play the whole sequence with interpolated transitions: during each frame,
+    # the joints move from the previous pose to the pose of the frame
+    # following the motion profile, and reach it at the end of the frame
+    # all the joints share one timebase: the profile is evaluated once
+    # every period_ms and scaled by the distance of each joint
+    # profile is a MotionProfile class (default TriangularMotionProfile)
+    def blend(self,group,period_ms=20,profile=None):
+        if profile is None:
+            from TriangularMotionProfile import TriangularMotionProfile
+            profile=TriangularMotionProfile
+        clock=Hal.clock
+        jointCount=self.jointCount
+        angles=self.angles
+        servos=group.servos
+        startPulses=array('f',(0 for servo in servos)) # previous pose in µs
+        deltaPulses=array('f',(0 for servo in servos)) # distance to the next pose in µs
+        pulses=array('H',(0 for servo in servos))      # pose sent to the servos
+        row=0
+        frameStart=clock.ticks_ms()
+        for duration in self.durations:
+            for i in range(jointCount):
+                servo=servos[i]
+                startPulse=servo.microseconds if servo.enabled else servo.positionToMicroseconds(servo.initialPosition)
+                startPulses[i]=startPulse
+                deltaPulses[i]=servo.positionToMicroseconds(angles[row+i])-startPulse
+            shape=profile(0.0,1.0,duration) # fraction of the transition done
+            frameEnd=clock.ticks_add(frameStart,duration)
+            t=clock.ticks_diff(clock.ticks_ms(),frameStart)
+            while t<duration:
+                fraction=shape.valueAt(t)
+                for i in range(jointCount):
+                    pulses[i]=int(startPulses[i]+deltaPulses[i]*fraction+0.5)
+                group.writeMicroseconds(pulses)
+                wait=clock.ticks_diff(frameEnd,clock.ticks_ms())
+                if wait>0:
+                    clock.sleep_ms(period_ms if wait>period_ms else wait)
+                t=clock.ticks_diff(clock.ticks_ms(),frameStart)
+            for i in range(jointCount):
+                pulses[i]=int(startPulses[i]+deltaPulses[i]+0.5)
+            group.writeMicroseconds(pulses)
+            frameStart=frameEnd
+            row+=jointCount
+
+    # mA=peakCurrent(profile=False,samples=100)
+    # estimates the peak current drawn by all the servos together during the sequence
+    # each servo draws SERVO_IDLE_MA plus SERVO_MA_PER_DPS per degree/s of joint speed
+    # profile=False: the poses are snapped by play(), the moving joints
+    # all start together at SERVO_MAX_DPS
+    # otherwise the poses are interpolated by blend() with the profile
+    # (None for TriangularMotionProfile), whose steepest slope is found
+    # by sampling it at samples points per frame
+    # the sequence is assumed to start from its first pose
+    def peakCurrent(self,profile=False,samples=100):
+        if profile is None:
+            from TriangularMotionProfile import TriangularMotionProfile
+            profile=TriangularMotionProfile
+        jointCount=self.jointCount
+        angles=self.angles
+        peak=0.0
+        row=0
+        previous=0
+        for duration in self.durations:
+            if profile is not False and duration>0:
+                # max. fraction of the transition done per second
+                shape=profile(0.0,1.0,duration)
+                maxSlope=0.0
+                value=0.0
+                for k in range(1,samples+1):
+                    t=k*duration/samples
+                    nextValue=shape.valueAt(t) if t<duration else 1.0
+                    slope=(nextValue-value)*samples*1000/duration
+                    if slope>maxSlope:
+                        maxSlope=slope
+                    value=nextValue
+            current=0.0
+            for i in range(jointCount):
+                distance=abs(angles[row+i]-angles[previous+i])
+                speed=0.0
+                if distance>0:
+                    speed=SERVO_MAX_DPS
+                    if profile is not False and duration>0 and distance*maxSlope<speed:
+                        speed=distance*maxSlope
+                current+=SERVO_IDLE_MA+SERVO_MA_PER_DPS*speed
+            if current>peak:
+                peak=current
+            previous=row
+            row+=jointCount
+        return int(peak+0.5)
+
+if __name__ == "__main__":
+    from Log import Log
+    from Servo import Servo
+    from ServoGroup import ServoGroup
+    Log.setLevel(Log.OFF)
+    clock=Hal.simulate()
+    servos=[Servo(0,initialPosition=0),Servo(1,initialPosition=180)]
+    keyframes=Keyframes(2,(
+        180,  0, 400,
+        180,  0, 100,
+    ))
+    start_us=clock.ticks_us()
+    keyframes.blend(ServoGroup(servos),period_ms=20)
+    assert(clock.ticks_us()-start_us==500000)
+    # the two joints cross at mid-move, at the same time
+    timeline0=servos[0].pin.timeline
+    timeline1=servos[1].pin.timeline
+    for k in range(len(timeline0)):
+        if timeline0[k][0]==start_us+200000:
+            assert(timeline0[k][1]==timeline1[k][1]==1520000)
+    assert(servos[0].readMicroseconds()==2400 and servos[1].readMicroseconds()==640)
+    # blending lowers the peak current
+    keyframes=Keyframes(2,(
+          0,180, 100,
+        180,  0,1000,
+    ))
+    assert(keyframes.peakCurrent(None)<keyframes.peakCurrent())
@@ -0,0 +1,196 @@
+# LegKinematics.py: Forward and inverse kinematics of the Raven MS legs in MicroPython
+# Copyright (C) 2022 Vincent Mistler (YouMakeTech)
+#
+# Each leg is a chain hip / upper leg / lower leg / foot:
+# the hip rolls the leg sideways, the upper leg (thigh) and the lower leg (knee)
+# pitch it forward and backward, and the foot rolls back such that the sole
+# stays parallel to the ground. All the angles are 0 for the standing pose
+# of the robot (the initial position of the servos), the leg being straight.
+#
+# The foot position is given relative to the hip in mm:
+# x forward, y to the right of the robot, z down (x=0,y=0,z=legLength when standing)
+#
+# >>> leg=Leg(ravenms.rightHip,ravenms.rightUpperLeg,ravenms.rightLowerLeg,ravenms.rightFoot,Leg.RIGHT)
+# >>> angles=leg.inverse(20,10,80)     # servo angles (hip,upperLeg,lowerLeg,foot) or None
+# >>> leg.moveFoot(20,10,80)           # same, and write the angles to the servos
+#
+# The solutions are memoized in a bounded cache keyed on the target quantized
+# to resolution mm, such that the repeated cycles of a gait cost a dictionary lookup.
+
+from math import sqrt, atan2, acos, sin, cos, degrees, radians
+from array import array
+
+_KEY_OFFSET=512 # quantized coordinates from -512 to 511 steps
+_KEY_BITS=10
+
+class Leg:
+    RIGHT=1
+    LEFT=-1
+
+    # Leg(hip,upperLeg,lowerLeg,foot,side,thighLength=45,shankLength=45,resolution=0.5,cacheSize=64)
+    # hip, upperLeg, lowerLeg and foot are the 4 servos of the chain
+    # side is Leg.RIGHT or Leg.LEFT: the pitch servos of the left leg are mirrored
+    # thighLength and shankLength are the lengths of the upper and lower leg in mm
+    # resolution is the quantization of the targets in mm
+    # cacheSize is the max. number of memoized solutions
+    def __init__(self,hip,upperLeg,lowerLeg,foot,side,thighLength=45,shankLength=45,resolution=0.5,cacheSize=64):
+        self.servos=(hip,upperLeg,lowerLeg,foot)
+        self.thighLength=thighLength
+        self.shankLength=shankLength
+        self.resolution=resolution
+        # servo angle=neutral+sign*joint angle
+        self._neutral=array('f',(servo.initialPosition for servo in self.servos))
+        self._signs=(1,-side,side,-1)
+
+        # cache of the solutions: key -> tuple of servo angles or None
+        self._cache={}
+        self._keys=[-1]*cacheSize # keys in the order of insertion, to evict the oldest
+        self._next=0
+        self.hits=0
+        self.misses=0
+
+    # (x,y,z)=forward(angles)
+    # returns the position of the foot for the servo angles (hip,upperLeg,lowerLeg,foot)
+    def forward(self,angles):
+        neutral=self._neutral
+        signs=self._signs
+        roll=radians((angles[0]-neutral[0])*signs[0])
+        thigh=radians((angles[1]-neutral[1])*signs[1])
+        knee=radians((angles[2]-neutral[2])*signs[2])
+        x=self.thighLength*sin(thigh)+self.shankLength*sin(thigh-knee)
+        d=self.thighLength*cos(thigh)+self.shankLength*cos(thigh-knee) # along the leg plane
+        return (x,d*sin(roll),d*cos(roll))
+
+    # angles=inverse(x,y,z)
+    # returns the servo angles (hip,upperLeg,lowerLeg,foot) placing the foot at x,y,z
+    # or None if the target is out of reach or requires a servo beyond
+    # its positionMin or positionMax
+    # the target is quantized to resolution mm and the solution memoized
+    def inverse(self,x,y,z):
+        resolution=self.resolution
+        qx=int(x/resolution+(0.5 if x>=0 else -0.5))
+        qy=int(y/resolution+(0.5 if y>=0 else -0.5))
+        qz=int(z/resolution+(0.5 if z>=0 else -0.5))
+        if qx<-_KEY_OFFSET or qx>=_KEY_OFFSET or qy<-_KEY_OFFSET or qy>=_KEY_OFFSET \
+           or qz<-_KEY_OFFSET or qz>=_KEY_OFFSET:
+            return self._solve(qx*resolution,qy*resolution,qz*resolution)
+        key=(((qx+_KEY_OFFSET)<<_KEY_BITS|(qy+_KEY_OFFSET))<<_KEY_BITS)|(qz+_KEY_OFFSET)
+        cache=self._cache
+        if key in cache:
+            self.hits+=1
+            return cache[key]
+        self.misses+=1
+        angles=self._solve(qx*resolution,qy*resolution,qz*resolution)
+        keys=self._keys
+        oldest=keys[self._next]
+        if oldest>=0:
+            del cache[oldest]
+        keys[self._next]=key
+        self._next=(self._next+1)%len(keys)
+        cache[key]=angles
+        return angles
+
+    # success=moveFoot(x,y,z)
+    # move the foot to x,y,z and return True, or return False if the target
+    # cannot be reached (the servos do not move)
+    def moveFoot(self,x,y,z):
+        angles=self.inverse(x,y,z)
+        if angles is None:
+            return False
+        i=0
+        for servo in self.servos:
+            servo.write(angles[i])
+            i+=1
+        return True
+
+    # clearCache()
+    # forget the memoized solutions, e.g. after changing the leg lengths
+    def clearCache(self):
+        self._cache={}
+        self._keys=[-1]*len(self._keys)
+        self._next=0
+
+    # analytic solution: roll in the y-z plane, then 2-link planar chain
+    def _solve(self,x,y,z):
+        l1=self.thighLength
+        l2=self.shankLength
+        roll=atan2(y,z)
+        d=sqrt(y*y+z*z)
+        r2=x*x+d*d
+        c=(r2-l1*l1-l2*l2)/(2*l1*l2)
+        if c>1 or c<-1:
+            return None # out of reach
+        knee=acos(c)
+        thigh=atan2(x,d)+atan2(l2*sin(knee),l1+l2*cos(knee))
+        joints=(degrees(roll),degrees(thigh),degrees(knee),-degrees(roll))
+        neutral=self._neutral
+        signs=self._signs
+        angles=[]
+        for i in range(4):
+            angle=neutral[i]+signs[i]*joints[i]
+            servo=self.servos[i]
+            if angle<servo.positionMin-1e-3 or angle>servo.positionMax+1e-3:
+                return None # beyond the limits of the servo
+            angles.append(angle)
+        return tuple(angles)
+
+# benchmark(iterations)
+# measures the time of an inverse kinematics solution, computed and cached
+def benchmark(iterations=1000):
+    from Hal import Hal
+    from Log import Log
+    from RavenMS import RavenMS
+    level=Log.level
+    Log.setLevel(Log.OFF)
+    ravenms=RavenMS(lazy=True)
+    leg=ravenms.rightLeg
+    targets=[(10*sin(i/10),5+5*cos(i/10),80) for i in range(63)] # one gait cycle
+    for cached in (False,True):
+        t0=Hal.clock.ticks_us()
+        for k in range(iterations):
+            x,y,z=targets[k%len(targets)]
+            if cached:
+                leg.inverse(x,y,z)
+            else:
+                leg._solve(x,y,z)
+        elapsed=Hal.clock.ticks_diff(Hal.clock.ticks_us(),t0)
+        print('Leg.inverse '+('cached' if cached else 'computed')+': '+str(int(1000*elapsed/iterations))+' ns/call')
+    Log.setLevel(level)
+
+if __name__ == "__main__":
+    from Hal import Hal
+    from Log import Log
+    from RavenMS import RavenMS
+    Log.setLevel(Log.OFF)
+    hostClock=Hal.clock
+    Hal.simulate()
+    ravenms=RavenMS()
+    for leg in (ravenms.rightLeg,ravenms.leftLeg):
+        # standing: straight leg under the hip
+        legLength=leg.thighLength+leg.shankLength
+        stand=leg.inverse(0,0,legLength)
+        for i in range(4):
+            assert(abs(stand[i]-leg.servos[i].initialPosition)<1e-3)
+        # inverse then forward returns the (quantized) target
+        # the hips only roll inwards (see their position limits)
+        side=1 if leg is ravenms.rightLeg else -1
+        for x,y,z in ((10,5,80),(-5.5,10,75),(20,2,70)):
+            target=(x,side*y,z)
+            angles=leg.inverse(*target)
+            assert(angles is not None)
+            position=leg.forward(angles)
+            for i in range(3):
+                assert(abs(position[i]-target[i])<1e-3)
+        assert(leg.inverse(0,0,legLength+1) is None) # out of reach
+    # the hip of the left leg cannot roll outwards beyond positionMax
+    assert(ravenms.leftLeg.inverse(0,20,80) is None)
+    # the cache holds the repeated targets
+    leg=ravenms.rightLeg
+    hits=leg.hits
+    leg.inverse(10,5,80)
+    leg.inverse(10.1,5,80) # same quantized target
+    assert(leg.hits==hits+2)
+    assert(leg.moveFoot(10,5,80))
+    assert(ravenms.rightHip.read()!=ravenms.rightHip.initialPosition)
+    Hal.setClock(hostClock)
+    benchmark()
@@ -0,0 +1,139 @@
+# Log.py: Level-controlled trace and ring-buffered event log in MicroPython
+# Copyright (C) 2022 Vincent Mistler (YouMakeTech)
+#
+# Printing over USB serial is slow and every message allocates strings.
+# Call sites test Log.level before building a message, such that
+# nothing is built or printed when the level is lowered:
+#     if Log.level>=Log.DEBUG:
+#         print('Servo.write('+str(angle)+')')
+# Clamped writes and calibration changes can also be recorded
+# in a preallocated ring buffer and dumped after the motion:
+# >>> from Log import Log
+# >>> Log.setLevel(Log.OFF)
+# >>> Log.enableEvents(64)
+# >>> ravenms.walk()
+# >>> Log.dump()
+
+from array import array
+from Hal import Hal
+
+class Log:
+    # trace levels
+    OFF=0     # no trace at all (fast path)
+    WARNING=1 # clamped writes
+    INFO=2    # high-level commands such as RavenMS.walk()
+    DEBUG=3   # every servo write and delay
+    level=DEBUG # current trace level
+
+    # event kinds
+    CLAMP_MIN=1        # write() limited to positionMin, value=requested angle
+    CLAMP_MAX=2        # write() limited to positionMax, value=requested angle
+    TRIM=3             # trim(), value=trim in µs
+    SERVO_MIN=4        # setServoMin(), value=pulse width in µs
+    SERVO_MAX=5        # setServoMax(), value=pulse width in µs
+    SERVO_CENTER=6     # setServoCenter(), value=pulse width in µs
+    RESTORE_DEFAULTS=7 # restoreDefaults(), value=0
+    _EVENT_NAMES=('','clampMin','clampMax','trim','servoMin','servoMax','servoCenter','restoreDefaults')
+
+    events=False # True when the event log is enabled
+
+    # internal variables: one entry per event in each array
+    _times=None  # Hal.clock.ticks_ms() of the event
+    _kinds=None  # event kind
+    _ids=None    # GPIO pin of the servo
+    _values=None # event value
+    _next=0      # index of the next entry to write
+    _count=0     # number of valid entries
+
+    # setLevel(level)
+    # set the trace level: Log.OFF, Log.WARNING, Log.INFO or Log.DEBUG
+    @staticmethod
+    def setLevel(level):
+        Log.level=level
+
+    # enableEvents(size=64)
+    # allocate a ring buffer for the last size events and start recording
+    @staticmethod
+    def enableEvents(size=64):
+        Log._times=array('I',(0 for i in range(size)))
+        Log._kinds=array('B',(0 for i in range(size)))
+        Log._ids=array('B',(0 for i in range(size)))
+        Log._values=array('f',(0 for i in range(size)))
+        Log.clear()
+        Log.events=True
+
+    # disableEvents()
+    # stop recording events and free the ring buffer
+    @staticmethod
+    def disableEvents():
+        Log.events=False
+        Log._times=None
+        Log._kinds=None
+        Log._ids=None
+        Log._values=None
+        Log.clear()
+
+    # clear()
+    # forget all the recorded events
+    @staticmethod
+    def clear():
+        Log._next=0
+        Log._count=0
+
+    # event(kind,id,value)
+    # record an event, overwriting the oldest one when the buffer is full
+    # does not allocate memory, call only when Log.events is True
+    @staticmethod
+    def event(kind,id,value):
+        i=Log._next
+        Log._times[i]=Hal.clock.ticks_ms()
+        Log._kinds[i]=kind
+        Log._ids[i]=id
+        Log._values[i]=value
+        i+=1
+        if i==len(Log._kinds):
+            i=0
+        Log._next=i
+        if Log._count<len(Log._kinds):
+            Log._count+=1
+
+    # n=eventCount()
+    # returns the number of events in the buffer
+    @staticmethod
+    def eventCount():
+        return Log._count
+
+    # (time_ms,kind,id,value)=getEvent(i)
+    # returns the i-th event in the buffer, 0 being the oldest one
+    @staticmethod
+    def getEvent(i):
+        j=(Log._next-Log._count+i)%len(Log._kinds)
+        return (Log._times[j],Log._kinds[j],Log._ids[j],Log._values[j])
+
+    # dump()
+    # print the recorded events, oldest first, one per line:
+    # time_ms,servo,event,value
+    @staticmethod
+    def dump():
+        print('time_ms,servo,event,value')
+        for i in range(Log._count):
+            event=Log.getEvent(i)
+            print(str(event[0])+','+str(event[2])+','+Log._EVENT_NAMES[event[1]]+','+str(event[3]))
+
+if __name__ == "__main__":
+    Log.enableEvents(4)
+    assert(Log.eventCount()==0)
+    Log.event(Log.CLAMP_MIN,3,-10)
+    Log.event(Log.TRIM,3,50)
+    assert(Log.eventCount()==2)
+    assert(Log.getEvent(0)[1]==Log.CLAMP_MIN)
+    assert(Log.getEvent(1)[3]==50)
+    # the oldest events are overwritten when the buffer is full
+    for i in range(5):
+        Log.event(Log.CLAMP_MAX,i,200+i)
+    assert(Log.eventCount()==4)
+    assert(Log.getEvent(0)[2]==1)
+    assert(Log.getEvent(3)[2]==4)
+    Log.dump()
+    Log.disableEvents()
+    assert(Log.events==False)
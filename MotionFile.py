@@ -0,0 +1,175 @@
+# MotionFile.py: Binary motion files streamed from flash in MicroPython
+# Copyright (C) 2022 Vincent Mistler (YouMakeTech)
+#
+# A motion file holds a keyframe sequence like the tables of RavenMS.py,
+# but stays on flash: MotionFileReader reads a few frames at a time into
+# a small reusable buffer, so a choreography much longer than the RAM
+# can be played.
+#
+# >>> writeMotionFile('walk.motion',WALK,[0,1,2,3,4,5,6,7,9,10]) # on the PC (see motionConvert.py)
+# ...
+# >>> reader=MotionFileReader('walk.motion')
+# >>> reader.play(ravenms.lowerBodyGroup)
+# >>> reader.close()
+#
+# File format (little-endian, as on the RP2040):
+#     4 bytes  magic b'MOTN'
+#     1 byte   format version (1)
+#     1 byte   number of joints
+#     2 bytes  angle scale: the angles are stored in 1/scale degrees
+#     4 bytes  number of frames
+#     joint map: one byte per joint, the id of its servo
+#     then fixed-size frames: one unsigned 16-bit angle per joint
+#     followed by the unsigned 16-bit duration of the frame in ms
+
+from array import array
+import struct
+from Hal import Hal
+
+_MAGIC=b'MOTN'
+_VERSION=1
+_HEADER='<4sBBHI'
+_HEADER_SIZE=12
+ANGLE_SCALE=100 # angles stored in 1/100 degree
+
+# writeMotionFile(filename,keyframes,servoIds)
+# write a Keyframes sequence to a motion file
+# servoIds[i] is the id of the servo driven by the i-th joint of the frames
+def writeMotionFile(filename,keyframes,servoIds):
+    jointCount=keyframes.jointCount
+    if len(servoIds)!=jointCount:
+        raise ValueError('writeMotionFile: expected '+str(jointCount)+' servo ids')
+    frameCount=keyframes.frameCount()
+    with open(filename,'wb') as f:
+        f.write(struct.pack(_HEADER,_MAGIC,_VERSION,jointCount,ANGLE_SCALE,frameCount))
+        f.write(bytes(servoIds))
+        frame=array('H',(0 for i in range(jointCount+1)))
+        for k in range(frameCount):
+            for joint in range(jointCount):
+                frame[joint]=int(keyframes.getAngle(k,joint)*ANGLE_SCALE+0.5)
+            frame[jointCount]=keyframes.getDuration(k)
+            f.write(struct.pack('<'+str(jointCount+1)+'H',*frame))
+
+class MotionFileReader:
+    # MotionFileReader(filename,chunkFrames=16)
+    # open a motion file; chunkFrames frames are read from the file at once
+    def __init__(self,filename,chunkFrames=16):
+        self._file=open(filename,'rb')
+        magic,version,jointCount,angleScale,frameCount=struct.unpack(_HEADER,self._file.read(_HEADER_SIZE))
+        if magic!=_MAGIC or version!=_VERSION:
+            self._file.close()
+            raise ValueError('MotionFileReader: '+filename+' is not a version '+str(_VERSION)+' motion file')
+        self.jointCount=jointCount
+        self.frameCount=frameCount
+        self.angleScale=angleScale
+        self.servoIds=self._file.read(jointCount) # joint map
+        self._dataStart=_HEADER_SIZE+jointCount
+        self._rowLength=jointCount+1
+        # reusable buffer of chunkFrames frames, filled by readinto()
+        self._chunk=array('H',(0 for i in range(chunkFrames*self._rowLength)))
+        self._chunkFrames=chunkFrames
+
+    # close()
+    # close the motion file
+    def close(self):
+        self._file.close()
+
+    # ms=totalDuration()
+    # returns the duration of the whole sequence in ms (reads the whole file)
+    def totalDuration(self):
+        duration=0
+        chunk=self._chunk
+        remaining=self.frameCount
+        self._file.seek(self._dataStart)
+        while remaining>0:
+            n=self._read(remaining)
+            for k in range(n):
+                duration+=chunk[k*self._rowLength+self.jointCount]
+            remaining-=n
+        return duration
+
+    # play(group)
+    # play the whole sequence on the servos of a ServoGroup
+    # the group must contain the servos of the joint map, in any order;
+    # its other servos hold their position
+    # the next chunk is read from flash while the last frame of the current chunk
+    # is held, and the frame times are kept on a deadline such that the
+    # reads do not delay the motion
+    def play(self,group):
+        clock=Hal.clock
+        jointCount=self.jointCount
+        rowLength=self._rowLength
+        scale=self.angleScale
+        chunk=self._chunk
+        # position in the group of the servo of each joint
+        order=[]
+        for id in self.servoIds:
+            for i in range(len(group)):
+                if group[i].id==id:
+                    order.append(i)
+                    break
+            else:
+                raise ValueError('MotionFileReader: no servo '+str(id)+' in the group')
+        pose=array('f',group.read())
+        remaining=self.frameCount
+        self._file.seek(self._dataStart)
+        n=self._read(remaining)
+        k=0
+        deadline=clock.ticks_ms()
+        while n>0:
+            base=k*rowLength
+            for joint in range(jointCount):
+                pose[order[joint]]=chunk[base+joint]/scale
+            group.write(pose)
+            deadline=clock.ticks_add(deadline,chunk[base+jointCount])
+            k+=1
+            if k==n:
+                remaining-=n
+                n=self._read(remaining)
+                k=0
+            wait=clock.ticks_diff(deadline,clock.ticks_ms())
+            if wait>0:
+                clock.sleep_ms(wait)
+
+    # read up to chunkFrames of the remaining frames into the chunk buffer
+    # returns the number of frames read
+    def _read(self,remaining):
+        if remaining<=0:
+            return 0
+        frames=self._chunkFrames if remaining>self._chunkFrames else remaining
+        if frames==self._chunkFrames:
+            count=self._file.readinto(self._chunk)
+        else:
+            count=self._file.readinto(memoryview(self._chunk)[:frames*self._rowLength])
+        if count!=2*frames*self._rowLength:
+            raise ValueError('MotionFileReader: truncated motion file')
+        return frames
+
+if __name__ == "__main__":
+    import os
+    from Log import Log
+    from RavenMS import RavenMS, WALK
+    from Servo import Servo
+    Log.setLevel(Log.OFF)
+    clock=Hal.simulate()
+    ravenms=RavenMS()
+    group=ravenms.lowerBodyGroup
+    writeMotionFile('walk.motion',WALK,[servo.id for servo in group])
+    assert(os.stat('walk.motion')[6]==_HEADER_SIZE+10+WALK.frameCount()*11*2)
+
+    # streamed by chunks of 4 frames: same pulses at the same times as RavenMS.walk()
+    reader=MotionFileReader('walk.motion',chunkFrames=4)
+    assert(reader.totalDuration()==WALK.totalDuration())
+    foot=ravenms.rightFoot
+    Servo.deduplicate=False # one pulse width per frame
+    timeline=foot.pin.timeline
+    first=len(timeline)
+    start_us=clock.ticks_us()
+    reader.play(group)
+    assert(clock.ticks_us()-start_us==1000*WALK.totalDuration())
+    t=start_us
+    for frame in range(WALK.frameCount()):
+        assert(timeline[first+frame]==(t,1000*foot.positionToMicroseconds(WALK.getAngle(frame,0))))
+        t+=1000*WALK.getDuration(frame)
+    reader.close()
+    os.remove('walk.motion')
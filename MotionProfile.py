@@ -0,0 +1,173 @@
+# MotionProfile.py: Base class of the motion profile generators in MicroPython
+# Used to smooth servo motions and trajectories
+# Copyright (C) 2022 Vincent Mistler (YouMakeTech)
+#
+# A motion profile moves a value from startValue to endValue in duration_ms.
+# MotionProfile itself moves it at constant speed (linear interpolation).
+# Subclasses precompute their coefficients in their constructor and
+# override valueAt(t) for 0<=t<duration_ms, t being the time in ms
+# since the beginning of the move, with a few multiply-adds.
+
+from Hal import Hal
+
+class MotionProfile:
+    def __init__(self,startValue,endValue,duration_ms):
+
+        # internal variables
+        self._startValue=startValue
+        self._endValue=endValue
+        self._duration_ms=duration_ms
+        self._slope=(endValue-startValue)/duration_ms if duration_ms>0 else 0 # of the linear move
+        self._currentValue=startValue
+        self._currentTime=Hal.clock.ticks_ms()
+        self._startTime=self._currentTime
+        self._moveInProgress=True
+
+    # Returns the current position for the move
+    # should be called as frequently as possible after
+    # creating the profile object and
+    # until moveInProgress() returns False
+    # currentTime is an optional Hal.clock.ticks_ms() timestamp, allowing
+    # several profiles to be evaluated at the same instant
+    def getValue(self,currentTime=None):
+        if currentTime is None:
+            currentTime=Hal.clock.ticks_ms()
+        self._currentTime=currentTime
+        t=Hal.clock.ticks_diff(currentTime,self._startTime)
+
+        if t<0:
+            self._currentValue=self._startValue
+            self._moveInProgress=False
+        elif t<self._duration_ms:
+            self._currentValue=self.valueAt(t)
+            self._moveInProgress=True
+        else:
+            self._currentValue=self._endValue
+            self._moveInProgress=False
+        return self._currentValue
+
+    # value=valueAt(t)
+    # returns the value t ms after the beginning of the move, for 0<=t<duration_ms
+    # linear from startValue to endValue, overridden by the subclasses
+    def valueAt(self,t):
+        return self._startValue+self._slope*t
+
+    def moveInProgress(self):
+        return self._moveInProgress
+
+    # duration_ms=duration()
+    # returns the duration of the move in ms
+    def duration(self):
+        return self._duration_ms
+
+    # n=sample(buffer,period_ms,start_ms=0)
+    # sample the whole move in one call, without waiting for it
+    # buffer[i] receives the value at start_ms+i*period_ms (ms since the beginning
+    # of the move): the start value before the move, the end value after it
+    # buffer is a preallocated array('f'), or an integer array such as array('H')
+    # in which case the values are rounded to the nearest integer
+    # returns the number of samples written, i.e. len(buffer)
+    def sample(self,buffer,period_ms,start_ms=0):
+        n=len(buffer)
+        if n==0:
+            return 0
+        integer=MotionProfile._isIntegerArray(buffer)
+        duration=self._duration_ms
+        valueAt=self.valueAt
+        t=start_ms
+        for i in range(n):
+            if t<0:
+                value=self._startValue
+            elif t<duration:
+                value=valueAt(t)
+            else:
+                value=self._endValue
+            if integer:
+                value=int(value+0.5)
+            buffer[i]=value
+            t+=period_ms
+        return n
+
+    # n=sampleTimes(times,buffer)
+    # same as sample() at arbitrary times: buffer[i] receives the value
+    # at times[i] ms since the beginning of the move
+    def sampleTimes(self,times,buffer):
+        n=len(times)
+        if n==0:
+            return 0
+        integer=MotionProfile._isIntegerArray(buffer)
+        duration=self._duration_ms
+        valueAt=self.valueAt
+        for i in range(n):
+            t=times[i]
+            if t<0:
+                value=self._startValue
+            elif t<duration:
+                value=valueAt(t)
+            else:
+                value=self._endValue
+            if integer:
+                value=int(value+0.5)
+            buffer[i]=value
+        return n
+
+    # MicroPython arrays have no typecode: integer arrays reject floats
+    # the probe is written into a one-element copy, not into the buffer
+    @staticmethod
+    def _isIntegerArray(buffer):
+        if len(buffer)==0:
+            return False
+        scratch=buffer[0:1]
+        try:
+            scratch[0]=0.5
+        except TypeError:
+            return True
+        return False
+
+    def plot(self):
+        t0=Hal.clock.ticks_ms()
+        while self.moveInProgress():
+            print(str(Hal.clock.ticks_ms()-t0)+','+str(self.getValue()))
+            Hal.clock.sleep_ms(20)
+
+# benchmark(samples)
+# measures the number of samples per second computed by sample()
+# for each profile, in float and integer buffers
+def benchmark(samples=1000):
+    from array import array
+    from TriangularMotionProfile import TriangularMotionProfile
+    from TrapezoidalMotionProfile import TrapezoidalMotionProfile
+    from SCurveMotionProfile import SCurveMotionProfile
+    floats=array('f',(0 for i in range(samples)))
+    integers=array('H',(0 for i in range(samples)))
+    for profile in (TriangularMotionProfile,TrapezoidalMotionProfile,SCurveMotionProfile):
+        trajectory=profile(500,2500,samples)
+        for buffer in (floats,integers):
+            t0=Hal.clock.ticks_us()
+            trajectory.sample(buffer,1)
+            elapsed=Hal.clock.ticks_diff(Hal.clock.ticks_us(),t0)
+            print(profile.__name__+(' float: ' if buffer is floats else ' integer: ') \
+                  +str(int(samples*1000000/elapsed))+' samples/s')
+
+if __name__ == "__main__":
+    from array import array
+    from TriangularMotionProfile import TriangularMotionProfile
+    trajectory=TriangularMotionProfile(500,2500,500)
+    buffer=array('H',(0 for i in range(27)))
+    assert(trajectory.sample(buffer,20,start_ms=-10)==27)
+    assert(buffer[0]==500)   # before the move
+    assert(buffer[13]==1500) # t=250ms, half way
+    assert(buffer[26]==2500) # after the move
+    times=array('f',(0,125,250,375,500))
+    values=array('f',(0 for i in range(5)))
+    trajectory.sampleTimes(times,values)
+    assert(values[2]==1500)
+    assert(values[1]+values[3]==3000) # symmetrical profile
+    # the type of the buffer is found without writing into it
+    values=array('f',(7,))
+    assert(not MotionProfile._isIntegerArray(values) and values[0]==7)
+    assert(MotionProfile._isIntegerArray(array('H',(7,))))
+    assert(trajectory.sampleTimes(array('f'),array('f'))==0)
+    linear=MotionProfile(500,2500,500)
+    assert(linear.valueAt(0)==500 and linear.valueAt(125)==1000 and linear.valueAt(250)==1500)
+    benchmark()
@@ -0,0 +1,182 @@
+# MotionScheduler.py: Non-blocking motion scheduler for several servos in MicroPython
+# Moves many servos together from a single fixed-rate tick
+# Copyright (C) 2022 Vincent Mistler (YouMakeTech)
+
+from Hal import Hal
+from TriangularMotionProfile import TriangularMotionProfile
+from Instrumentation import Instrumentation
+
+class MotionScheduler:
+    def __init__(self,period_ms=20):
+        self.period_ms=period_ms # time between two ticks in ms (20ms=50Hz)
+
+        # internal variables
+        self._servos=[]       # servos with a move in progress
+        self._trajectories=[] # motion profile of each servo in self._servos
+        self._nextTick=Hal.clock.ticks_ms()
+        self._lastTick=-1 # ticks_us() of the previous tick, for Instrumentation
+        self._timer=None
+        self._timerCallback=self._onTimer # bound once to avoid allocating in the callback
+
+    # move(servo,angle,duration_ms=500,profile=TriangularMotionProfile)
+    # start moving a servo to the specified angle and return immediately
+    # the move is performed by the next calls to tick() or update()
+    # a move already in progress on the same servo is replaced
+    # profile is the motion profile class, e.g. TrapezoidalMotionProfile or SCurveMotionProfile
+    def move(self,servo,angle,duration_ms=500,profile=TriangularMotionProfile):
+        if not servo.enabled and servo._lazy:
+            servo.write(servo.initialPosition) # start from a known position
+        if servo.enabled:
+            microseconds=servo.angleToMicroseconds(angle)
+            self.follow(servo,profile(servo.microseconds,microseconds,duration_ms))
+
+    # follow(servo,trajectory)
+    # start moving a servo along a motion profile of pulse widths in µs
+    # e.g. a profile whose duration is derived from velocity and acceleration limits:
+    # >>> scheduler.follow(servo,TrapezoidalMotionProfile(servo.readMicroseconds(),2000, \
+    # ...                  maxVelocity=5,maxAcceleration=0.05))
+    def follow(self,servo,trajectory):
+        if servo.enabled:
+            # the timer of start() must not tick between the updates of the two lists
+            state=Hal.disable_irq()
+            for i in range(len(self._servos)):
+                if self._servos[i] is servo:
+                    self._trajectories[i]=trajectory
+                    Hal.enable_irq(state)
+                    return
+            self._servos.append(servo)
+            self._trajectories.append(trajectory)
+            Hal.enable_irq(state)
+
+    # stop(servo=None)
+    # abort the move of a servo, or of all servos when servo is None
+    # the servos hold their last commanded position
+    def stop(self,servo=None):
+        state=Hal.disable_irq() # see follow()
+        if servo is None:
+            self._servos=[]
+            self._trajectories=[]
+        else:
+            for i in range(len(self._servos)):
+                if self._servos[i] is servo:
+                    self._servos.pop(i)
+                    self._trajectories.pop(i)
+                    break
+        Hal.enable_irq(state)
+
+    # moveInProgress(servo=None)
+    # returns True while the servo (or any servo when servo is None) is moving
+    def moveInProgress(self,servo=None):
+        if servo is None:
+            return len(self._servos)>0
+        for ithServo in self._servos:
+            if ithServo is servo:
+                return True
+        return False
+
+    # tick()
+    # advance all the moves in progress by one step
+    # all profiles are evaluated at the same instant
+    def tick(self):
+        if Instrumentation.enabled:
+            self._lastTick=Instrumentation.tick(self._lastTick)
+        currentTime=Hal.clock.ticks_ms()
+        i=len(self._servos)-1
+        while i>=0:
+            trajectory=self._trajectories[i]
+            self._servos[i].writeMicroseconds(int(trajectory.getValue(currentTime)))
+            if not trajectory.moveInProgress():
+                self._servos.pop(i)
+                self._trajectories.pop(i)
+            i-=1
+
+    # ticked=update()
+    # call as often as possible from the main loop
+    # performs a tick when period_ms has elapsed since the previous one
+    # and returns True if a tick was performed
+    def update(self):
+        now=Hal.clock.ticks_ms()
+        if Hal.clock.ticks_diff(now,self._nextTick)<0:
+            return False
+        late=Hal.clock.ticks_diff(now,self._nextTick)
+        self._nextTick=Hal.clock.ticks_add(self._nextTick,self.period_ms)
+        if Hal.clock.ticks_diff(now,self._nextTick)>=0:
+            # we are late by more than one period: skip the missed ticks
+            if Instrumentation.enabled:
+                Instrumentation.late(1000*late)
+            self._nextTick=Hal.clock.ticks_add(now,self.period_ms)
+        self.tick()
+        return True
+
+    # start(timerId=-1)
+    # tick automatically from a periodic hardware timer
+    # the main program keeps running while the servos move
+    def start(self,timerId=-1):
+        self.stopTimer()
+        self._timer=Hal.Timer(timerId)
+        self._timer.init(mode=Hal.Timer.PERIODIC,period=self.period_ms,callback=self._timerCallback)
+
+    # stopTimer()
+    # stop ticking from the hardware timer started by start()
+    def stopTimer(self):
+        if self._timer is not None:
+            self._timer.deinit()
+            self._timer=None
+
+    def _onTimer(self,timer):
+        self.tick()
+
+# benchmark(servoCounts,ticks)
+# measures the average duration of a tick for several numbers of servos
+# and prints the maximum tick rate and the maximum number of servos
+# that can be driven at 50Hz and 100Hz
+def benchmark(servoCounts=(1,5,10,16,21),ticks=200):
+    from Servo import Servo
+    from servoBenchmark import BenchmarkPWM
+    print('servos,tick_us,max_rate_Hz,max_servos_50Hz,max_servos_100Hz')
+    for servoCount in servoCounts:
+        servos=[]
+        for i in range(servoCount):
+            servo=Servo(i) # GP16 to GP20 are multiplexed with GP0 to GP4
+            servo.pin=BenchmarkPWM() # measure the scheduler, not the hardware
+            servos.append(servo)
+        scheduler=MotionScheduler()
+        for servo in servos:
+            # long moves such that all servos move during the whole benchmark
+            scheduler.move(servo,180,duration_ms=3600000)
+        t0=Hal.clock.ticks_us()
+        for i in range(ticks):
+            scheduler.tick()
+        tick_us=Hal.clock.ticks_diff(Hal.clock.ticks_us(),t0)/ticks
+        servo_us=tick_us/servoCount
+        print(str(servoCount)+','+str(int(tick_us))+','+str(int(1000000/tick_us))+',' \
+              +str(int(20000/servo_us))+','+str(int(10000/servo_us)))
+        for servo in servos:
+            servo.detach()
+
+if __name__ == "__main__":
+    from Servo import Servo
+
+    # Move two servos together while the main program keeps running
+    servo0=Servo(0)
+    servo1=Servo(1)
+    scheduler=MotionScheduler(period_ms=20)
+    scheduler.move(servo0,0,duration_ms=1000)
+    scheduler.move(servo1,180,duration_ms=500)
+    while scheduler.moveInProgress():
+        scheduler.update()
+        Hal.clock.sleep_ms(1) # other work can be done here
+    assert(servo0.readMicroseconds()==640)
+    assert(servo1.readMicroseconds()==2400)
+
+    # Same moves ticked from a hardware timer
+    scheduler.start()
+    scheduler.move(servo0,180,duration_ms=1000)
+    scheduler.move(servo1,0,duration_ms=1000)
+    while scheduler.moveInProgress():
+        Hal.clock.sleep_ms(10)
+    scheduler.stopTimer()
+    assert(servo0.readMicroseconds()==2400)
+    assert(servo1.readMicroseconds()==640)
+
+    benchmark()
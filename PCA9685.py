@@ -0,0 +1,179 @@
+# PCA9685.py: 16-channel I2C servo driver backend in MicroPython
+# Copyright (C) 2022 Vincent Mistler (YouMakeTech)
+#
+# The PCA9685 generates the pulses of 16 servos by itself.
+# The driver keeps an image of the 64 LEDn_ON/LEDn_OFF registers:
+# the writes of a whole pose are batched between begin() and flush()
+# and sent in a single auto-increment I2C transaction.
+#
+# Example usage:
+# >>> from machine import I2C, Pin
+# >>> from PCA9685 import PCA9685
+# >>> from Servo import Servo
+# >>> pca=PCA9685(I2C(0,sda=Pin(20),scl=Pin(21),freq=400000))
+# >>> servo=Servo(0,backend=pca) # servo on channel 0 of the PCA9685
+
+from Hal import Hal
+
+_MODE1=0x00
+_MODE2=0x01
+_LED0_ON_L=0x06
+_PRE_SCALE=0xfe
+
+_MODE1_RESTART=0x80
+_MODE1_AI=0x20    # register auto-increment
+_MODE1_SLEEP=0x10
+_MODE2_OUTDRV=0x04 # totem pole outputs
+_LED_FULL=0x10    # full on/off bit in LEDn_ON_H/LEDn_OFF_H
+
+_OSCILLATOR_HZ=25000000
+
+class PCA9685:
+    def __init__(self,i2c,address=0x40,freq=50):
+        self.i2c=i2c
+        self.address=address
+        # register image of LED0_ON_L to LED15_OFF_H, 4 bytes per channel
+        self._registers=bytearray(64)
+        self._view=memoryview(self._registers)
+        self._dirtyMin=16 # first channel to send
+        self._dirtyMax=-1 # last channel to send
+        self._batch=0     # > 0 between begin() and flush()
+        self._buffer=bytearray(1) # single register writes
+        self.deduplicate=True # skip the channel updates which do not change the registers
+        self.writesIssued=0 # channel updates sent to the chip
+        self.writesSuppressed=0 # channel updates skipped, the register value being unchanged
+        self.setFreq(freq)
+
+    # setFreq(freq)
+    # set the pulse frequency in Hz of all the channels
+    def setFreq(self,freq):
+        self.prescale=int(_OSCILLATOR_HZ/(4096*freq)+0.5)-1
+        # duration of one of the 4096 steps of a period in ns
+        self._step_ns=(self.prescale+1)*(1000000000//_OSCILLATOR_HZ)
+        self._writeRegister(_MODE2,_MODE2_OUTDRV)
+        self._writeRegister(_MODE1,_MODE1_SLEEP|_MODE1_AI) # the prescaler can only be set while sleeping
+        self._writeRegister(_PRE_SCALE,self.prescale)
+        self._writeRegister(_MODE1,_MODE1_AI)
+        Hal.clock.sleep_ms(1) # oscillator start-up
+        self._writeRegister(_MODE1,_MODE1_RESTART|_MODE1_AI)
+
+    # setPulse_ns(channel,ns)
+    # set the pulse width in ns of a channel
+    # sent immediately, or by flush() between begin() and flush()
+    # nothing is sent when the pulse width quantized to the 4096 steps
+    # of the period does not change
+    def setPulse_ns(self,channel,ns):
+        off=ns//self._step_ns
+        if off>4095:
+            off=4095
+        i=4*channel
+        registers=self._registers
+        if self.deduplicate and registers[i+2]==off&0xff and registers[i+3]==off>>8 \
+           and registers[i]==0 and registers[i+1]==0:
+            self.writesSuppressed+=1
+            return
+        self.writesIssued+=1
+        registers[i]=0     # LEDn_ON_L: pulse starts at the beginning of the period
+        registers[i+1]=0   # LEDn_ON_H
+        registers[i+2]=off&0xff
+        registers[i+3]=off>>8
+        self._markDirty(channel)
+
+    # setOff(channel)
+    # stop the pulses of a channel
+    def setOff(self,channel):
+        i=4*channel
+        self._registers[i]=0
+        self._registers[i+1]=0
+        self._registers[i+2]=0
+        self._registers[i+3]=_LED_FULL
+        self._markDirty(channel)
+
+    # begin()
+    # start a batch: the channels are only sent by flush()
+    def begin(self):
+        self._batch+=1
+
+    # flush()
+    # end a batch and send all the modified channels in one I2C transaction
+    def flush(self):
+        if self._batch>0:
+            self._batch-=1
+        if self._batch==0 and self._dirtyMax>=self._dirtyMin:
+            start=4*self._dirtyMin
+            end=4*(self._dirtyMax+1)
+            self.i2c.writeto_mem(self.address,_LED0_ON_L+start,self._view[start:end])
+            self._dirtyMin=16
+            self._dirtyMax=-1
+
+    # attach(servo)
+    # backend interface: servo.id is the channel (0 to 15) of the servo
+    def attach(self,servo):
+        if servo.id<0 or servo.id>15:
+            raise ValueError('PCA9685: channel '+str(servo.id)+' out of range 0..15')
+        servo.pin=PCA9685Channel(self,servo.id)
+        servo._pwmActive=True
+
+    # detach(servo)
+    # backend interface: stop the pulses of the servo
+    def detach(self,servo):
+        servo.pin.deinit()
+        servo._pwmActive=False
+
+    def _markDirty(self,channel):
+        if channel<self._dirtyMin:
+            self._dirtyMin=channel
+        if channel>self._dirtyMax:
+            self._dirtyMax=channel
+        if self._batch==0:
+            self.flush()
+
+    def _writeRegister(self,register,value):
+        self._buffer[0]=value
+        self.i2c.writeto_mem(self.address,register,self._buffer)
+
+# One channel of a PCA9685, used as Servo.pin
+class PCA9685Channel:
+    def __init__(self,driver,channel):
+        self.driver=driver
+        self.channel=channel
+
+    def duty_ns(self,ns):
+        self.driver.setPulse_ns(self.channel,ns)
+
+    def deinit(self):
+        self.driver.setOff(self.channel)
+
+# returns the pulse width in steps of a channel written to a FakeI2C
+def _getOff(i2c,address,channel):
+    register=_LED0_ON_L+4*channel
+    return i2c.memory[(address,register+2)]+(i2c.memory[(address,register+3)]<<8)
+
+if __name__ == "__main__":
+    from Servo import Servo
+    from ServoGroup import ServoGroup
+    from Hal import FakeI2C
+    i2c=FakeI2C()
+    pca=PCA9685(i2c)
+    assert(pca.prescale==121)
+    assert(i2c.memory[(0x40,_PRE_SCALE)]==121)
+
+    # each single write is one transaction of 4 bytes
+    servos=[Servo(i,backend=pca) for i in range(10)]
+    assert(_getOff(i2c,0x40,0)==1500000//pca._step_ns)
+    i2c.transactions=0
+    i2c.bytes=0
+    servos[3].write(0)
+    assert(i2c.transactions==1 and i2c.bytes==4)
+    assert(_getOff(i2c,0x40,3)==640000//pca._step_ns)
+
+    # a whole pose is one transaction
+    group=ServoGroup(servos)
+    i2c.transactions=0
+    i2c.bytes=0
+    group.write([45]*10)
+    assert(i2c.transactions==1 and i2c.bytes==40)
+    assert(_getOff(i2c,0x40,9)==servos[9].readMicroseconds()*1000//pca._step_ns)
+
+    servos[9].detach()
+    assert(i2c.memory[(0x40,_LED0_ON_L+4*9+3)]==_LED_FULL)
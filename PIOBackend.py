@@ -0,0 +1,376 @@
+# PIOBackend.py: Servo pulses of up to 30 GPIOs generated by a PIO state machine in MicroPython
+# Copyright (C) 2022 Vincent Mistler (YouMakeTech)
+#
+# One PIO state machine drives consecutive GPIOs from basePin, whatever their
+# PWM channels. It plays a frame buffer of 32-bit words, two per event:
+#     pin states (bit i: GPIO basePin+i), then the delay until the next event
+# The first event raises the pins of all the servos, the next ones lower them
+# in the order of their pulse widths, and the last delay completes the period.
+# Two DMA channels feed the buffer to the state machine again and again:
+# the first copies the buffer to the TX FIFO, then chains to the second, which
+# reloads the read address of the first from a word holding the address of the
+# front buffer. A pose is packed into a free buffer and published by writing
+# that word: one store instead of one duty_ns() per servo, taken into account
+# at the beginning of the next frame. Three buffers are used, such that a free
+# one (neither played by the DMA nor published for the next frame) is always
+# available: publishing never waits for the end of a frame.
+#
+# >>> from PIOBackend import PIOBackend
+# >>> pio=PIOBackend(basePin=0,pinCount=16)
+# >>> servos=[Servo(i,backend=pio) for i in range(16)]   # GP0 to GP15
+# >>> ServoGroup(servos).write(pose)                       # one writePose(), one buffer swap
+#
+# PulseTrain packs the frames and SimStateMachine plays them with the cycle
+# timing of the PIO program: off-device, PIOBackend uses a SimStateMachine.
+
+from array import array
+from Hal import Hal
+
+try:
+    import rp2
+except ImportError:
+    rp2=None
+
+_SM_FREQ=10000000 # state machine clock: 10 cycles per µs
+_EVENT_CYCLES=5   # cycles of an event besides its delay loop (see _pulseProgram)
+_MAX_PINS=30      # GP0 to GP29, the pin states stay small integers
+
+# program=_pulseProgram(pinCount)
+# PIO program driving pinCount pins: one event per pair of words
+# pull, out pins (pins change), pull, mov x, then x+1 cycles of jmp
+def _pulseProgram(pinCount):
+    @rp2.asm_pio(out_init=(rp2.PIO.OUT_LOW,)*pinCount,out_shiftdir=rp2.PIO.SHIFT_RIGHT, \
+                 fifo_join=rp2.PIO.JOIN_TX)
+    def program():
+        wrap_target()
+        pull(block)
+        out(pins,32)
+        pull(block)
+        mov(x,osr)
+        label('delay')
+        jmp(x_dec,'delay')
+        wrap()
+    return program
+
+class PulseTrain:
+    # PulseTrain(pinCount,period_ms=20,freq=_SM_FREQ)
+    # packs the pulse widths of pinCount pins into frames of period_ms
+    # for a state machine clocked at freq Hz
+    def __init__(self,pinCount,period_ms=20,freq=_SM_FREQ):
+        if pinCount<1 or pinCount>_MAX_PINS:
+            raise ValueError('PulseTrain: pinCount must be between 1 and '+str(_MAX_PINS))
+        self.pinCount=pinCount
+        self.period_us=1000*period_ms
+        self.cyclesPerUs=freq//1000000
+        self.wordCount=2*(pinCount+1) # rise, then up to pinCount falls
+        self._order=array('B',(i for i in range(pinCount))) # pins sorted by pulse width in the last frame
+
+    # words=buffer()
+    # returns a new frame buffer
+    def buffer(self):
+        return array('I',(0 for i in range(self.wordCount)))
+
+    # pack(pulses,words)
+    # write the frame of the pulse widths pulses[i] in µs of the pins (0: no pulse)
+    # into the frame buffer words, without allocating memory
+    # the pins with the same pulse width fall in the same event; the events
+    # left unused hold the pins low for 1µs before the end of the period
+    def pack(self,pulses,words):
+        order=self._order
+        count=self.pinCount
+        cyclesPerUs=self.cyclesPerUs
+        # insertion sort of the pins by pulse width, starting from the order
+        # of the previous frame: consecutive poses are close, so it is almost sorted
+        for k in range(1,count):
+            pin=order[k]
+            pulse=pulses[pin]
+            j=k
+            while j>0 and pulses[order[j-1]]>pulse:
+                order[j]=order[j-1]
+                j-=1
+            order[j]=pin
+        k=0
+        while k<count and pulses[order[k]]==0:
+            k+=1 # no pulse
+        pins=0
+        for i in range(k,count):
+            pins|=1<<order[i]
+        words[0]=pins
+        w=1 # delay of the current event
+        t=0 # start of the current event in µs
+        while k<count:
+            pulse=pulses[order[k]]
+            while k<count and pulses[order[k]]==pulse:
+                pins&=~(1<<order[k])
+                k+=1
+            words[w]=cyclesPerUs*(pulse-t)-_EVENT_CYCLES
+            words[w+1]=pins
+            w+=2
+            t=pulse
+        last=self.wordCount-1
+        while w<last:
+            words[w]=cyclesPerUs-_EVENT_CYCLES # 1µs
+            words[w+1]=0
+            w+=2
+            t+=1
+        words[w]=self._delay(self.period_us-t)
+
+    # cycle count of the delay loop of an event lasting us
+    def _delay(self,us):
+        return self.cyclesPerUs*us-_EVENT_CYCLES
+
+# Host model of the PIO program: plays frame buffers cycle by cycle
+class SimStateMachine:
+    def __init__(self,freq=_SM_FREQ):
+        self.freq=freq
+        self.cycle=0  # cycles since the start
+        self.pins=0   # current pin states
+        self.edges=[] # (cycle,pins) at each out pins
+        self.frames=0
+
+    # run(words)
+    # play one frame buffer
+    def run(self,words):
+        for i in range(0,len(words),2):
+            # pull, then the pins change on the out instruction
+            self.pins=words[i]
+            self.edges.append((self.cycle+1,self.pins))
+            self.cycle+=_EVENT_CYCLES+words[i+1]
+        self.frames+=1
+
+    # widths=pulseWidths(pinCount)
+    # returns the width in µs of the last pulse of each pin (0: no pulse)
+    def pulseWidths(self,pinCount):
+        cyclesPerUs=self.freq//1000000
+        widths=[0]*pinCount
+        rise=[-1]*pinCount
+        previous=0
+        for cycle,pins in self.edges:
+            for pin in range(pinCount):
+                bit=1<<pin
+                if pins&bit and not previous&bit:
+                    rise[pin]=cycle
+                elif previous&bit and not pins&bit:
+                    widths[pin]=(cycle-rise[pin])//cyclesPerUs
+            previous=pins
+        return widths
+
+class PIOBackend:
+    # PIOBackend(basePin=0,pinCount=16,period_ms=20,stateMachineId=0)
+    # drives GP basePin to basePin+pinCount-1 from the PIO state machine stateMachineId
+    def __init__(self,basePin=0,pinCount=16,period_ms=20,stateMachineId=0):
+        self.basePin=basePin
+        self.train=PulseTrain(pinCount,period_ms)
+        self.pulses=array('H',(0 for i in range(pinCount))) # pulse width of each pin in µs
+        self._buffers=(self.train.buffer(),self.train.buffer(),self.train.buffer())
+        self._front=0 # buffer published for the next frames
+        self.train.pack(self.pulses,self._buffers[0])
+        self._batch=0     # > 0 between begin() and flush()
+        self._dirty=False # True when the pulses changed since the last swap
+        self.swaps=0      # number of frame buffers swapped
+        if rp2 is not None:
+            self._startHardware(stateMachineId)
+        else:
+            self.stateMachine=SimStateMachine()
+
+    # words=frontBuffer()
+    # returns the frame buffer published for the state machine
+    def frontBuffer(self):
+        return self._buffers[self._front]
+
+    # setPulse_us(pin,us)
+    # set the pulse width in µs of a pin (0: no pulse), relative to basePin
+    # applied immediately, or by flush() between begin() and flush()
+    def setPulse_us(self,pin,us):
+        self.pulses[pin]=us
+        self._dirty=True
+        if self._batch==0:
+            self._swap()
+
+    # writePose(ids,microseconds,start=0)
+    # set the pulse widths microseconds[start+i] in µs of the GPIOs ids[i] at once
+    # (ids[i]=-1: pin left unchanged) and send them with one buffer swap
+    # called once per pose by ServoGroup instead of one duty_ns() per servo
+    def writePose(self,ids,microseconds,start=0):
+        pulses=self.pulses
+        basePin=self.basePin
+        for i in range(len(ids)):
+            id=ids[i]
+            if id>=0:
+                pulse=microseconds[start+i]
+                if pulses[id-basePin]!=pulse:
+                    pulses[id-basePin]=pulse
+                    self._dirty=True
+        if self._batch==0 and self._dirty:
+            self._swap()
+
+    # begin()
+    # start a batch: the pulses are only sent by flush()
+    def begin(self):
+        self._batch+=1
+
+    # flush()
+    # end a batch and send the whole pose with one buffer swap
+    def flush(self):
+        if self._batch>0:
+            self._batch-=1
+        if self._batch==0 and self._dirty:
+            self._swap()
+
+    # attach(servo)
+    # backend interface: servo.id is the GPIO of the servo
+    def attach(self,servo):
+        pin=servo.id-self.basePin
+        if pin<0 or pin>=self.train.pinCount:
+            raise ValueError('PIOBackend: GP'+str(servo.id)+' out of range GP'+str(self.basePin) \
+                             +'..GP'+str(self.basePin+self.train.pinCount-1))
+        servo.pin=PIOChannel(self,pin)
+        servo._pwmActive=True
+
+    # detach(servo)
+    # backend interface: stop the pulses of the servo
+    def detach(self,servo):
+        servo.pin.deinit()
+        servo._pwmActive=False
+
+    # pack the pulses into a free buffer and publish it for the next frame
+    def _swap(self):
+        playing=self._playing()
+        back=0
+        while back==self._front or back==playing:
+            back+=1
+        self.train.pack(self.pulses,self._buffers[back])
+        self._front=back
+        if rp2 is not None:
+            self._address[0]=self._addresses[back]
+        self._dirty=False
+        self.swaps+=1
+
+    # index of the buffer being read by the DMA, -1 if none
+    # the previously published buffer may be played until the end of the current frame
+    def _playing(self):
+        if rp2 is None:
+            return -1
+        read=self._dataDma.read
+        size=4*self.train.wordCount
+        for i in range(len(self._addresses)):
+            if self._addresses[i]<=read<self._addresses[i]+size:
+                return i
+        return -1
+
+    def _startHardware(self,stateMachineId):
+        from uctypes import addressof
+        self._addresses=tuple(addressof(buffer) for buffer in self._buffers)
+        self._address=array('I',(self._addresses[0],)) # read by the control DMA channel
+        self.stateMachine=rp2.StateMachine(stateMachineId,_pulseProgram(self.train.pinCount),freq=_SM_FREQ, \
+                                           out_base=Hal.Pin(self.basePin))
+        self._dataDma=rp2.DMA()
+        self._controlDma=rp2.DMA()
+        pio=stateMachineId>>2
+        dreq=8*pio+(stateMachineId&3) # TX FIFO of the state machine
+        self._dataDma.config(read=self._buffers[0],write=self.stateMachine,count=self.train.wordCount, \
+            ctrl=self._dataDma.pack_ctrl(size=2,inc_write=False,treq_sel=dreq,chain_to=self._controlDma.channel))
+        # writes READ_ADDR_TRIG (alias 3) of the data channel, which restarts it
+        self._controlDma.config(read=self._address,write=addressof(self._dataDma.registers)+0x3c,count=1, \
+            ctrl=self._controlDma.pack_ctrl(size=2,inc_read=False,inc_write=False))
+        self.stateMachine.active(1)
+        self._controlDma.active(1)
+
+# One pin of a PIOBackend, used as Servo.pin
+# for the writes of a single servo: the poses of a ServoGroup use writePose()
+class PIOChannel:
+    def __init__(self,backend,pin):
+        self.backend=backend
+        self.pin=pin
+
+    def duty_ns(self,ns):
+        self.backend.setPulse_us(self.pin,ns//1000)
+
+    def deinit(self):
+        self.backend.setPulse_us(self.pin,0)
+
+# benchmark(iterations)
+# compares the time of a pose update of the lower body of the Raven MS
+# with a duty_ns() per servo and with a PIO buffer swap
+def benchmark(iterations=1000):
+    from Log import Log
+    from Servo import Servo
+    from ServoGroup import ServoGroup
+    from RavenMS import WALK
+    from servoBenchmark import BenchmarkPWM
+    level=Log.level
+    Log.setLevel(Log.OFF)
+    deduplicate=Servo.deduplicate
+    Servo.deduplicate=False
+    pio=PIOBackend(pinCount=16)
+    ids=(0,1,2,3,4,5,6,7,9,10) # the lower body servos of RavenMS
+    for name in ('duty_ns','PIO'):
+        if name=='PIO':
+            group=ServoGroup([Servo(id,backend=pio) for id in ids])
+        else:
+            group=ServoGroup([Servo(id,lazy=True) for id in ids])
+            for servo in group:
+                servo.pin=BenchmarkPWM() # attached without a real PWM
+                servo._lazy=False
+                servo.enabled=True
+                servo._pwmActive=True
+        frameCount=WALK.frameCount()
+        t0=Hal.clock.ticks_us()
+        for k in range(iterations):
+            group.write(WALK.angles,(k%frameCount)*WALK.jointCount)
+        elapsed=Hal.clock.ticks_diff(Hal.clock.ticks_us(),t0)
+        print('ServoGroup.write with '+name+': '+str(int(1000*elapsed/iterations))+' ns/pose')
+    train=PulseTrain(30)
+    pulses=array('H',(1000+37*i for i in range(30)))
+    words=train.buffer()
+    t0=Hal.clock.ticks_us()
+    for k in range(iterations):
+        train.pack(pulses,words)
+    elapsed=Hal.clock.ticks_diff(Hal.clock.ticks_us(),t0)
+    print('PulseTrain.pack 30 pins: '+str(int(1000*elapsed/iterations))+' ns/frame')
+    Servo.deduplicate=deduplicate
+    Log.setLevel(level)
+
+if __name__ == "__main__":
+    from Log import Log
+    from Servo import Servo
+    from ServoGroup import ServoGroup
+    Log.setLevel(Log.OFF)
+    hostClock=Hal.clock
+    Hal.simulate()
+
+    # the simulated state machine outputs the packed pulse widths
+    train=PulseTrain(8)
+    words=train.buffer()
+    pulses=array('H',(1500,0,640,2400,1500,1000,1001,2399))
+    train.pack(pulses,words)
+    sm=SimStateMachine()
+    sm.run(words)
+    assert(sm.pulseWidths(8)==list(pulses))
+    assert(sm.cycle==10*train.period_us) # one frame per period
+    assert(words[0]==0b11111101) # GP1 does not pulse
+
+    # a pose of the group is one buffer swap
+    pio=PIOBackend(basePin=2,pinCount=16)
+    servos=[Servo(id,backend=pio) for id in range(2,12)]
+    swaps=pio.swaps
+    group=ServoGroup(servos)
+    group.write((0,45,90,135,180,90,90,90,30,60))
+    assert(pio.swaps==swaps+1)
+    group.write((0,45,90,135,180,90,90,90,30,60))
+    assert(pio.swaps==swaps+1) # same pose, nothing to send
+    pio.stateMachine.run(pio.frontBuffer())
+    widths=pio.stateMachine.pulseWidths(16)
+    for i in range(len(servos)):
+        assert(widths[i]==servos[i].readMicroseconds())
+    servos[3].detach()
+    pio.stateMachine.run(pio.frontBuffer())
+    assert(pio.stateMachine.pulseWidths(16)[3]==servos[3].readMicroseconds()) # last pulse before detach
+    assert(pio.frontBuffer()[0]&(1<<3)==0)
+    try:
+        Servo(20,backend=pio)
+        assert(False)
+    except ValueError:
+        pass
+    Hal.setClock(hostClock)
+    benchmark()
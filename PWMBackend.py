@@ -0,0 +1,53 @@
+# PWMBackend.py: Servo output on the PWM channels of the RP2040 in MicroPython
+# Copyright (C) 2022 Vincent Mistler (YouMakeTech)
+#
+# A backend connects Servo objects to the hardware generating their pulses.
+# Each backend provides:
+#   attach(servo)  set servo.pin to an object with duty_ns(ns) and deinit()
+#                  and servo._pwmActive to True when servo.pin outputs immediately
+#   detach(servo)  stop the pulses of the servo
+#   begin()        start a batch of writes (see ServoGroup)
+#   flush()        send the writes of the batch to the hardware
+# and optionally:
+#   writePose(ids,microseconds,start)  send a whole pose at once, used by
+#                  ServoGroup instead of one servo.pin.duty_ns() per servo
+# PWMBackend is the default backend of Servo, see also PCA9685.
+
+from Hal import Hal
+from Log import Log
+from PWMMultiplexer import PWMMultiplexer
+
+class PWMBackend:
+    def __init__(self):
+        # shares the PWM channels between the servos connected to conflicting GPIO pins
+        self.multiplexer=PWMMultiplexer()
+
+    # attach(servo)
+    # configure the PWM of the GPIO pin servo.id at 50Hz
+    # if another attached servo uses the same PWM channel,
+    # the channel is shared by self.multiplexer
+    def attach(self,servo):
+        servo._gpio=Hal.Pin(servo.id)
+        servo.pin=Hal.PWM(servo._gpio)
+        servo.pin.freq(50) # Hz
+        if self.multiplexer.register(servo) and Log.level>=Log.INFO:
+            print('Servo.attach(): GP'+str(servo.id)+' shares its PWM channel with GP' \
+                  +','.join([str(other.id) for other in self.multiplexer.conflicts(servo)]))
+
+    # detach(servo)
+    # free the PWM channel of the servo unless it is still used by another servo
+    def detach(self,servo):
+        if not self.multiplexer.unregister(servo):
+            # the PWM channel is not used by another servo
+            servo.pin.deinit()
+        Hal.Pin(servo.id).init(mode=Hal.Pin.IN)
+
+    # begin()
+    # PWM channels are updated immediately: nothing to batch
+    def begin(self):
+        pass
+
+    # flush()
+    # PWM channels are updated immediately: nothing to send
+    def flush(self):
+        pass
@@ -0,0 +1,177 @@
+# PWMMultiplexer.py: Share the RP2040 PWM channels between several servos in MicroPython
+# Copyright (C) 2022 Vincent Mistler (YouMakeTech)
+#
+# The RP2040 has 8 PWM slices with 2 channels (A and B) each.
+# GPIO n is connected to slice (n>>1)&7, channel n&1, hence
+# GPIO n and GPIO n+16 share the same PWM channel (e.g. GP0 and GP16 on PWM_A[0])
+# and output the same pulses when both are attached.
+#
+# The multiplexer detects such conflicts when a servo is attached
+# and connects only one servo at a time to the shared channel.
+# refresh() gives the channel to the next servo once the current servo
+# held it for a whole PWM period and its pulse is over, such that each servo
+# receives pulses often enough to hold its position (every 2 or 3 PWM periods
+# for 2 servos on the same channel). refresh() runs several times per PWM period:
+# a timer with the same period as the PWM could always fire during the pulses.
+# Servos remain in their last commanded position between two pulses.
+#
+# The servos write their pulse width with the interrupts disabled
+# (see Servo.writeMicroseconds), such that the timer cannot give
+# their channel to another servo between their check and their write.
+
+from Hal import Hal
+
+_PWM_BASE=0x40050000 # address of the PWM registers of slice 0
+_PWM_SLICE_SIZE=0x14 # size of the registers of one slice
+_PWM_CTR=0x08        # counter register
+_PWM_CC=0x0c         # counter compare register (channel A in bits 0-15, channel B in bits 16-31)
+
+class PWMMultiplexer:
+    # PWMMultiplexer(period_ms=20,refreshPeriod_ms=5)
+    # period_ms is the PWM period: a servo keeps the channel for at least one period
+    # refreshPeriod_ms is the time between two calls to refresh() by the timer
+    def __init__(self,period_ms=20,refreshPeriod_ms=5):
+        self.period_ms=period_ms
+        self.refreshPeriod_ms=refreshPeriod_ms
+        self._channels=[[] for i in range(16)] # servos attached to each PWM channel
+        self._active=[0]*16 # index of the servo connected to each channel
+        self._selected=[0]*16 # ticks_us() when the active servo of each channel was selected
+        self._shared=[]     # channels used by more than one servo
+        self._timer=None
+        self._timerCallback=self._onTimer # bound once to avoid allocating in the callback
+
+    # channel=channel(id)
+    # returns the PWM channel (0 to 15) of a GPIO pin: 2*slice+channel
+    @staticmethod
+    def channel(id):
+        return id&15
+
+    # shared=register(servo)
+    # called by Servo.attach() once the PWM of the servo is configured
+    # returns True if the servo shares its PWM channel with other servos
+    # the newly attached servo gets the channel, once the current pulse is over
+    # a servo previously attached to the same pin is disabled
+    def register(self,servo):
+        servos=self._channels[PWMMultiplexer.channel(servo.id)]
+        for other in servos:
+            if other.id==servo.id and other is not servo:
+                self.unregister(other)
+                other.enabled=False
+                break
+        if servo not in servos:
+            servos.append(servo)
+        channel=PWMMultiplexer.channel(servo.id)
+        if len(servos)==1:
+            self._active[channel]=0
+            servo._pwmActive=True
+            return False
+        if channel not in self._shared:
+            self._shared.append(channel)
+        self._selectAfterPulse(channel,servos.index(servo))
+        return True
+
+    # shared=unregister(servo)
+    # called by Servo.detach()
+    # returns True if the PWM channel is still used by other servos
+    def unregister(self,servo):
+        channel=PWMMultiplexer.channel(servo.id)
+        servos=self._channels[channel]
+        if servo not in servos:
+            return False
+        wasActive=servo._pwmActive
+        servos.remove(servo)
+        servo._pwmActive=False
+        if len(servos)<=1 and channel in self._shared:
+            self._shared.remove(channel)
+        if len(servos)==0:
+            return False
+        if wasActive or len(servos)==1:
+            self._selectAfterPulse(channel,0)
+        return True
+
+    # shared=isShared(servo)
+    # returns True if the servo shares its PWM channel with other attached servos
+    def isShared(self,servo):
+        return len(self._channels[PWMMultiplexer.channel(servo.id)])>1
+
+    # conflicts=conflicts(servo)
+    # returns the list of the other attached servos using the same PWM channel
+    def conflicts(self,servo):
+        return [other for other in self._channels[PWMMultiplexer.channel(servo.id)] if other is not servo]
+
+    # refresh()
+    # give each shared channel to its next servo
+    # should be called several times per period_ms, e.g. every refreshPeriod_ms from start()
+    # a channel is only switched once the current servo held it for period_ms
+    # and its pulse is over
+    def refresh(self):
+        now=Hal.clock.ticks_us()
+        period_us=1000*self.period_ms
+        for channel in self._shared:
+            if Hal.clock.ticks_diff(now,self._selected[channel])>=period_us and self._pulseOver(channel):
+                servos=self._channels[channel]
+                i=self._active[channel]+1
+                if i>=len(servos):
+                    i=0
+                self._select(channel,i)
+
+    # start(timerId=-1)
+    # call refresh() automatically every refreshPeriod_ms from a periodic hardware timer
+    def start(self,timerId=-1):
+        self.stop()
+        self._timer=Hal.Timer(timerId)
+        self._timer.init(mode=Hal.Timer.PERIODIC,period=self.refreshPeriod_ms,callback=self._timerCallback)
+
+    # stop()
+    # stop the timer started by start()
+    def stop(self):
+        if self._timer is not None:
+            self._timer.deinit()
+            self._timer=None
+
+    def _onTimer(self,timer):
+        self.refresh()
+
+    # connect the i-th servo of a channel to the PWM and disconnect the others
+    def _select(self,channel,i):
+        servos=self._channels[channel]
+        for other in servos:
+            if other._pwmActive:
+                other._pwmActive=False
+                other._sentMicroseconds=-1 # the channel will output the pulses of another servo
+                other._gpio.init(mode=Hal.Pin.IN)
+        servo=servos[i]
+        self._active[channel]=i
+        if servo.microseconds>=0:
+            # the compare register is double-buffered: the new pulse width
+            # is used from the next PWM period
+            servo.pin.duty_ns(1000*servo.microseconds)
+        servo._sentMicroseconds=servo.microseconds
+        servo._gpio.init(mode=Hal.Pin.ALT,alt=Hal.Pin.ALT_PWM)
+        servo._pwmActive=True
+        self._selected[channel]=Hal.clock.ticks_us()
+
+    # _select() outside of the timer: wait for the end of the current pulse,
+    # such that the newly connected pin does not output the rest of it (at most a few ms)
+    def _selectAfterPulse(self,channel,i):
+        while True:
+            state=Hal.disable_irq()
+            if self._pulseOver(channel):
+                self._select(channel,i)
+                Hal.enable_irq(state)
+                return
+            Hal.enable_irq(state)
+
+    # returns True when the PWM output of a channel is low for the current period
+    # i.e. when switching the channel to another pin cannot shorten a pulse
+    def _pulseOver(self,channel):
+        mem32=Hal.mem32
+        if mem32 is None:
+            return True
+        address=_PWM_BASE+(channel>>1)*_PWM_SLICE_SIZE
+        cc=mem32[address+_PWM_CC]
+        if channel&1:
+            level=(cc>>16)&0xffff
+        else:
+            level=cc&0xffff
+        return (mem32[address+_PWM_CTR]&0xffff)>=level
@@ -3,23 +3,106 @@
 # Robot and motion stands by Tang Woonthai: https://youtube.com/shorts/nuiew2s-k3U
 
 from Servo import Servo
-from time import sleep
+from ServoGroup import ServoGroup
+from Keyframes import Keyframes
+from Calibration import Calibration
+from LegKinematics import Leg
+from Log import Log
+from Hal import Hal
+
+# walk cycle
+# one row per frame: angles of the 10 lowerBodyServos then duration in ms
+WALK=Keyframes(10,(
+    #  r.foot   r.l.leg   r.u.leg     r.hip     l.hip   l.u.leg   l.l.leg    l.foot     low.b      up.b     ms
+        90-40,  90-40+0,  90+40-0,    90-40,    90+40,  90-40+0,    90+40,    90+40,    90-40,  90-40+0,  1000, # 1stand 1(100)
+        90-40, 90-40+30, 90+40-30,    90-40,    90+40, 90-40+30, 90+40-30,    90+40,    90-40,  90-40+0,   200, # 2stand 2(1100)
+     90-40-11, 90-40+30, 90+40-30, 90-40-11, 90+40-11, 90-40+30, 90+40-30, 90+40-11,    90-40,  90-40+0,   200, # 3stand r side(1300)
+     90-40-11, 90-40+30, 90+40-30, 90-40-11, 90+40-11, 90-40+70, 90+40-70, 90+40-11,    90-40,  90-40+0,   150, # 4stand r foot(1500)
+     90-40-12, 90-40+30, 90+40-30, 90-40-12, 90+40-12, 90-40+70,  90+40-0, 90+40-12,    90-40,  90-40+0,   150, # 5stand r foot l foot forward(1650)
+     90-40-12, 90-40+30, 90+40-30, 90-40-12, 90+40-12, 90-40+50,  90+40-0, 90+40-12,    90-40,  90-40+0,   150, # 6stand r foot l foot down(1800)
+      90-40-6, 90-40+35,90+40-22.5,  90-40-6,  90+40-6, 90-40+35,90+40-22.5,  90+40-6,    90-40,  90-40+0,   100, # 7stand r foot l foot front1(1950)
+      90-40-0, 90-40+40, 90+40-15,  90-40-0,  90+40-0, 90-40+40, 90+40-15,  90+40-0,    90-40,  90-40+0,   100, # 8stand r foot l foot front2(2050)
+      90-40+8, 90-40+45,90+40-7.5,  90-40+8,  90+40+8, 90-40+35,90+40-22.5,  90+40+8,    90-40,  90-40+0,   100, # 8stand r foot l foot front3(2150)
+     90-40+16, 90-40+50,  90+40-0, 90-40+16, 90+40+16, 90-40+30, 90+40-30, 90+40+16,    90-40,  90-40+0,   200, # 10stand l side l foot front(2250)
+     90-40+16, 90-40+70, 90+40-70, 90-40+16, 90+40+16, 90-40+30, 90+40-30, 90+40+16,    90-40,  90-40+0,   150, # 11stand l  foot (2450)
+     90-40+19,  90-40+0, 90+40-70, 90-40+16, 90+40+16, 90-40+30, 90+40-30, 90+40+19,    90-40,  90-40+0,   150, # 12stand l foot r foot forward (2600)
+     90-40+16,  90-40+0, 90+40-50, 90-40+16, 90+40+16, 90-40+30, 90+40-30, 90+40+16,    90-40,  90-40+0,   150, # 13stand l foot r foot down(2750)
+      90-40+8,90-40+7.5, 90+40-45,  90-40+0,  90+40+8,90-40+22.5, 90+40-35,  90+40+8,    90-40,  90-40+0,   100, # 14stand l foot r foot front1(2900)
+      90-40+0, 90-40+15, 90+40-40,  90-40+0,  90+40+0, 90-40+15, 90+40-40,  90+40+0,    90-40,  90-40+0,   100, # 5stand l foot r foot front2(3000)
+      90-40-5,90-40+22.5, 90+40-35,  90-40-5,  90+40-5,90-40+7.5, 90+40-45,  90+40-5,    90-40,  90-40+0,   100, # 16stand l foot r foot front3(3100)
+     90-40-10, 90-40+30, 90+40-30, 90-40-10, 90+40-10,  90-40+0, 90+40-50, 90+40-10,    90-40,  90-40+0,   250, # 17stand r side r foot front(3200)
+     90-40-11, 90-40+30, 90+40-30, 90-40-11, 90+40-11, 90-40+70, 90+40-70, 90+40-11,    90-40,  90-40+0,   150, # 18stand r foot(3450)
+        90-40,  90-40+0,  90+40-0,    90-40,    90+40,  90-40+0,    90+40,    90+40,    90-40,  90-40+0,  2000, # 1stand 1(11750)
+))
+
+# lower body transformation from human to helicopter
+# one row per frame: angles of the 10 lowerBodyServos then duration in ms
+LB_TRANSFORM_HUMAN_HELI=Keyframes(10,(
+    #  r.foot   r.l.leg   r.u.leg     r.hip     l.hip   l.u.leg   l.l.leg    l.foot     low.b      up.b     ms
+        90-40,    90-40,    90+40,    90-40,    90+40,    90-40,    90+40,    90+40,    90-40,    90-40, 10000, # stand 1
+        90-40, 90-40+80, 90+40-80,    90-40,    90+40, 90-40+80, 90+40-80,    90+40,    90-40,    90-40,   500, # stand 2
+        90-40, 90-40+80, 90+40-80,    90-40,    90+40, 90-40+80, 90+40-80,    90+40,    90-40, 90-40+90,   500, # stand 3
+        90-40, 90-40+80, 90+40-80,    90-40,    90+40, 90-40+80, 90+40-80,    90+40, 90-40+85, 90-40+90,   500, # stand 4
+        90-40, 90-40+80, 90+40-80,    90-40,    90+40, 90-40+80, 90+40-80,    90+40, 90-40+85, 90-40+90,   500, # stand 5
+))
+
+# lower body transformation from helicopter to human
+# one row per frame: angles of the 10 lowerBodyServos then duration in ms
+LB_TRANSFORM_HELI_HUMAN=Keyframes(10,(
+    #  r.foot   r.l.leg   r.u.leg     r.hip     l.hip   l.u.leg   l.l.leg    l.foot     low.b      up.b     ms
+        90-40, 90-40+80, 90+40-80,    90-40,    90+40, 90-40+80, 90+40-80,    90+40, 90-40+90, 90-40+90,  5000, # stand 1
+        90-40, 90-40+80, 90+40-80,    90-40,    90+40, 90-40+80, 90+40-80,    90+40, 90-40+90, 90-40+90,   500, # stand 2
+        90-40, 90-40+80, 90+40-80,    90-40,    90+40, 90-40+80, 90+40-80,    90+40,    90-40, 90-40+90,   500, # stand 3
+        90-40, 90-40+80, 90+40-80,    90-40,    90+40, 90-40+80, 90+40-80,    90+40,    90-40,  90-40+0,   500, # stand 12
+        90-40,  90-40+0,  90+40-0,    90-40,    90+40,  90-40+0,  90+40-0,    90+40,    90-40,  90-40+0,   500, # stand 16
+))
+
+# forbidden combinations of two lowerBodyServos (see SafetyChecker.py)
+# (jointA,minA,maxA,jointB,minB,maxB): jointA within [minA,maxA] and jointB within [minB,maxB]
+LB_FORBIDDEN=(
+    (3, 70,170, 4, 10,110), # both hips rolled inwards by more than 20 degrees: the legs cross
+    (8,100,180, 2,100,180), # low body folded (heli) while the right leg is not: the body hits the thigh
+    (8,100,180, 5,  0, 80), # same with the left leg
+)
 
 class RavenMS:
-    def __init__(self):
-        print('RavenMS()')
+    # RavenMS(upperBody=False,backend=None)
+    # upperBody=True also attaches the 11 upper body servos
+    # backend drives the lower body servos (e.g. a PCA9685, channels 0 to 10),
+    # the default is the PWM of the GPIO pins
+    # lazy=True only registers the servos for a fast startup: they are attached
+    # by the first motion, or together by home()
+    # calibration is an optional calibration file of the servos (see Calibration.py),
+    # e.g. 'ravenms.cal' on the board, applied before the first pulse;
+    # without it (or if the file cannot be read), the servos
+    # use the limits below and the default pulse widths
+    def __init__(self,upperBody=False,backend=None,lazy=False,calibration=None):
+        if Log.level>=Log.INFO:
+            print('RavenMS()')
+
+        calibrationData=None
+        if calibration is not None:
+            try:
+                calibrationData=Calibration.load(calibration)
+                if Log.level>=Log.INFO:
+                    print('RavenMS(): calibration '+calibration+' applied')
+            except OSError:
+                if Log.level>=Log.INFO:
+                    print('RavenMS(): calibration '+calibration+' not found, default pulse widths')
+        # calibrated servos are attached after their calibration is applied
+        servoLazy=lazy or calibrationData is not None
 
         # lb  human pose
-        self.rightFoot=Servo(0,initialPosition=90-40,positionMin=10,positionMax=90)
-        self.rightLowerLeg=Servo(1,initialPosition=90-40,positionMin=50,positionMax=160)
-        self.rightUpperLeg=Servo(2,initialPosition=90+40,positionMin=40,positionMax=130)
-        self.rightHip=Servo(3,initialPosition=90-40,positionMin=50,positionMax=170)
-        self.leftHip=Servo(4,initialPosition=90+40,positionMin=10,positionMax=130)
-        self.leftUpperLeg=Servo(5,initialPosition=90-40,positionMin=50,positionMax=140)
-        self.leftLowerLeg=Servo(6,initialPosition=90+40,positionMin=30,positionMax=130)
-        self.leftFoot=Servo(7,initialPosition=90+40,positionMin=90,positionMax=170)
-        self.lowBody=Servo(9,initialPosition=90-40,positionMin=30,positionMax=80)
-        self.upperBody=Servo(10,initialPosition=90-40,positionMin=0,positionMax=100)
+        self.rightFoot=Servo(0,initialPosition=90-40,positionMin=10,positionMax=90,backend=backend,lazy=servoLazy)
+        self.rightLowerLeg=Servo(1,initialPosition=90-40,positionMin=50,positionMax=160,backend=backend,lazy=servoLazy)
+        self.rightUpperLeg=Servo(2,initialPosition=90+40,positionMin=40,positionMax=130,backend=backend,lazy=servoLazy)
+        self.rightHip=Servo(3,initialPosition=90-40,positionMin=50,positionMax=170,backend=backend,lazy=servoLazy)
+        self.leftHip=Servo(4,initialPosition=90+40,positionMin=10,positionMax=130,backend=backend,lazy=servoLazy)
+        self.leftUpperLeg=Servo(5,initialPosition=90-40,positionMin=50,positionMax=140,backend=backend,lazy=servoLazy)
+        self.leftLowerLeg=Servo(6,initialPosition=90+40,positionMin=30,positionMax=130,backend=backend,lazy=servoLazy)
+        self.leftFoot=Servo(7,initialPosition=90+40,positionMin=90,positionMax=170,backend=backend,lazy=servoLazy)
+        self.lowBody=Servo(9,initialPosition=90-40,positionMin=30,positionMax=80,backend=backend,lazy=servoLazy)
+        self.upperBody=Servo(10,initialPosition=90-40,positionMin=0,positionMax=100,backend=backend,lazy=servoLazy)
                               
         self.lowerBodyServos=[]
         self.lowerBodyServos.append(self.rightFoot)      # 0
@@ -32,421 +115,132 @@ class RavenMS:
         self.lowerBodyServos.append(self.leftFoot)       # 7
         self.lowerBodyServos.append(self.lowBody)        # 8
         self.lowerBodyServos.append(self.upperBody)      # 9
+        self.lowerBodyGroup=ServoGroup(self.lowerBodyServos)
+        # kinematics of the legs, straight in the initial pose
+        self.rightLeg=Leg(self.rightHip,self.rightUpperLeg,self.rightLowerLeg,self.rightFoot,Leg.RIGHT)
+        self.leftLeg=Leg(self.leftHip,self.leftUpperLeg,self.leftLowerLeg,self.leftFoot,Leg.LEFT)
+        self.interpolation=None # motion profile of the transitions, None to snap to each pose
+        self.interpolationPeriod_ms=20
+        self.safety=None # SafetyChecker of the motions, None to play them unchecked
         
-#         # Detach the lower body servos before attaching the upper body
-#         # to avoid conflict between shared PWM channels
-#         sleep(0.500)
-#         for ithServo in self.lowerBodyServos:
-#             ithServo.detach()
-#         sleep(0.500)
-#         
-#         # ub heli pose (stand 17)
-#         self.rightLowerArm=Servo(11,initialPosition=90+10)
-#         self.rightArm=Servo(12,initialPosition=90-89)
-#         self.rightShoulder=Servo(13,initialPosition=90-80)
-#         self.sd1=Servo(14,initialPosition=90)
-#         self.sd2=Servo(15,initialPosition=90)
-#         self.sd3=Servo(16,initialPosition=90)
-#         self.leftShoulder=Servo(17,initialPosition=90+60)
-#         self.leftArm=Servo(18,initialPosition=90+40)
-#         self.leftLowerArm=Servo(19,initialPosition=90+80)
-#         self.mainRotor=Servo(20,initialPosition=0)
-#         self.tailRotor=Servo(21,initialPosition=0)
-#         
-#         self.upperBodyServos=[]
-#         self.upperBodyServos.append(self.rightLowerArm) # 0
-#         self.upperBodyServos.append(self.rightArm)       # 1
-#         self.upperBodyServos.append(self.rightShoulder)  # 2
-#         self.upperBodyServos.append(self.sd1)             # 3
-#         self.upperBodyServos.append(self.sd2)             # 4
-#         self.upperBodyServos.append(self.sd3)             # 5
-#         self.upperBodyServos.append(self.leftShoulder)   # 6
-#         self.upperBodyServos.append(self.leftArm)        # 7
-#         self.upperBodyServos.append(self.leftLowerArm)  # 8
-#         self.upperBodyServos.append(self.mainRotor)      # 9
-#         self.upperBodyServos.append(self.tailRotor)      # 10
-#         
-#         # Detach the upper body servos
-#         sleep(0.500)
-#         for ithServo in self.upperBodyServos:
-#             ithServo.detach()
-#         sleep(0.500)
-#         
-#         # Re-attach the lower body servos
-#         sleep(0.500)
-#         for ithServo in self.lowerBodyServos:
-#             ithServo.attach()
-#         sleep(0.500)
-        
+        if upperBody:
+            # ub heli pose (stand 17)
+            # GP16 to GP21 share their PWM channels with GP0 to GP5:
+            # the conflicting servos are multiplexed by Servo.defaultBackend.multiplexer
+            self.rightLowerArm=Servo(11,initialPosition=90+10,lazy=servoLazy)
+            self.rightArm=Servo(12,initialPosition=90-89,lazy=servoLazy)
+            self.rightShoulder=Servo(13,initialPosition=90-80,lazy=servoLazy)
+            self.sd1=Servo(14,initialPosition=90,lazy=servoLazy)
+            self.sd2=Servo(15,initialPosition=90,lazy=servoLazy)
+            self.sd3=Servo(16,initialPosition=90,lazy=servoLazy)
+            self.leftShoulder=Servo(17,initialPosition=90+60,lazy=servoLazy)
+            self.leftArm=Servo(18,initialPosition=90+40,lazy=servoLazy)
+            self.leftLowerArm=Servo(19,initialPosition=90+80,lazy=servoLazy)
+            self.mainRotor=Servo(20,initialPosition=0,lazy=servoLazy)
+            self.tailRotor=Servo(21,initialPosition=0,lazy=servoLazy)
+
+            self.upperBodyServos=[]
+            self.upperBodyServos.append(self.rightLowerArm) # 0
+            self.upperBodyServos.append(self.rightArm)       # 1
+            self.upperBodyServos.append(self.rightShoulder)  # 2
+            self.upperBodyServos.append(self.sd1)             # 3
+            self.upperBodyServos.append(self.sd2)             # 4
+            self.upperBodyServos.append(self.sd3)             # 5
+            self.upperBodyServos.append(self.leftShoulder)   # 6
+            self.upperBodyServos.append(self.leftArm)        # 7
+            self.upperBodyServos.append(self.leftLowerArm)  # 8
+            self.upperBodyServos.append(self.mainRotor)      # 9
+            self.upperBodyServos.append(self.tailRotor)      # 10
+            self.upperBodyGroup=ServoGroup(self.upperBodyServos)
+
+            # send the pulses of the multiplexed servos in the background
+            Servo.defaultBackend.multiplexer.start()
+
+        if calibrationData is not None:
+            calibrationData.apply(self.allServos())
+            if not lazy:
+                self.home()
+
+    # servos=allServos()
+    # returns the list of the attached and lazy servos of the robot
+    def allServos(self):
+        if hasattr(self,'upperBodyServos'):
+            return self.lowerBodyServos+self.upperBodyServos
+        return self.lowerBodyServos
+
+    # saveCalibration(filename='ravenms.cal')
+    # save the current calibration of all the servos, loaded by RavenMS(calibration=filename)
+    def saveCalibration(self,filename='ravenms.cal'):
+        Calibration.fromServos(self.allServos()).save(filename)
+
+    # home()
+    # move all the servos to their initial position, one batched write per group
+    def home(self):
+        self.lowerBodyGroup.home()
+        if hasattr(self,'upperBodyGroup'):
+            self.upperBodyGroup.home()
+
     def delay(self,ms):
-        print('RavenMS.delay(' + str(ms) + ')')
-        sleep(ms/1000)
+        if Log.level>=Log.DEBUG:
+            print('RavenMS.delay(' + str(ms) + ')')
+        Hal.clock.sleep(ms/1000)
     
-    def walk(self):
-        print('RavenMS.walk()')
-        # 1stand 1(100)
-        self.lowerBodyServos[0].write(90-40);        #right foot
-        self.lowerBodyServos[1].write(90-40+0);        #right lower leg
-        self.lowerBodyServos[2].write(90+40-0);        #right upper leg
-        self.lowerBodyServos[3].write(90-40);        #right hip
-        self.lowerBodyServos[4].write(90+40);       #left hip
-        self.lowerBodyServos[5].write(90-40+0);        #left upper leg
-        self.lowerBodyServos[6].write(90+40);        #left lower leg
-        self.lowerBodyServos[7].write(90+40);        #left foot
-        self.lowerBodyServos[8].write(90-40);        #low body
-        self.lowerBodyServos[9].write(90-40+0);       #upper body
-        self.delay(1000);
-        #2stand 2(1100)
-        self.lowerBodyServos[0].write(90-40);        #right foot
-        self.lowerBodyServos[1].write(90-40+30);        #right lower leg
-        self.lowerBodyServos[2].write(90+40-30);        #right upper leg
-        self.lowerBodyServos[3].write(90-40);        #right hip
-        self.lowerBodyServos[4].write(90+40);       #left hip
-        self.lowerBodyServos[5].write(90-40+30);        #left upper leg
-        self.lowerBodyServos[6].write(90+40-30);        #left lower leg
-        self.lowerBodyServos[7].write(90+40);        #left foot
-        self.lowerBodyServos[8].write(90-40);        #low body
-        self.lowerBodyServos[9].write(90-40+0);       #upper body
-        self.delay(200);
-        #3stand r side(1300)
-        self.lowerBodyServos[0].write(90-40-11);        #right foot
-        self.lowerBodyServos[1].write(90-40+30);        #right lower leg
-        self.lowerBodyServos[2].write(90+40-30);        #right upper leg
-        self.lowerBodyServos[3].write(90-40-11);        #right hip
-        self.lowerBodyServos[4].write(90+40-11);       #left hip
-        self.lowerBodyServos[5].write(90-40+30);        #left upper leg
-        self.lowerBodyServos[6].write(90+40-30);        #left lower leg
-        self.lowerBodyServos[7].write(90+40-11);        #left foot
-        self.lowerBodyServos[8].write(90-40);        #low body
-        self.lowerBodyServos[9].write(90-40+0);       #upper body
-        self.delay(200);
-        #4stand r foot(1500)
-        self.lowerBodyServos[0].write(90-40-11);        #right foot
-        self.lowerBodyServos[1].write(90-40+30);        #right lower leg
-        self.lowerBodyServos[2].write(90+40-30);        #right upper leg
-        self.lowerBodyServos[3].write(90-40-11);        #right hip
-        self.lowerBodyServos[4].write(90+40-11);       #left hip
-        self.lowerBodyServos[5].write(90-40+70);        #left upper leg
-        self.lowerBodyServos[6].write(90+40-70);        #left lower leg
-        self.lowerBodyServos[7].write(90+40-11);        #left foot
-        self.lowerBodyServos[8].write(90-40);        #low body
-        self.lowerBodyServos[9].write(90-40+0);       #upper body
-        self.delay(150);
-        #5stand r foot l foot forward(1650)
-        self.lowerBodyServos[0].write(90-40-12);        #right foot
-        self.lowerBodyServos[1].write(90-40+30);        #right lower leg
-        self.lowerBodyServos[2].write(90+40-30);        #right upper leg
-        self.lowerBodyServos[3].write(90-40-12);        #right hip
-        self.lowerBodyServos[4].write(90+40-12);       #left hip
-        self.lowerBodyServos[5].write(90-40+70);        #left upper leg
-        self.lowerBodyServos[6].write(90+40-0);        #left lower leg
-        self.lowerBodyServos[7].write(90+40-12);        #left foot
-        self.lowerBodyServos[8].write(90-40);        #low body
-        self.lowerBodyServos[9].write(90-40+0);       #upper body
-        self.delay(150);
-        #6stand r foot l foot down(1800)
-        self.lowerBodyServos[0].write(90-40-12);        #right foot
-        self.lowerBodyServos[1].write(90-40+30);        #right lower leg
-        self.lowerBodyServos[2].write(90+40-30);        #right upper leg
-        self.lowerBodyServos[3].write(90-40-12);        #right hip
-        self.lowerBodyServos[4].write(90+40-12);       #left hip
-        self.lowerBodyServos[5].write(90-40+50);        #left upper leg
-        self.lowerBodyServos[6].write(90+40-0);        #left lower leg
-        self.lowerBodyServos[7].write(90+40-12);        #left foot
-        self.lowerBodyServos[8].write(90-40);        #low body
-        self.lowerBodyServos[9].write(90-40+0);       #upper body
-        self.delay(150);
-        #7stand r foot l foot front1(1950)
-        self.lowerBodyServos[0].write(90-40-6);        #right foot
-        self.lowerBodyServos[1].write(90-40+35);        #right lower leg
-        self.lowerBodyServos[2].write(90+40-22.5);        #right upper leg
-        self.lowerBodyServos[3].write(90-40-6);        #right hip
-        self.lowerBodyServos[4].write(90+40-6);       #left hip
-        self.lowerBodyServos[5].write(90-40+35);        #left upper leg
-        self.lowerBodyServos[6].write(90+40-22.5);        #left lower leg
-        self.lowerBodyServos[7].write(90+40-6);        #left foot
-        self.lowerBodyServos[8].write(90-40);        #low body
-        self.lowerBodyServos[9].write(90-40+0);       #upper body
-        self.delay(100);
-        #8stand r foot l foot front2(2050)
-        self.lowerBodyServos[0].write(90-40-0);        #right foot
-        self.lowerBodyServos[1].write(90-40+40);        #right lower leg
-        self.lowerBodyServos[2].write(90+40-15);        #right upper leg
-        self.lowerBodyServos[3].write(90-40-0);        #right hip
-        self.lowerBodyServos[4].write(90+40-0);       #left hip
-        self.lowerBodyServos[5].write(90-40+40);        #left upper leg
-        self.lowerBodyServos[6].write(90+40-15);        #left lower leg
-        self.lowerBodyServos[7].write(90+40-0);        #left foot
-        self.lowerBodyServos[8].write(90-40);        #low body
-        self.lowerBodyServos[9].write(90-40+0);       #upper body
-        self.delay(100);
-        #8stand r foot l foot front3(2150)
-        self.lowerBodyServos[0].write(90-40+8);        #right foot
-        self.lowerBodyServos[1].write(90-40+45);        #right lower leg
-        self.lowerBodyServos[2].write(90+40-7.5);        #right upper leg
-        self.lowerBodyServos[3].write(90-40+8);        #right hip
-        self.lowerBodyServos[4].write(90+40+8);       #left hip
-        self.lowerBodyServos[5].write(90-40+35);        #left upper leg
-        self.lowerBodyServos[6].write(90+40-22.5);        #left lower leg
-        self.lowerBodyServos[7].write(90+40+8);        #left foot
-        self.lowerBodyServos[8].write(90-40);        #low body
-        self.lowerBodyServos[9].write(90-40+0);       #upper body
-        self.delay(100);
-        #10stand l side l foot front(2250)
-        self.lowerBodyServos[0].write(90-40+16);        #right foot
-        self.lowerBodyServos[1].write(90-40+50);        #right lower leg
-        self.lowerBodyServos[2].write(90+40-0);        #right upper leg
-        self.lowerBodyServos[3].write(90-40+16);        #right hip
-        self.lowerBodyServos[4].write(90+40+16);       #left hip
-        self.lowerBodyServos[5].write(90-40+30);        #left upper leg
-        self.lowerBodyServos[6].write(90+40-30);        #left lower leg
-        self.lowerBodyServos[7].write(90+40+16);        #left foot
-        self.lowerBodyServos[8].write(90-40);        #low body
-        self.lowerBodyServos[9].write(90-40+0);       #upper body
-        self.delay(200);
-        #11stand l  foot (2450)
-        self.lowerBodyServos[0].write(90-40+16);        #right foot
-        self.lowerBodyServos[1].write(90-40+70);        #right lower leg
-        self.lowerBodyServos[2].write(90+40-70);        #right upper leg
-        self.lowerBodyServos[3].write(90-40+16);        #right hip
-        self.lowerBodyServos[4].write(90+40+16);       #left hip
-        self.lowerBodyServos[5].write(90-40+30);        #left upper leg
-        self.lowerBodyServos[6].write(90+40-30);        #left lower leg
-        self.lowerBodyServos[7].write(90+40+16);        #left foot
-        self.lowerBodyServos[8].write(90-40);        #low body
-        self.lowerBodyServos[9].write(90-40+0);       #upper body
-        self.delay(150);
-        #12stand l foot r foot forward (2600)
-        self.lowerBodyServos[0].write(90-40+19);        #right foot
-        self.lowerBodyServos[1].write(90-40+0);        #right lower leg
-        self.lowerBodyServos[2].write(90+40-70);        #right upper leg
-        self.lowerBodyServos[3].write(90-40+16);        #right hip
-        self.lowerBodyServos[4].write(90+40+16);       #left hip
-        self.lowerBodyServos[5].write(90-40+30);        #left upper leg
-        self.lowerBodyServos[6].write(90+40-30);        #left lower leg
-        self.lowerBodyServos[7].write(90+40+19);        #left foot
-        self.lowerBodyServos[8].write(90-40);        #low body
-        self.lowerBodyServos[9].write(90-40+0);       #upper body
-        self.delay(150);
-        #13stand l foot r foot down(2750)
-        self.lowerBodyServos[0].write(90-40+16);        #right foot
-        self.lowerBodyServos[1].write(90-40+0);        #right lower leg
-        self.lowerBodyServos[2].write(90+40-50);        #right upper leg
-        self.lowerBodyServos[3].write(90-40+16);        #right hip
-        self.lowerBodyServos[4].write(90+40+16);       #left hip
-        self.lowerBodyServos[5].write(90-40+30);        #left upper leg
-        self.lowerBodyServos[6].write(90+40-30);        #left lower leg
-        self.lowerBodyServos[7].write(90+40+16);        #left foot
-        self.lowerBodyServos[8].write(90-40);        #low body
-        self.lowerBodyServos[9].write(90-40+0);       #upper body
-        self.delay(150);
-        #14stand l foot r foot front1(2900)
-        self.lowerBodyServos[0].write(90-40+8);        #right foot
-        self.lowerBodyServos[1].write(90-40+7.5);        #right lower leg
-        self.lowerBodyServos[2].write(90+40-45);        #right upper leg
-        self.lowerBodyServos[3].write(90-40+0);        #right hip
-        self.lowerBodyServos[4].write(90+40+8);       #left hip
-        self.lowerBodyServos[5].write(90-40+22.5);        #left upper leg
-        self.lowerBodyServos[6].write(90+40-35);        #left lower leg
-        self.lowerBodyServos[7].write(90+40+8);        #left foot
-        self.lowerBodyServos[8].write(90-40);        #low body
-        self.lowerBodyServos[9].write(90-40+0);       #upper body
-        self.delay(100);
-        #5stand l foot r foot front2(3000)
-        self.lowerBodyServos[0].write(90-40+0);        #right foot
-        self.lowerBodyServos[1].write(90-40+15);        #right lower leg
-        self.lowerBodyServos[2].write(90+40-40);        #right upper leg
-        self.lowerBodyServos[3].write(90-40+0);        #right hip
-        self.lowerBodyServos[4].write(90+40+0);       #left hip
-        self.lowerBodyServos[5].write(90-40+15);        #left upper leg
-        self.lowerBodyServos[6].write(90+40-40);        #left lower leg
-        self.lowerBodyServos[7].write(90+40+0);        #left foot
-        self.lowerBodyServos[8].write(90-40);        #low body
-        self.lowerBodyServos[9].write(90-40+0);       #upper body
-        self.delay(100);
-        #16stand l foot r foot front3(3100)
-        self.lowerBodyServos[0].write(90-40-5);        #right foot
-        self.lowerBodyServos[1].write(90-40+22.5);        #right lower leg
-        self.lowerBodyServos[2].write(90+40-35);        #right upper leg
-        self.lowerBodyServos[3].write(90-40-5);        #right hip
-        self.lowerBodyServos[4].write(90+40-5);       #left hip
-        self.lowerBodyServos[5].write(90-40+7.5);        #left upper leg
-        self.lowerBodyServos[6].write(90+40-45);        #left lower leg
-        self.lowerBodyServos[7].write(90+40-5);        #left foot
-        self.lowerBodyServos[8].write(90-40);        #low body
-        self.lowerBodyServos[9].write(90-40+0);       #upper body
-        self.delay(100);
-        #17stand r side r foot front(3200)
-        self.lowerBodyServos[0].write(90-40-10);        #right foot
-        self.lowerBodyServos[1].write(90-40+30);        #right lower leg
-        self.lowerBodyServos[2].write(90+40-30);        #right upper leg
-        self.lowerBodyServos[3].write(90-40-10);        #right hip
-        self.lowerBodyServos[4].write(90+40-10);       #left hip
-        self.lowerBodyServos[5].write(90-40+0);        #left upper leg
-        self.lowerBodyServos[6].write(90+40-50);        #left lower leg
-        self.lowerBodyServos[7].write(90+40-10);        #left foot
-        self.lowerBodyServos[8].write(90-40);        #low body
-        self.lowerBodyServos[9].write(90-40+0);       #upper body
-        self.delay(250);
-        #18stand r foot(3450)
-        self.lowerBodyServos[0].write(90-40-11);        #right foot
-        self.lowerBodyServos[1].write(90-40+30);        #right lower leg
-        self.lowerBodyServos[2].write(90+40-30);        #right upper leg
-        self.lowerBodyServos[3].write(90-40-11);        #right hip
-        self.lowerBodyServos[4].write(90+40-11);       #left hip
-        self.lowerBodyServos[5].write(90-40+70);        #left upper leg
-        self.lowerBodyServos[6].write(90+40-70);        #left lower leg
-        self.lowerBodyServos[7].write(90+40-11);        #left foot
-        self.lowerBodyServos[8].write(90-40);        #low body
-        self.lowerBodyServos[9].write(90-40+0);       #upper body
-        self.delay(150);
-        #1stand 1(11750)
-        self.lowerBodyServos[0].write(90-40);        #right foot
-        self.lowerBodyServos[1].write(90-40+0);        #right lower leg
-        self.lowerBodyServos[2].write(90+40-0);        #right upper leg
-        self.lowerBodyServos[3].write(90-40);        #right hip
-        self.lowerBodyServos[4].write(90+40);       #left hip
-        self.lowerBodyServos[5].write(90-40+0);        #left upper leg
-        self.lowerBodyServos[6].write(90+40);        #left lower leg
-        self.lowerBodyServos[7].write(90+40);        #left foot
-        self.lowerBodyServos[8].write(90-40);        #low body
-        self.lowerBodyServos[9].write(90-40+0);       #upper body
-        self.delay(2000);
-        
-    def lb_transform_human_heli(self):
-        # stand 1
-        self.lowerBodyServos[0].write(90-40);        # right foot
-        self.lowerBodyServos[1].write(90-40);        # right lower leg
-        self.lowerBodyServos[2].write(90+40);        # right upper leg
-        self.lowerBodyServos[3].write(90-40);        # right hip
-        self.lowerBodyServos[4].write(90+40);       # left hip
-        self.lowerBodyServos[5].write(90-40);        # left upper leg
-        self.lowerBodyServos[6].write(90+40);        # left lower leg
-        self.lowerBodyServos[7].write(90+40);        # left foot
-        self.lowerBodyServos[8].write(90-40);        # low body
-        self.lowerBodyServos[9].write(90-40);       # upper body
-        self.delay(10000);
-        
-        # stand 2
-        self.lowerBodyServos[0].write(90-40);        # right foot
-        self.lowerBodyServos[1].write(90-40+80);        # right lower leg
-        self.lowerBodyServos[2].write(90+40-80);        # right upper leg
-        self.lowerBodyServos[3].write(90-40);        # right hip
-        self.lowerBodyServos[4].write(90+40);       # left hip
-        self.lowerBodyServos[5].write(90-40+80);        # left upper leg
-        self.lowerBodyServos[6].write(90+40-80);        # left lower leg
-        self.lowerBodyServos[7].write(90+40);        # left foot
-        self.lowerBodyServos[8].write(90-40);        # low body
-        self.lowerBodyServos[9].write(90-40);       # upper body
-        self.delay(500);
+    # setInterpolation(profile,period_ms=20)
+    # blend the joints from one pose to the next over each frame duration
+    # following a MotionProfile class such as TriangularMotionProfile,
+    # the servos being updated every period_ms
+    # profile=None snaps the servos to each pose (default)
+    def setInterpolation(self,profile,period_ms=20):
+        self.interpolation=profile
+        self.interpolationPeriod_ms=period_ms
 
-        # stand 3
-        self.lowerBodyServos[0].write(90-40);        # right foot
-        self.lowerBodyServos[1].write(90-40+80);        # right lower leg
-        self.lowerBodyServos[2].write(90+40-80);        # right upper leg
-        self.lowerBodyServos[3].write(90-40);        # right hip
-        self.lowerBodyServos[4].write(90+40);       # left hip
-        self.lowerBodyServos[5].write(90-40+80);        # left upper leg
-        self.lowerBodyServos[6].write(90+40-80);        # left lower leg
-        self.lowerBodyServos[7].write(90+40);        # left foot
-        self.lowerBodyServos[8].write(90-40);        # low body
-        self.lowerBodyServos[9].write(90-40+90);       # upper body
-        self.delay(500);
-        
-        # stand 4
-        self.lowerBodyServos[0].write(90-40);        # right foot
-        self.lowerBodyServos[1].write(90-40+80);        # right lower leg
-        self.lowerBodyServos[2].write(90+40-80);        # right upper leg
-        self.lowerBodyServos[3].write(90-40);        # right hip
-        self.lowerBodyServos[4].write(90+40);       # left hip
-        self.lowerBodyServos[5].write(90-40+80);        # left upper leg
-        self.lowerBodyServos[6].write(90+40-80);        # left lower leg
-        self.lowerBodyServos[7].write(90+40);        # left foot
-        self.lowerBodyServos[8].write(90-40+85);        # low body
-        self.lowerBodyServos[9].write(90-40+90);       # upper body
-        self.delay(500);
+    # checker=setSafety(enabled=True)
+    # check the motions before playing them: play() raises ValueError instead of
+    # playing a motion too fast or with colliding joints (see SafetyChecker.py)
+    # the motions of the robot are checked here, once
+    def setSafety(self,enabled=True):
+        if not enabled:
+            self.safety=None
+            return None
+        from SafetyChecker import SafetyChecker
+        self.safety=SafetyChecker(self.lowerBodyServos,forbidden=LB_FORBIDDEN)
+        for keyframes in (WALK,LB_TRANSFORM_HUMAN_HELI,LB_TRANSFORM_HELI_HUMAN):
+            self.safety.check(keyframes)
+        return self.safety
 
-        # stand 5
-        self.lowerBodyServos[0].write(90-40);        # right foot
-        self.lowerBodyServos[1].write(90-40+80);        # right lower leg
-        self.lowerBodyServos[2].write(90+40-80);        # right upper leg
-        self.lowerBodyServos[3].write(90-40);        # right hip
-        self.lowerBodyServos[4].write(90+40);       # left hip
-        self.lowerBodyServos[5].write(90-40+80);        # left upper leg
-        self.lowerBodyServos[6].write(90+40-80);        # left lower leg
-        self.lowerBodyServos[7].write(90+40);        # left foot
-        self.lowerBodyServos[8].write(90-40+85);        # low body
-        self.lowerBodyServos[9].write(90-40+90);       # upper body
-        self.delay(500);
-        
-    def lb_transform_heli_human(self):
-        # stand 1
-        self.lowerBodyServos[0].write(90-40);        # right foot
-        self.lowerBodyServos[1].write(90-40+80);        # right lower leg
-        self.lowerBodyServos[2].write(90+40-80);        # right upper leg
-        self.lowerBodyServos[3].write(90-40);        # right hip
-        self.lowerBodyServos[4].write(90+40);       # left hip
-        self.lowerBodyServos[5].write(90-40+80);        # left upper leg
-        self.lowerBodyServos[6].write(90+40-80);        # left lower leg
-        self.lowerBodyServos[7].write(90+40);        # left foot
-        self.lowerBodyServos[8].write(90-40+90);        # low body
-        self.lowerBodyServos[9].write(90-40+90);       # upper body
-        self.delay(5000);
-        
-        # stand 2
-        self.lowerBodyServos[0].write(90-40);        # right foot
-        self.lowerBodyServos[1].write(90-40+80);        # right lower leg
-        self.lowerBodyServos[2].write(90+40-80);        # right upper leg
-        self.lowerBodyServos[3].write(90-40);        # right hip
-        self.lowerBodyServos[4].write(90+40);       # left hip
-        self.lowerBodyServos[5].write(90-40+80);        # left upper leg
-        self.lowerBodyServos[6].write(90+40-80);        # left lower leg
-        self.lowerBodyServos[7].write(90+40);        # left foot
-        self.lowerBodyServos[8].write(90-40+90);        # low body
-        self.lowerBodyServos[9].write(90-40+90);       # upper body
-        self.delay(500);
+    # play(keyframes)
+    # play a keyframe sequence on the lower body servos
+    def play(self,keyframes):
+        if self.safety is not None and not self.safety.isSafe(keyframes):
+            raise ValueError('RavenMS.play(): unsafe motion, see SafetyChecker.report()')
+        if self.interpolation is None:
+            keyframes.play(self.lowerBodyGroup,self.delay)
+        else:
+            keyframes.blend(self.lowerBodyGroup,self.interpolationPeriod_ms,self.interpolation)
 
-        # stand 3
-        self.lowerBodyServos[0].write(90-40);        # right foot
-        self.lowerBodyServos[1].write(90-40+80);        # right lower leg
-        self.lowerBodyServos[2].write(90+40-80);        # right upper leg
-        self.lowerBodyServos[3].write(90-40);        # right hip
-        self.lowerBodyServos[4].write(90+40);       # left hip
-        self.lowerBodyServos[5].write(90-40+80);        # left upper leg
-        self.lowerBodyServos[6].write(90+40-80);        # left lower leg
-        self.lowerBodyServos[7].write(90+40);        # left foot
-        self.lowerBodyServos[8].write(90-40);        # low body
-        self.lowerBodyServos[9].write(90-40+90);       # upper body
-        self.delay(500);
+    # playFile(filename)
+    # stream a motion file (see MotionFile.py) on the lower body servos
+    def playFile(self,filename):
+        from MotionFile import MotionFileReader
+        reader=MotionFileReader(filename)
+        try:
+            reader.play(self.lowerBodyGroup)
+        finally:
+            reader.close()
 
-        # stand 12
-        self.lowerBodyServos[0].write(90-40);        # right foot
-        self.lowerBodyServos[1].write(90-40+80);        # right lower leg
-        self.lowerBodyServos[2].write(90+40-80);        # right upper leg
-        self.lowerBodyServos[3].write(90-40);        # right hip
-        self.lowerBodyServos[4].write(90+40);       # left hip
-        self.lowerBodyServos[5].write(90-40+80);        # left upper leg
-        self.lowerBodyServos[6].write(90+40-80);        # left lower leg
-        self.lowerBodyServos[7].write(90+40);        # left foot
-        self.lowerBodyServos[8].write(90-40);        # low body
-        self.lowerBodyServos[9].write(90-40+0);       # upper body
-        self.delay(500);
-    
-        # stand 16
-        self.lowerBodyServos[0].write(90-40);        # right foot
-        self.lowerBodyServos[1].write(90-40+0);        # right lower leg
-        self.lowerBodyServos[2].write(90+40-0);        # right upper leg
-        self.lowerBodyServos[3].write(90-40);        # right hip
-        self.lowerBodyServos[4].write(90+40);       # left hip
-        self.lowerBodyServos[5].write(90-40+0);        # left upper leg
-        self.lowerBodyServos[6].write(90+40-0);        # left lower leg
-        self.lowerBodyServos[7].write(90+40);        # left foot
-        self.lowerBodyServos[8].write(90-40);        # low body
-        self.lowerBodyServos[9].write(90-40+0);       # upper body
-        self.delay(500);
+    def walk(self):
+        if Log.level>=Log.INFO:
+            print('RavenMS.walk()')
+        self.play(WALK)
+
+    def lb_transform_human_heli(self):
+        self.play(LB_TRANSFORM_HUMAN_HELI)
+
+    def lb_transform_heli_human(self):
+        self.play(LB_TRANSFORM_HELI_HUMAN)
 
 if __name__ == "__main__":
-   ravenms=RavenMS()
+   ravenms=RavenMS(calibration='ravenms.cal') # saved on the board by saveCalibration()
    ravenms.walk()
    
    ravenms.lb_transform_human_heli()
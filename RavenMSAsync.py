@@ -0,0 +1,204 @@
+# RavenMSAsync.py: uasyncio behavior runtime for the Raven MS robot
+# Copyright (C) 2022 Vincent Mistler (YouMakeTech)
+#
+# The motions of RavenMS block the program in time.sleep() until they end.
+# RavenMSAsync plays the same motions as asyncio tasks: the board keeps
+# reading its sensors and answering commands while the robot moves, and
+# a motion can be aborted at any time by cancelling its task.
+#
+# The poses are sent to the servos by a separate task ticking at a fixed rate.
+# A cancelled motion brings the robot back to a safe pose (standing) with
+# a smooth move performed by that task, without blocking the event loop.
+#
+# >>> import uasyncio as asyncio
+# >>> robot=RavenMSAsync(RavenMS())
+# >>> async def main():
+# ...     robot.start()
+# ...     task=robot.startMotion(robot.walk())
+# ...     await asyncio.sleep_ms(3000)
+# ...     task.cancel()             # stop walking and stand still
+# >>> asyncio.run(main())
+#
+# Under CPython, Hal.simulate() runs the tasks in simulated time.
+
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+from array import array
+from Hal import Hal
+from Log import Log
+from MotionScheduler import MotionScheduler
+from Instrumentation import Instrumentation
+from RavenMS import WALK, LB_TRANSFORM_HUMAN_HELI, LB_TRANSFORM_HELI_HUMAN
+
+# await sleep_ms(ms)
+# non-blocking sleep on the clock of Hal
+def sleep_ms(ms):
+    clock=Hal.clock
+    if hasattr(clock,'asleep_ms'):
+        return clock.asleep_ms(ms) # host or simulated clock
+    return asyncio.sleep_ms(ms)
+
+class RavenMSAsync:
+    # RavenMSAsync(ravenms,period_ms=20,safePoseDuration_ms=1000)
+    # ravenms is the RavenMS robot to drive
+    # period_ms is the period of the servo update task (20ms=50Hz)
+    # safePoseDuration_ms is the duration of the move back to the safe pose
+    def __init__(self,ravenms,period_ms=20,safePoseDuration_ms=1000):
+        self.ravenms=ravenms
+        self.group=ravenms.lowerBodyGroup
+        self.period_ms=period_ms
+        self.safePoseDuration_ms=safePoseDuration_ms
+        self.scheduler=MotionScheduler(period_ms) # smooth moves such as the return to the safe pose
+        # safe pose: standing, the first frame of the walk cycle
+        self.safePose=array('f',(WALK.getAngle(0,joint) for joint in range(WALK.jointCount)))
+
+        # internal variables
+        self._pose=array('f',(0 for servo in self.group)) # pose to send on the next tick
+        self._poseChanged=False
+        self._servoTask=None
+        self._motionTask=None
+
+    # start()
+    # start the servo update task
+    def start(self):
+        if self._servoTask is None:
+            self._servoTask=asyncio.create_task(self._servoLoop())
+
+    # stop()
+    # cancel the motion in progress and the servo update task
+    # the servos hold their last position
+    def stop(self):
+        self.cancelMotion()
+        if self._servoTask is not None:
+            self._servoTask.cancel()
+            self._servoTask=None
+
+    # task=startMotion(motion)
+    # run a motion coroutine such as walk() as a task, cancelling the motion in progress
+    def startMotion(self,motion):
+        self.cancelMotion()
+        self._motionTask=asyncio.create_task(motion)
+        return self._motionTask
+
+    # cancelMotion()
+    # cancel the motion started by startMotion(), if any
+    def cancelMotion(self):
+        if self._motionTask is not None:
+            self._motionTask.cancel()
+            self._motionTask=None
+
+    # await play(keyframes)
+    # play a keyframe sequence on the lower body servos
+    # when cancelled, the robot moves back to the safe pose
+    # raises ValueError if ravenms.safety refuses the sequence (see RavenMS.setSafety)
+    async def play(self,keyframes):
+        safety=self.ravenms.safety
+        if safety is not None and not safety.isSafe(keyframes):
+            raise ValueError('RavenMSAsync.play(): unsafe motion, see SafetyChecker.report()')
+        jointCount=keyframes.jointCount
+        angles=keyframes.angles
+        pose=self._pose
+        row=0
+        try:
+            for duration in keyframes.durations:
+                self.scheduler.stop() # a new pose overrides the smooth moves
+                for joint in range(jointCount):
+                    pose[joint]=angles[row+joint]
+                self._poseChanged=True
+                row+=jointCount
+                await sleep_ms(duration)
+        except asyncio.CancelledError:
+            self.goToSafePose()
+            raise
+
+    # goToSafePose()
+    # start a smooth move to the safe pose and return immediately
+    # the move is performed by the servo update task
+    def goToSafePose(self):
+        if Log.level>=Log.INFO:
+            print('RavenMSAsync.goToSafePose()')
+        self._poseChanged=False # drop the pose of the cancelled motion
+        safePose=self.safePose
+        i=0
+        for servo in self.group:
+            self.scheduler.move(servo,safePose[i],duration_ms=self.safePoseDuration_ms)
+            i+=1
+
+    async def walk(self):
+        if Log.level>=Log.INFO:
+            print('RavenMSAsync.walk()')
+        await self.play(WALK)
+
+    async def lb_transform_human_heli(self):
+        await self.play(LB_TRANSFORM_HUMAN_HELI)
+
+    async def lb_transform_heli_human(self):
+        await self.play(LB_TRANSFORM_HELI_HUMAN)
+
+    # servo update task: sends the latest pose and advances the smooth moves
+    # every period_ms, skipping the missed ticks when late
+    async def _servoLoop(self):
+        clock=Hal.clock
+        nextTick=clock.ticks_ms()
+        while True:
+            if self._poseChanged:
+                self._poseChanged=False
+                self.group.write(self._pose)
+            self.scheduler.tick() # also records its period with Instrumentation.tick()
+            nextTick=clock.ticks_add(nextTick,self.period_ms)
+            delay=clock.ticks_diff(nextTick,clock.ticks_ms())
+            if delay<=-self.period_ms:
+                # late by one period or more: skip the missed ticks
+                if Instrumentation.enabled:
+                    Instrumentation.late(-1000*delay)
+                nextTick=clock.ticks_ms()
+            if delay<0:
+                delay=0
+            await sleep_ms(delay)
+
+if __name__ == "__main__":
+    from RavenMS import RavenMS
+    Log.setLevel(Log.OFF)
+    clock=Hal.simulate()
+    robot=RavenMSAsync(RavenMS())
+    foot=robot.ravenms.rightFoot
+    ticks=[0]
+
+    async def sensors():
+        # another task keeps running while the robot walks
+        while True:
+            ticks[0]+=1
+            await sleep_ms(100)
+
+    async def main():
+        robot.start()
+        sensorTask=asyncio.create_task(sensors())
+
+        # a whole walk cycle
+        start_ms=clock.ticks_ms()
+        await robot.walk()
+        assert(clock.ticks_ms()-start_ms==WALK.totalDuration())
+        assert(ticks[0]>=WALK.totalDuration()//100)
+        await sleep_ms(robot.period_ms)
+        assert(foot.microseconds==foot.positionToMicroseconds(WALK.getAngle(WALK.frameCount()-1,0)))
+
+        # cancel in the middle of the 4th frame: back to the safe pose
+        task=robot.startMotion(robot.walk())
+        await sleep_ms(1475)
+        assert(foot.microseconds==foot.positionToMicroseconds(WALK.getAngle(3,0)))
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        assert(robot.scheduler.moveInProgress())
+        await sleep_ms(robot.safePoseDuration_ms+robot.period_ms)
+        assert(not robot.scheduler.moveInProgress())
+        assert(foot.microseconds==foot.angleToMicroseconds(robot.safePose[0]))
+
+        sensorTask.cancel()
+        robot.stop()
+
+    asyncio.run(main())
@@ -0,0 +1,597 @@
+# RemoteControl.py: Binary command protocol to drive a robot over UART or USB serial in MicroPython
+# Copyright (C) 2022 Vincent Mistler (YouMakeTech)
+#
+# A host streams poses to the robot at 50-100Hz, or starts its motions,
+# with compact binary frames instead of Python calls at the REPL.
+#
+# On the board:
+# >>> from machine import UART
+# >>> server=RemoteServer(RavenMS(),UART(0,115200,timeout=0))
+# >>> server.serve()                 # or server.poll() from the main loop
+# On the host (see remoteClient.py):
+# >>> client=RemoteClient(serial.Serial('/dev/ttyACM0',timeout=0))
+# >>> client.ack(client.setPose(angles))
+#
+# Frame format (little-endian):
+#     1 byte   sync 0xa5
+#     1 byte   type
+#     2 bytes  sequence number, chosen by the host and echoed in the replies
+#     1 byte   payload length (up to MAX_PAYLOAD)
+#     payload
+#     1 byte   checksum: sum modulo 256 of the bytes from type to the end of the payload
+# Commands (host to robot), the angles being unsigned 16-bit in 1/ANGLE_SCALE degree:
+#     SET_POSE    one angle per servo of the group
+#     SET_JOINTS  batch of (1 byte joint index, angle) pairs
+#     PLAY        1 byte motion index in RemoteServer.motions
+#     STOP        stop the motion, the servos hold their position
+#     QUERY       ask for the state
+#     TIME        ask for the clock of the robot
+#     POSE_AT     unsigned 32-bit time in ms on the clock of the robot, then one angle per servo:
+#                 the pose is queued and sent to the servos at that time (see Fleet.py)
+# Replies (robot to host):
+#     ACK         1 byte status: OK, UNKNOWN_COMMAND, BAD_PAYLOAD, STALE, FULL or UNSAFE
+#     STATE       1 byte flags (bit 0: motion playing) then one angle per servo
+#     CLOCK       unsigned 32-bit ticks_ms() of the robot
+# Poses older than the last pose received (sequence numbers out of order) are rejected as STALE.
+# SET_POSE, SET_JOINTS, PLAY and STOP drop the queued poses.
+# PLAY is answered UNSAFE, and the motion is not played, when ravenms.safety
+# refuses it (see RavenMS.setSafety).
+# The frames are parsed and the replies built in preallocated buffers.
+# The received angles stay integers in 1/ANGLE_SCALE degree until _write()
+# converts them to pulse widths for the servos.
+
+from array import array
+from Hal import Hal
+from Log import Log
+from MotionFile import ANGLE_SCALE
+
+SYNC=0xa5
+MAX_PAYLOAD=64
+_HEADER_SIZE=5
+
+# commands
+SET_POSE=0x01
+SET_JOINTS=0x02
+PLAY=0x03
+STOP=0x04
+QUERY=0x05
+TIME=0x06
+POSE_AT=0x07
+# replies
+ACK=0x80
+STATE=0x81
+CLOCK=0x82
+# status of ACK
+OK=0
+UNKNOWN_COMMAND=1
+BAD_PAYLOAD=2
+STALE=3
+FULL=4
+UNSAFE=5
+
+# checksum of frame[1:end]
+def _checksum(frame,end):
+    total=0
+    for i in range(1,end):
+        total+=frame[i]
+    return total&0xff
+
+# size=_seal(frame,type,sequence,length)
+# write the header and the checksum around the payload already in frame
+# returns the size of the frame
+def _seal(frame,type,sequence,length):
+    frame[0]=SYNC
+    frame[1]=type
+    frame[2]=sequence&0xff
+    frame[3]=(sequence>>8)&0xff
+    frame[4]=length
+    end=_HEADER_SIZE+length
+    frame[end]=_checksum(frame,end)
+    return end+1
+
+# returns the unsigned 32-bit time at the beginning of the payload of a frame
+def _getTime(frame):
+    i=_HEADER_SIZE
+    return frame[i]|(frame[i+1]<<8)|(frame[i+2]<<16)|(frame[i+3]<<24)
+
+# Incremental parser of the frames received from a stream
+class FrameParser:
+    # FrameParser(maxPayload=MAX_PAYLOAD,chunkSize=32)
+    # chunkSize bytes are read from the stream at once
+    def __init__(self,maxPayload=MAX_PAYLOAD,chunkSize=32):
+        self.frame=bytearray(_HEADER_SIZE+maxPayload+1) # last frame received
+        self.errors=0 # frames dropped: bad length or checksum
+        self._count=0 # bytes of the frame received so far
+        self._chunk=bytearray(chunkSize)
+        self._chunkLength=0
+        self._chunkIndex=0
+
+    # ready=receive(stream)
+    # read from the stream until a whole frame is received and return True,
+    # or return False when the stream has no more bytes available
+    # the stream must return None or 0 from readinto() instead of blocking
+    def receive(self,stream):
+        frame=self.frame
+        chunk=self._chunk
+        while True:
+            if self._chunkIndex>=self._chunkLength:
+                n=stream.readinto(chunk)
+                if not n:
+                    return False
+                self._chunkLength=n
+                self._chunkIndex=0
+            byte=chunk[self._chunkIndex]
+            self._chunkIndex+=1
+            count=self._count
+            if count==0 and byte!=SYNC:
+                continue # resynchronize
+            frame[count]=byte
+            count+=1
+            if count==_HEADER_SIZE and _HEADER_SIZE+byte+1>len(frame):
+                self.errors+=1
+                count=0
+            elif count>_HEADER_SIZE and count==_HEADER_SIZE+frame[4]+1:
+                self._count=0
+                if frame[count-1]==_checksum(frame,count-1):
+                    return True
+                self.errors+=1
+                continue
+            self._count=count
+
+    # type of the last frame received
+    def type(self):
+        return self.frame[1]
+
+    # sequence number of the last frame received
+    def sequence(self):
+        return self.frame[2]|(self.frame[3]<<8)
+
+    # payload length of the last frame received
+    def length(self):
+        return self.frame[4]
+
+class RemoteServer:
+    # RemoteServer(ravenms,stream,group=None,queueSize=8,clock=None)
+    # executes the commands received from stream, e.g. a machine.UART with timeout=0
+    # group is the ServoGroup of the poses, the lower body of ravenms by default
+    # queueSize is the max. number of poses waiting for their time (POSE_AT)
+    # clock is the clock of the timed commands, Hal.clock by default
+    def __init__(self,ravenms,stream,group=None,queueSize=8,clock=None):
+        from RavenMS import WALK, LB_TRANSFORM_HUMAN_HELI, LB_TRANSFORM_HELI_HUMAN
+        self.ravenms=ravenms
+        self.stream=stream
+        self.group=ravenms.lowerBodyGroup if group is None else group
+        self.clock=Hal.clock if clock is None else clock
+        self.motions=[WALK,LB_TRANSFORM_HUMAN_HELI,LB_TRANSFORM_HELI_HUMAN] # played by PLAY
+        self.parser=FrameParser()
+        self.commands=0 # number of commands executed
+        self.rejected=0 # number of commands answered with another status than OK
+
+        # internal variables
+        jointCount=len(self.group)
+        self._pose=array('H',(int(angle*ANGLE_SCALE+0.5) for angle in self.group.read())) # in 1/ANGLE_SCALE degree
+        self._pulses=array('H',(0 for i in range(jointCount))) # pulse widths in µs sent by _write()
+        self._ack=bytearray(_HEADER_SIZE+1+1)
+        self._state=bytearray(_HEADER_SIZE+1+2*jointCount+1)
+        self._clock=bytearray(_HEADER_SIZE+4+1)
+        # queue of the timed poses: ring buffer of queueSize poses and their times
+        self._queue=array('H',(0 for i in range(queueSize*jointCount)))
+        self._times=array('i',(0 for i in range(queueSize)))
+        self._queueHead=0
+        self._queueCount=0
+        self._lastPose=-1 # sequence number of the last pose
+        self._motion=None # keyframes being played
+        self._frame=0
+        self._deadline=0
+
+    # count=poll()
+    # execute the commands received since the last call, advance the motion
+    # being played and return immediately with the number of commands executed
+    def poll(self):
+        count=0
+        while self.parser.receive(self.stream):
+            self._execute()
+            count+=1
+        if self._motion is not None:
+            self._playFrames()
+        if self._queueCount>0:
+            self._playQueue()
+        return count
+
+    # serve()
+    # execute the commands forever
+    def serve(self):
+        if Log.level>=Log.INFO:
+            print('RemoteServer.serve()')
+        while True:
+            if self.poll()==0:
+                self.clock.sleep_ms(1)
+
+    def _execute(self):
+        parser=self.parser
+        frame=parser.frame
+        type=parser.type()
+        length=parser.length()
+        sequence=parser.sequence()
+        jointCount=len(self._pose)
+        self.commands+=1
+        status=OK
+        if type==SET_POSE:
+            if length!=2*jointCount:
+                status=BAD_PAYLOAD
+            elif not self._fresh(sequence):
+                status=STALE
+            else:
+                pose=self._pose
+                for joint in range(jointCount):
+                    i=_HEADER_SIZE+2*joint
+                    pose[joint]=frame[i]|(frame[i+1]<<8)
+                self._stopMotion()
+                self._write(pose,0)
+        elif type==SET_JOINTS:
+            status=BAD_PAYLOAD if length%3 else OK
+            for i in range(_HEADER_SIZE,_HEADER_SIZE+length-2,3):
+                if frame[i]>=jointCount:
+                    status=BAD_PAYLOAD
+            if status==OK and not self._fresh(sequence):
+                status=STALE
+            if status==OK:
+                pose=self._pose
+                for i in range(_HEADER_SIZE,_HEADER_SIZE+length,3):
+                    pose[frame[i]]=frame[i+1]|(frame[i+2]<<8)
+                self._stopMotion()
+                self._write(pose,0)
+        elif type==PLAY:
+            if length!=1 or frame[_HEADER_SIZE]>=len(self.motions) \
+               or self.motions[frame[_HEADER_SIZE]].jointCount!=jointCount:
+                status=BAD_PAYLOAD
+            elif self.ravenms.safety is not None and not self.ravenms.safety.isSafe(self.motions[frame[_HEADER_SIZE]]):
+                status=UNSAFE
+            else:
+                self._stopMotion()
+                self._motion=self.motions[frame[_HEADER_SIZE]]
+                self._frame=0
+                self._deadline=self.clock.ticks_ms()
+        elif type==STOP:
+            self._stopMotion()
+        elif type==QUERY:
+            self._sendState(sequence)
+            return
+        elif type==TIME:
+            self._sendClock(sequence)
+            return
+        elif type==POSE_AT:
+            if length!=4+2*jointCount:
+                status=BAD_PAYLOAD
+            elif self._queueCount==len(self._times):
+                status=FULL
+            else:
+                self._enqueue(frame)
+        else:
+            status=UNKNOWN_COMMAND
+        if status!=OK:
+            self.rejected+=1
+        ack=self._ack
+        ack[_HEADER_SIZE]=status
+        _seal(ack,ACK,sequence,1)
+        self.stream.write(ack)
+
+    # True if a pose with this sequence number is newer than the last pose
+    def _fresh(self,sequence):
+        if self._lastPose>=0 and not 0<((sequence-self._lastPose)&0xffff)<0x8000:
+            return False
+        self._lastPose=sequence
+        return True
+
+    # stop the motion and drop the queued poses
+    def _stopMotion(self):
+        self._motion=None
+        self._queueCount=0
+
+    # add the timed pose of a POSE_AT frame to the queue
+    def _enqueue(self,frame):
+        queueSize=len(self._times)
+        jointCount=len(self._pose)
+        slot=(self._queueHead+self._queueCount)%queueSize
+        self._times[slot]=_getTime(frame)
+        queue=self._queue
+        base=slot*jointCount
+        for joint in range(jointCount):
+            i=_HEADER_SIZE+4+2*joint
+            queue[base+joint]=frame[i]|(frame[i+1]<<8)
+        self._queueCount+=1
+
+    # send the queued poses which are due
+    def _playQueue(self):
+        clock=self.clock
+        now=clock.ticks_ms()
+        while self._queueCount>0 and clock.ticks_diff(now,self._times[self._queueHead])>=0:
+            self._write(self._queue,self._queueHead*len(self._pose))
+            self._queueHead=(self._queueHead+1)%len(self._times)
+            self._queueCount-=1
+
+    # send a pose of angles in 1/ANGLE_SCALE degree, angles[start+i] for the i-th servo
+    # the only place where the received angles are converted
+    def _write(self,angles,start):
+        pulses=self._pulses
+        i=0
+        for servo in self.group:
+            pulses[i]=servo.positionToMicroseconds(angles[start+i]/ANGLE_SCALE)
+            i+=1
+        self.group.writeMicroseconds(pulses)
+
+    # send the frames of the motion which are due
+    def _playFrames(self):
+        clock=self.clock
+        motion=self._motion
+        while clock.ticks_diff(clock.ticks_ms(),self._deadline)>=0:
+            if self._frame>=motion.frameCount():
+                self._motion=None
+                return
+            self.group.write(motion.angles,self._frame*motion.jointCount)
+            self._deadline=clock.ticks_add(self._deadline,motion.getDuration(self._frame))
+            self._frame+=1
+
+    def _sendState(self,sequence):
+        state=self._state
+        state[_HEADER_SIZE]=1 if self._motion is not None else 0
+        i=_HEADER_SIZE+1
+        for servo in self.group:
+            angle=int(servo.read()*ANGLE_SCALE+0.5)
+            state[i]=angle&0xff
+            state[i+1]=angle>>8
+            i+=2
+        _seal(state,STATE,sequence,len(state)-_HEADER_SIZE-1)
+        self.stream.write(state)
+
+    def _sendClock(self,sequence):
+        reply=self._clock
+        now=self.clock.ticks_ms()
+        for i in range(4):
+            reply[_HEADER_SIZE+i]=(now>>(8*i))&0xff
+        _seal(reply,CLOCK,sequence,4)
+        self.stream.write(reply)
+
+class RemoteClient:
+    # RemoteClient(stream,timeout_ms=100,idle=None)
+    # sends commands to a RemoteServer through stream (e.g. a pyserial Serial with timeout=0)
+    # the commands return their sequence number without waiting for the reply
+    # idle is called while waiting for a reply, e.g. the poll() of a server on a loopback link
+    def __init__(self,stream,timeout_ms=100,idle=None):
+        self.stream=stream
+        self.timeout_ms=timeout_ms
+        self.idle=idle
+        self.parser=FrameParser()
+        self.sequence=0
+        self._frame=bytearray(_HEADER_SIZE+MAX_PAYLOAD+1)
+        self._view=memoryview(self._frame)
+
+    # sequence=setPose(angles)
+    # set the angles in degrees of all the servos of the group of the server
+    def setPose(self,angles):
+        frame=self._frame
+        i=_HEADER_SIZE
+        for angle in angles:
+            i=self._putAngle(i,angle)
+        return self._send(SET_POSE,i-_HEADER_SIZE)
+
+    # sequence=setJoints(joints,angles)
+    # set the angles in degrees of the servos at the indices joints in the group of the server
+    def setJoints(self,joints,angles):
+        frame=self._frame
+        i=_HEADER_SIZE
+        for k in range(len(joints)):
+            frame[i]=joints[k]
+            i=self._putAngle(i+1,angles[k])
+        return self._send(SET_JOINTS,i-_HEADER_SIZE)
+
+    # sequence=setPoseAt(time_ms,angles)
+    # queue a pose sent to the servos when the clock of the robot reaches time_ms
+    def setPoseAt(self,time_ms,angles):
+        frame=self._frame
+        for i in range(4):
+            frame[_HEADER_SIZE+i]=(time_ms>>(8*i))&0xff
+        i=_HEADER_SIZE+4
+        for angle in angles:
+            i=self._putAngle(i,angle)
+        return self._send(POSE_AT,i-_HEADER_SIZE)
+
+    # sequence=play(motion)
+    # play the motion with the index motion in the motions of the server
+    def play(self,motion):
+        self._frame[_HEADER_SIZE]=motion
+        return self._send(PLAY,1)
+
+    # sequence=stop()
+    # stop the motion being played
+    def stop(self):
+        return self._send(STOP,0)
+
+    # status=ack(sequence)
+    # wait for the ACK of a command and return its status, None after timeout_ms
+    def ack(self,sequence):
+        if self._wait(ACK,sequence):
+            return self.parser.frame[_HEADER_SIZE]
+        return None
+
+    # (playing,angles)=query()
+    # returns whether a motion is playing and the angles in degrees of the servos
+    # None after timeout_ms
+    def query(self):
+        sequence=self._send(QUERY,0)
+        if not self._wait(STATE,sequence):
+            return None
+        frame=self.parser.frame
+        angles=[]
+        for i in range(_HEADER_SIZE+1,_HEADER_SIZE+self.parser.length(),2):
+            angles.append((frame[i]|(frame[i+1]<<8))/ANGLE_SCALE)
+        return (frame[_HEADER_SIZE]&1==1,angles)
+
+    # ticks_ms=time()
+    # returns the ticks_ms() of the robot, None after timeout_ms
+    def time(self):
+        if not self._wait(CLOCK,self._send(TIME,0)):
+            return None
+        return _getTime(self.parser.frame)
+
+    def _putAngle(self,i,angle):
+        value=int(angle*ANGLE_SCALE+0.5)
+        self._frame[i]=value&0xff
+        self._frame[i+1]=value>>8
+        return i+2
+
+    def _send(self,type,length):
+        self.sequence=(self.sequence+1)&0xffff
+        size=_seal(self._frame,type,self.sequence,length)
+        self.stream.write(self._view[:size])
+        return self.sequence
+
+    # wait for the reply of a given type to a command, dropping the older replies
+    def _wait(self,type,sequence):
+        clock=Hal.clock
+        start=clock.ticks_ms()
+        parser=self.parser
+        while True:
+            if parser.receive(self.stream):
+                if parser.type()==type and parser.sequence()==sequence:
+                    return True
+            elif clock.ticks_diff(clock.ticks_ms(),start)>=self.timeout_ms:
+                return False
+            elif self.idle is not None:
+                self.idle()
+
+# In-memory byte stream, one end of a loopback link (see LoopbackStream.pair())
+class LoopbackStream:
+    def __init__(self,incoming,outgoing):
+        self._incoming=incoming
+        self._outgoing=outgoing
+
+    # (a,b)=LoopbackStream.pair()
+    # returns two streams connected to each other
+    @staticmethod
+    def pair():
+        a=bytearray()
+        b=bytearray()
+        return (LoopbackStream(a,b),LoopbackStream(b,a))
+
+    def write(self,buffer):
+        self._outgoing.extend(buffer)
+        return len(buffer)
+
+    def readinto(self,buffer):
+        incoming=self._incoming
+        n=len(incoming) if len(incoming)<len(buffer) else len(buffer)
+        if n==0:
+            return None
+        buffer[0:n]=incoming[0:n]
+        incoming[0:n]=b''
+        return n
+
+# benchmark(frames)
+# streams the walk as poses through a loopback link and measures
+# the poses per second and the round trip time of a pose and its ACK
+def benchmark(frames=1000):
+    from RavenMS import RavenMS, WALK
+    from servoBenchmark import BenchmarkPWM
+    level=Log.level
+    Log.setLevel(Log.OFF)
+    ravenms=RavenMS()
+    for servo in ravenms.lowerBodyServos:
+        servo.pin=BenchmarkPWM()
+    host,device=LoopbackStream.pair()
+    server=RemoteServer(ravenms,device)
+    client=RemoteClient(host,idle=server.poll)
+    poses=[[WALK.getAngle(k,joint) for joint in range(WALK.jointCount)] for k in range(WALK.frameCount())]
+    clock=Hal.clock
+    # streaming: the replies are read once per batch of 10 poses
+    t0=clock.ticks_us()
+    for k in range(frames):
+        client.setPose(poses[k%len(poses)])
+        if k%10==9:
+            client.ack(client.sequence)
+    elapsed=clock.ticks_diff(clock.ticks_us(),t0)
+    print('RemoteControl streaming: '+str(int(frames*1000000/elapsed))+' poses/s')
+    # round trip of each pose
+    worst=0
+    t0=clock.ticks_us()
+    for k in range(frames):
+        t=clock.ticks_us()
+        client.ack(client.setPose(poses[k%len(poses)]))
+        rtt=clock.ticks_diff(clock.ticks_us(),t)
+        if rtt>worst:
+            worst=rtt
+    elapsed=clock.ticks_diff(clock.ticks_us(),t0)
+    print('RemoteControl round trip: '+str(int(elapsed/frames))+' us avg, '+str(worst)+' us max')
+    for servo in ravenms.lowerBodyServos:
+        servo.detach()
+    Log.setLevel(level)
+
+if __name__ == "__main__":
+    from RavenMS import RavenMS, WALK
+    Log.setLevel(Log.OFF)
+    hostClock=Hal.clock
+    clock=Hal.simulate()
+    ravenms=RavenMS()
+    host,device=LoopbackStream.pair()
+    server=RemoteServer(ravenms,device)
+    foot=ravenms.rightFoot
+
+    # the server runs while the client waits for its replies
+    def idle():
+        server.poll()
+        clock.sleep_ms(1)
+    client=RemoteClient(host,idle=idle)
+
+    # a pose, then a batch of joints
+    sequence=client.setPose([WALK.getAngle(3,joint) for joint in range(10)])
+    assert(server.poll()==1)
+    assert(client.ack(sequence)==OK)
+    assert(foot.microseconds==foot.positionToMicroseconds(WALK.getAngle(3,0)))
+    client.ack(client.setJoints((0,9),(70,100.5)))
+    playing,angles=client.query()
+    assert(not playing)
+    assert(abs(angles[0]-70)<0.2) # read back from the pulse width in µs
+    assert(len(server._state)==_HEADER_SIZE+1+2*10+1)
+
+    # out of order and malformed frames
+    client.sequence-=2
+    assert(client.ack(client.setPose([90]*10))==STALE)
+    client.sequence+=2
+    client._frame[_HEADER_SIZE]=12 # joint out of range
+    client._frame[_HEADER_SIZE+1]=0
+    client._frame[_HEADER_SIZE+2]=0
+    assert(client.ack(client._send(SET_JOINTS,3))==BAD_PAYLOAD)
+    host.write(b'\x00\x01noise')
+    sequence=client.stop()
+    host._outgoing[-1]^=0xff # corrupted checksum: no reply
+    assert(client.ack(sequence) is None)
+    assert(server.parser.errors==1)
+    assert(client.ack(client._send(0x42,0))==UNKNOWN_COMMAND)
+
+    # a motion plays while the commands keep being executed
+    assert(client.ack(client.play(0))==OK)
+    clock.sleep_ms(WALK.getDuration(0))
+    server.poll()
+    assert(foot.microseconds==foot.positionToMicroseconds(WALK.getAngle(1,0)))
+    assert(client.query()[0])
+    assert(client.ack(client.stop())==OK)
+    clock.sleep_ms(1000)
+    server.poll()
+    assert(foot.microseconds==foot.positionToMicroseconds(WALK.getAngle(1,0)))
+
+    # timed poses, on the clock of the robot
+    now=client.time()
+    assert(0<=clock.ticks_ms()-now<=1) # read by the server during idle()
+    assert(client.ack(client.setPoseAt(now+50,[WALK.getAngle(5,joint) for joint in range(10)]))==OK)
+    assert(client.ack(client.setPoseAt(now+100,[WALK.getAngle(6,joint) for joint in range(10)]))==OK)
+    clock.sleep_ms(50-(clock.ticks_ms()-now))
+    server.poll()
+    assert(foot.microseconds==foot.positionToMicroseconds(WALK.getAngle(5,0)))
+    clock.sleep_ms(50)
+    server.poll()
+    assert(foot.microseconds==foot.positionToMicroseconds(WALK.getAngle(6,0)))
+    for k in range(len(server._times)):
+        client.setPoseAt(now+1000,[90]*10)
+    assert(client.ack(client.setPoseAt(now+1000,[90]*10))==FULL)
+    Hal.setClock(hostClock)
+    benchmark()
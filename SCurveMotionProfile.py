@@ -0,0 +1,113 @@
+# SCurveMotionProfile.py: Jerk-limited (S-curve) velocity profile generator in MicroPython
+# Used to smooth servo motions and trajectories
+# Copyright (C) 2022 Vincent Mistler (YouMakeTech)
+#
+# Like the trapezoidal profile, but the acceleration itself ramps up and down
+# with a constant jerk instead of jumping: the acceleration phase is made of
+# a jerk phase (jerkTime), a constant acceleration phase and another jerk phase.
+# The deceleration is symmetrical. Smoother than the trapezoidal profile,
+# it further reduces the current spikes and the mechanical shocks.
+
+from math import sqrt
+from MotionProfile import MotionProfile
+
+class SCurveMotionProfile(MotionProfile):
+    # SCurveMotionProfile(startValue,endValue,duration_ms,rampFraction=1/3,jerkFraction=0.5)
+    # the acceleration and the deceleration last rampFraction*duration_ms each
+    # (0<rampFraction<=0.5) and the jerk phases last jerkFraction of them
+    # (0<jerkFraction<=0.5, 0.5 leaves no constant acceleration phase)
+    #
+    # SCurveMotionProfile(startValue,endValue,maxVelocity=v,maxAcceleration=a,maxJerk=j)
+    # the duration is the shortest one respecting the limits
+    # maxVelocity is in units/ms, maxAcceleration in units/ms², maxJerk in units/ms³
+    def __init__(self,startValue,endValue,duration_ms=None,rampFraction=1/3,jerkFraction=0.5, \
+                 maxVelocity=None,maxAcceleration=None,maxJerk=None):
+        distance=abs(endValue-startValue)
+        if duration_ms is None:
+            if maxVelocity is None or maxAcceleration is None or maxJerk is None:
+                raise ValueError('SCurveMotionProfile: duration_ms or maxVelocity, maxAcceleration and maxJerk required')
+            velocity=maxVelocity
+            jerkTime=maxAcceleration/maxJerk
+            if velocity<maxAcceleration*jerkTime:
+                # the maximum acceleration cannot be reached before the maximum velocity
+                jerkTime=sqrt(velocity/maxJerk)
+                rampTime=2*jerkTime
+            else:
+                rampTime=velocity/maxAcceleration+jerkTime
+            if velocity*rampTime>distance:
+                # the maximum velocity cannot be reached: no constant velocity phase
+                jerkTime=maxAcceleration/maxJerk
+                velocity=0.5*maxAcceleration*(sqrt(jerkTime*jerkTime+4*distance/maxAcceleration)-jerkTime)
+                if velocity<maxAcceleration*jerkTime:
+                    # nor the maximum acceleration
+                    velocity=(0.5*distance*sqrt(maxJerk))**(2/3)
+                    jerkTime=sqrt(velocity/maxJerk)
+                    rampTime=2*jerkTime
+                else:
+                    rampTime=velocity/maxAcceleration+jerkTime
+            duration_ms=distance/velocity+rampTime if distance>0 else 0
+        else:
+            if rampFraction<=0 or rampFraction>0.5:
+                raise ValueError('SCurveMotionProfile: rampFraction must be in ]0,0.5]')
+            if jerkFraction<=0 or jerkFraction>0.5:
+                raise ValueError('SCurveMotionProfile: jerkFraction must be in ]0,0.5]')
+            rampTime=rampFraction*duration_ms
+            jerkTime=jerkFraction*rampTime
+            velocity=distance/(duration_ms-rampTime) if duration_ms>0 else 0
+        MotionProfile.__init__(self,startValue,endValue,duration_ms)
+
+        # coefficients of the move, computed once
+        if endValue<startValue:
+            velocity=-velocity
+        if rampTime>0:
+            acceleration=velocity/(rampTime-jerkTime)
+            jerk=acceleration/jerkTime
+        else:
+            acceleration=0.0
+            jerk=0.0
+        self._jerkTime=jerkTime                          # end of the first jerk phase
+        self._constantAccelerationEnd=rampTime-jerkTime  # beginning of the second jerk phase
+        self._rampTime=rampTime                          # end of the acceleration
+        self._decelerationTime=duration_ms-rampTime      # beginning of the deceleration
+        self._velocity=velocity                          # cruise velocity in units/ms
+        self._jerk6=jerk/6                               # jerk/6 for the cubic terms
+        self._jerkVelocity=0.5*acceleration*jerkTime     # velocity at the end of the first jerk phase
+        self._jerkValue=self._jerk6*jerkTime*jerkTime*jerkTime # distance at the end of the first jerk phase
+        self._halfAcceleration=0.5*acceleration
+        self._rampDistance=0.5*velocity*rampTime         # distance at the end of the acceleration
+
+    # velocity=maxVelocity()
+    # returns the cruise velocity in units/ms
+    def maxVelocity(self):
+        return abs(self._velocity)
+
+    # distance covered after t ms of acceleration (0<=t<=rampTime)
+    def _ramp(self,t):
+        if t<self._jerkTime:
+            return self._jerk6*t*t*t
+        if t<self._constantAccelerationEnd:
+            t-=self._jerkTime
+            return self._jerkValue+(self._jerkVelocity+self._halfAcceleration*t)*t
+        t=self._rampTime-t
+        return self._rampDistance-(self._velocity-self._jerk6*t*t)*t
+
+    def valueAt(self,t):
+        if t<self._rampTime:
+            return self._startValue+self._ramp(t)
+        if t<self._decelerationTime:
+            return self._startValue+self._rampDistance+self._velocity*(t-self._rampTime)
+        return self._endValue-self._ramp(self._duration_ms-t)
+
+if __name__ == "__main__":
+    trajectory=SCurveMotionProfile(500,2500,600)
+    assert(trajectory.valueAt(0)==500)
+    assert(abs(trajectory.valueAt(300)-1500)<1e-6)
+    assert(abs(trajectory.valueAt(599.999)-2500)<0.01)
+    # continuous position at the phase boundaries
+    for t in (50,150,200,400,450,550):
+        assert(abs(trajectory.valueAt(t-1e-6)-trajectory.valueAt(t+1e-6))<0.01)
+    trajectory.plot()
+
+    trajectory=SCurveMotionProfile(2500,500,maxVelocity=5,maxAcceleration=0.05,maxJerk=0.001)
+    assert(abs(trajectory.maxVelocity()-5)<1e-6)
+    trajectory.plot()
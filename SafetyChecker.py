@@ -0,0 +1,190 @@
+# SafetyChecker.py: Validation of whole motions before they are played in MicroPython
+# Copyright (C) 2022 Vincent Mistler (YouMakeTech)
+#
+# Servo.write() limits each angle on its own, when it is sent.
+# SafetyChecker checks all the frames of a Keyframes sequence at once, ahead of time:
+#     LIMIT      an angle beyond the positionMin/positionMax of its servo
+#                (clamped by Servo.write, hence only reported)
+#     VELOCITY   a joint moving faster than maxSpeed_dps from one frame to the next
+#     COLLISION  a forbidden combination of the angles of two joints,
+#                e.g. both hips rolled inwards such that the legs collide
+# The speeds and the collisions are checked on the angles the servos
+# reach, i.e. after clamping. The results are cached per sequence:
+# a motion is checked once, when loaded, and not on every write.
+#
+# >>> checker=SafetyChecker(ravenms.lowerBodyServos,forbidden=LB_FORBIDDEN)
+# >>> checker.isSafe(WALK)             # computed once, then cached
+# >>> checker.report(WALK,'walk')      # one line per offending frame
+#
+# A forbidden combination is a tuple (jointA,minA,maxA,jointB,minB,maxB):
+# the pose collides when the angle of jointA is within [minA,maxA]
+# and the angle of jointB within [minB,maxB] (joints in the order of the servos).
+
+from Keyframes import SERVO_MAX_DPS
+
+LIMIT=0
+VELOCITY=1
+COLLISION=2
+_KIND_NAMES=('limit','velocity','collision')
+
+# print a line, or write it to a stream
+def _output(stream,line):
+    if stream is None:
+        print(line)
+    else:
+        stream.write(line+'\n')
+
+class SafetyChecker:
+    # SafetyChecker(servos,maxSpeed_dps=SERVO_MAX_DPS,forbidden=())
+    # servos are the servos driven by the joints of the sequences, in their order
+    # maxSpeed_dps is the max. speed of a joint in degrees/s
+    # forbidden is a sequence of forbidden combinations of two joints
+    def __init__(self,servos,maxSpeed_dps=SERVO_MAX_DPS,forbidden=()):
+        self.servos=servos
+        self.maxSpeed_dps=maxSpeed_dps
+        self.forbidden=forbidden
+        self._results={} # Keyframes -> list of violations
+
+    # violations=check(keyframes)
+    # returns the list of the violations of a sequence, computed on the first call only
+    # each violation is a tuple (frame,kind,joint,otherJoint,value):
+    #     LIMIT      value is the angle of the joint, otherJoint is -1
+    #     VELOCITY   value is the speed of the joint in degrees/s to reach the frame, otherJoint is -1
+    #     COLLISION  value is the angle of the joint, otherJoint the joint it collides with
+    def check(self,keyframes):
+        violations=self._results.get(keyframes)
+        if violations is None:
+            violations=self._check(keyframes)
+            self._results[keyframes]=violations
+        return violations
+
+    # safe=isSafe(keyframes)
+    # returns True if the sequence has no speed or collision violation
+    # (the angles beyond the limits are clamped by Servo.write)
+    def isSafe(self,keyframes):
+        for violation in self.check(keyframes):
+            if violation[1]!=LIMIT:
+                return False
+        return True
+
+    # forget(keyframes=None)
+    # drop the cached result of a sequence, or of all the sequences,
+    # e.g. after changing a sequence or the calibration of the servos
+    def forget(self,keyframes=None):
+        if keyframes is None:
+            self._results={}
+        elif keyframes in self._results:
+            del self._results[keyframes]
+
+    # count=report(keyframes,name='motion',stream=None)
+    # print the violations of a sequence, or write them to a stream such as a file,
+    # and return their number
+    def report(self,keyframes,name='motion',stream=None):
+        violations=self.check(keyframes)
+        if len(violations)==0:
+            _output(stream,name+': ok')
+        for frame,kind,joint,otherJoint,value in violations:
+            servo=self.servos[joint]
+            line=name+' frame '+str(frame)+': '+_KIND_NAMES[kind]+', joint '+str(joint)+' (GP'+str(servo.id)+') '
+            if kind==LIMIT:
+                line+=str(value)+' deg beyond ['+str(servo.positionMin)+','+str(servo.positionMax)+']'
+            elif kind==VELOCITY:
+                line+=str(int(value+0.5))+' deg/s > '+str(self.maxSpeed_dps)
+            else:
+                line+=str(value)+' deg with joint '+str(otherJoint)+' at ' \
+                      +str(self._reached(otherJoint,keyframes.getAngle(frame,otherJoint)))+' deg'
+            _output(stream,line)
+        return len(violations)
+
+    def _check(self,keyframes):
+        if keyframes.jointCount!=len(self.servos):
+            raise ValueError('SafetyChecker: expected '+str(len(self.servos))+' joints')
+        violations=[]
+        jointCount=keyframes.jointCount
+        for frame in range(keyframes.frameCount()):
+            for joint in range(jointCount):
+                servo=self.servos[joint]
+                angle=keyframes.getAngle(frame,joint)
+                if angle<servo.positionMin or angle>servo.positionMax:
+                    violations.append((frame,LIMIT,joint,-1,angle))
+                # the previous frame is held for its duration, then the joint moves to this frame
+                # the first frame starts from wherever the robot is
+                if frame>0:
+                    delta=self._reached(joint,angle)-self._reached(joint,keyframes.getAngle(frame-1,joint))
+                    speed=1000*(delta if delta>=0 else -delta)/keyframes.getDuration(frame-1)
+                    if speed>self.maxSpeed_dps:
+                        violations.append((frame,VELOCITY,joint,-1,speed))
+            for jointA,minA,maxA,jointB,minB,maxB in self.forbidden:
+                angleA=self._reached(jointA,keyframes.getAngle(frame,jointA))
+                angleB=self._reached(jointB,keyframes.getAngle(frame,jointB))
+                if minA<=angleA<=maxA and minB<=angleB<=maxB:
+                    violations.append((frame,COLLISION,jointA,jointB,angleA))
+        return violations
+
+    # angle reached by the servo of a joint, after clamping
+    def _reached(self,joint,angle):
+        servo=self.servos[joint]
+        if angle<servo.positionMin:
+            return servo.positionMin
+        if angle>servo.positionMax:
+            return servo.positionMax
+        return angle
+
+if __name__ == "__main__":
+    from Hal import Hal
+    from Log import Log
+    from Keyframes import Keyframes
+    from RavenMS import RavenMS, WALK, LB_TRANSFORM_HUMAN_HELI, LB_FORBIDDEN
+    Log.setLevel(Log.OFF)
+    Hal.simulate()
+    ravenms=RavenMS(lazy=True)
+    checker=SafetyChecker(ravenms.lowerBodyServos,forbidden=LB_FORBIDDEN)
+
+    stand=[WALK.getAngle(0,joint) for joint in range(10)]
+    bad=list(stand)
+    bad[0]=5          # right foot below positionMin=10
+    crossed=list(stand)
+    crossed[3]=90     # both hips rolled inwards
+    crossed[4]=90
+    fast=list(stand)
+    fast[2]=60        # right upper leg: 70 degrees in 50ms
+    motion=Keyframes(10,stand+[500]+bad+[500]+crossed+[50]+fast+[500])
+    violations=checker.check(motion)
+    assert((1,LIMIT,0,-1,5) in violations)
+    assert((2,COLLISION,3,4,90) in violations)
+    assert([v for v in violations if v[1]==VELOCITY]==[(3,VELOCITY,2,-1,1400.0),(3,VELOCITY,3,-1,800.0), \
+                                                      (3,VELOCITY,4,-1,800.0)])
+    assert(not checker.isSafe(motion))
+    assert(checker.check(motion) is violations) # cached
+    checker.forget(motion)
+    assert(checker.check(motion) is not violations)
+
+    # the motions of the robot only exceed the limits, which are clamped
+    assert(checker.isSafe(WALK) and checker.isSafe(LB_TRANSFORM_HUMAN_HELI))
+    assert(checker.report(motion,'test')==len(violations))
+
+    # RavenMS refuses the unsafe motions
+    ravenms.setSafety()
+    try:
+        ravenms.play(motion)
+        assert(False)
+    except ValueError:
+        pass
+    assert(not ravenms.rightUpperLeg.enabled) # nothing sent, the lazy servos are not attached
+
+    # and so do RavenMSAsync and RemoteServer
+    import asyncio
+    from RavenMSAsync import RavenMSAsync
+    from RemoteControl import RemoteServer, RemoteClient, LoopbackStream, UNSAFE, OK
+    try:
+        asyncio.run(RavenMSAsync(ravenms).play(motion))
+        assert(False)
+    except ValueError:
+        pass
+    host,device=LoopbackStream.pair()
+    server=RemoteServer(ravenms,device)
+    server.motions.append(motion)
+    client=RemoteClient(host,idle=server.poll)
+    assert(client.ack(client.play(len(server.motions)-1))==UNSAFE)
+    assert(not ravenms.rightUpperLeg.enabled)
+    assert(client.ack(client.play(0))==OK) # WALK
@@ -1,23 +1,47 @@
 # Servo.py: Servo motor control in MicroPython
 # Copyright (C) 2022 Vincent Mistler (YouMakeTech)
 
-from machine import Pin, PWM
-from time import sleep
+from Hal import Hal
+from array import array
+from Log import Log
 from TriangularMotionProfile import TriangularMotionProfile
+from PWMBackend import PWMBackend
+from Instrumentation import Instrumentation
 
 class Servo:
+    # backend of the servos created without backend: RP2040 PWM channels
+    defaultBackend=PWMBackend()
+    # skip the hardware writes which would not change the pulse width
+    deduplicate=True
+
+    # Servo(id,servoMin=640,servoMax=2400,servoCenter=1500,initialPosition=90.0,
+    #       positionMin=0,positionMax=180,backend=None,lazy=False)
+    # the servo is attached and moved to initialPosition immediately,
+    # or with lazy=True only registered: it is attached by its first command
     def __init__(self,id,servoMin=640,servoMax=2400,servoCenter=1500, \
-                 initialPosition=90.0,positionMin=0,positionMax=180):
+                 initialPosition=90.0,positionMin=0,positionMax=180,backend=None,lazy=False):
         self.microseconds=-1    # servo initial position in µs (initialized by write)
         self.servoMin=servoMin # Pulse width in µs corresponding to 0 degrees
         self.servoMax=servoMax # Pulse width in µs corresponding to 180 degrees
         self.servoCenter=servoCenter # Pulse width in µs corresponding to 90 degrees
+        self.servoTrim=0 # sum of the trims added to servoCenter in µs
         self.positionMin=positionMin # min. commandable position in degrees
         self.positionMax=positionMax # max. commandable position in degrees
-        self.id=id # GPIO pin to which the servo is connected
+        self.id=id # GPIO pin (or backend channel) to which the servo is connected
+        self.initialPosition=initialPosition # position in degrees at startup
+        self.backend=backend if backend is not None else Servo.defaultBackend # hardware generating the pulses
         self.enabled=False # True when the servo is connected to a PWM pin
-        self.attach()
-        self.write(initialPosition) 
+        self._pwmActive=False # True when self.pin currently outputs the pulses (see PWMMultiplexer)
+        self._lut=None # optional pulse widths in µs for angles by steps of 1/_lutSteps degree
+        self._lutSteps=0 # number of LUT entries per degree
+        self._sentMicroseconds=-1 # pulse width in µs last sent to self.pin, -1 if unknown
+        self.writesIssued=0 # number of pulse widths sent to the hardware
+        self.writesSuppressed=0 # number of writes skipped because the pulse width did not change
+        self._calibrationChanged() # coefficients of angleToMicroseconds()
+        self._lazy=lazy # True until the first command attaches the servo
+        if not lazy:
+            self.attach()
+            self.write(initialPosition)
     
     # microseconds=angleToMicroseconds(angle)
     # convert a servo angle to a pulse duration
@@ -29,9 +53,9 @@ class Servo:
         elif angle>180:
             angle=180
         if angle>=90:
-            microseconds=int(self.servoCenter+(angle-90)*((self.servoMax-self.servoCenter)/90.0))
+            microseconds=int(self.servoCenter+(angle-90)*self._slopeHigh)
         else:
-            microseconds=int(self.servoMin+angle*((self.servoCenter-self.servoMin)/90.0))
+            microseconds=int(self.servoMin+angle*self._slopeLow)
         return microseconds
     
     # angle=microsecondsToAngle(microseconds)
@@ -52,35 +76,78 @@ class Servo:
     # writeMicroseconds(microseconds)
     # make the servo move by writing a pulse width on the pin
     def writeMicroseconds(self,microseconds):
+        if not self.enabled and self._lazy:
+            self.attach()
         if self.enabled:
             if microseconds<self.servoMin:
                 microseconds=self.servoMin
             elif microseconds>self.servoMax:
                 microseconds=self.servoMax
-            self.pin.duty_ns(1000*microseconds)
             self.microseconds=microseconds
+            # the PWMMultiplexer timer must not switch the channel between the check and the write
+            state=Hal.disable_irq()
+            if self._pwmActive:
+                if microseconds==self._sentMicroseconds and Servo.deduplicate:
+                    self.writesSuppressed+=1
+                else:
+                    self._sentMicroseconds=microseconds
+                    if Instrumentation.enabled:
+                        t0=Hal.clock.ticks_us()
+                        self.pin.duty_ns(1000*microseconds)
+                        Instrumentation.written(t0)
+                    else:
+                        self.pin.duty_ns(1000*microseconds)
+                    self.writesIssued+=1
+            # else the PWM channel is shared and the pulse
+            # is sent by the next PWMMultiplexer.refresh()
+            Hal.enable_irq(state)
             
+    # microseconds=positionToMicroseconds(angle)
+    # convert a commanded position to the pulse duration sent by write()
+    # the angle is first limited to positionMin..positionMax
+    # the lookup table is used when enabled (see enableLUT)
+    def positionToMicroseconds(self,angle):
+        if angle<self.positionMin:
+            if Log.level>=Log.WARNING:
+                print('Servo.write('+str(angle)+') limited to min. '+str(self.positionMin)+' degrees')
+            if Log.events:
+                Log.event(Log.CLAMP_MIN,self.id,angle)
+            angle=self.positionMin
+        elif angle>self.positionMax:
+            if Log.level>=Log.WARNING:
+                print('Servo.write('+str(angle)+') limited to max. '+str(self.positionMax)+' degrees')
+            if Log.events:
+                Log.event(Log.CLAMP_MAX,self.id,angle)
+            angle=self.positionMax
+
+        lut=self._lut
+        if lut is None:
+            return self.angleToMicroseconds(angle)
+        # integer index in the lookup table, no float math for integer angles
+        index=int(angle*self._lutSteps)
+        if index<0:
+            index=0
+        elif index>=len(lut):
+            index=len(lut)-1
+        return lut[index]
+
     # write(angle)
     # move the servo to the specified angle
     # angle is a float between 0 and 180 degrees included
     def write(self,angle):
+        if not self.enabled and self._lazy:
+            self.attach()
         if self.enabled:
-            if angle<self.positionMin:
-                print('Servo.write('+str(angle)+') limited to min. '+str(self.positionMin)+' degrees')
-                angle=self.positionMin
-            elif angle>self.positionMax:
-                print('Servo.write('+str(angle)+') limited to max. '+str(self.positionMax)+' degrees')
-                angle=self.positionMax
-            else:
+            if Log.level>=Log.DEBUG and angle>=self.positionMin and angle<=self.positionMax:
                 print('Servo.write('+str(angle)+')')
-                
-            microseconds=self.angleToMicroseconds(angle)
-            self.writeMicroseconds(microseconds)
+            self.writeMicroseconds(self.positionToMicroseconds(angle))
         
     # angle=read()
     # returns the latest commanded position in degrees
     # angle is a float between 0 and 180 degrees included
     def read(self):
+        if self.microseconds<0:
+            return self.initialPosition # lazy servo not commanded yet
         return self.microsecondsToAngle(self.microseconds)
     
     # microseconds=readMicroseconds()
@@ -98,6 +165,10 @@ class Servo:
         position=self.read()
         # Add the trim to the servo center pulse width
         self.servoCenter=self.servoCenter+servoTrim
+        self.servoTrim+=servoTrim
+        self._calibrationChanged()
+        if Log.events:
+            Log.event(Log.TRIM,self.id,servoTrim)
         # Move the servo immediately to see the effect
         self.write(position)
     
@@ -106,6 +177,9 @@ class Servo:
     # servoMin is the pulse width in us (default=640)
     def setServoMin(self,servoMin):
         self.servoMin=servoMin
+        self._calibrationChanged()
+        if Log.events:
+            Log.event(Log.SERVO_MIN,self.id,servoMin)
         # Move the servo immediately to see the effect
         self.write(0.0)
     
@@ -114,6 +188,9 @@ class Servo:
     # servoMax is the pulse width in us (default=2400)
     def setServoMax(self,servoMax):
         self.servoMax=servoMax
+        self._calibrationChanged()
+        if Log.events:
+            Log.event(Log.SERVO_MAX,self.id,servoMax)
         # Move the servo immediately to see the effect
         self.write(180.0)
     
@@ -122,6 +199,9 @@ class Servo:
     # servoCenter is the pulse width in us (default=1500)
     def setServoCenter(self,servoCenter):
         self.servoCenter=servoCenter
+        self._calibrationChanged()
+        if Log.events:
+            Log.event(Log.SERVO_CENTER,self.id,servoCenter)
         # Move the servo immediately to see the effect
         self.write(90.0)
 
@@ -146,6 +226,61 @@ class Servo:
         self.servoMin=640
         self.servoMax=2400
         self.servoCenter=1500
+        self.servoTrim=0
+        self._calibrationChanged()
+        if Log.events:
+            Log.event(Log.RESTORE_DEFAULTS,self.id,0)
+
+    # enableLUT(resolution=0.5)
+    # precompute the pulse width of all the angles between 0 and 180 degrees
+    # by steps of resolution degrees (e.g. 0.5 or 0.1 degree)
+    # write() then converts angles with a table lookup instead of float math
+    # angles are truncated to the resolution of the table
+    # the table uses 2 bytes per entry: 722 bytes at 0.5 degree, 3602 bytes at 0.1 degree
+    # and is rebuilt automatically when the calibration changes
+    def enableLUT(self,resolution=0.5):
+        self._lutSteps=int(1/resolution+0.5)
+        self._buildLUT()
+
+    # disableLUT()
+    # free the lookup table, write() converts angles with angleToMicroseconds()
+    def disableLUT(self):
+        self._lut=None
+        self._lutSteps=0
+
+    # lutEnabled()
+    # returns True if write() uses a lookup table
+    def lutEnabled(self):
+        return self._lut is not None
+
+    def _buildLUT(self):
+        steps=self._lutSteps
+        self._lut=None # free the previous table before allocating the new one
+        self._lut=array('H',(self.angleToMicroseconds(i/steps) for i in range(180*steps+1)))
+
+    # calibrate(servoMin,servoCenter,servoMax,positionMin,positionMax,servoTrim=0,lutResolution=None)
+    # set the whole calibration at once, e.g. from a Calibration store, before the first pulse:
+    # the coefficients and the optional lookup table are computed once and the servo does not move
+    # servoCenter is the untrimmed center, the servo is centered on servoCenter+servoTrim
+    def calibrate(self,servoMin,servoCenter,servoMax,positionMin,positionMax,servoTrim=0,lutResolution=None):
+        self.servoMin=servoMin
+        self.servoCenter=servoCenter+servoTrim
+        self.servoMax=servoMax
+        self.servoTrim=servoTrim
+        self.positionMin=positionMin
+        self.positionMax=positionMax
+        self.disableLUT() # rebuilt once below if required
+        self._calibrationChanged()
+        if lutResolution is not None:
+            self.enableLUT(lutResolution)
+
+    # called whenever servoMin, servoMax or servoCenter change
+    def _calibrationChanged(self):
+        # slopes of angleToMicroseconds() in µs/degree below and above 90 degrees
+        self._slopeLow=(self.servoCenter-self.servoMin)/90.0
+        self._slopeHigh=(self.servoMax-self.servoCenter)/90.0
+        if self._lut is not None:
+            self._buildLUT()
     
     # attached()
     # returns True if a pin is attached to the servo
@@ -154,10 +289,13 @@ class Servo:
     
     # attach()
     # enables a servo for PWM control 
+    # with the default backend, if another attached servo uses the same
+    # PWM channel, the channel is shared by Servo.defaultBackend.multiplexer
     def attach(self):
-        self.pin=PWM(Pin(self.id))
-        self.pin.freq(50) # Hz
+        self._sentMicroseconds=-1 # new pin
+        self.backend.attach(self)
         self.enabled=True
+        self._lazy=False
         
     # detach()
     # disables a servo for PWM control
@@ -166,29 +304,36 @@ class Servo:
     # The Pico exposes 26 GPIO pins but has only 16 PWM channels
     # For example, GP0 and GP16 share the same PWM channel PWM_A[0]
     # and only one GPIO can use the same PWM channel at a time
-    # detach() is required when we want to control more than 16
-    # servos. The servo remains in the last commanded position when
-    # it does not receive any signal!
+    # Servos on conflicting pins are time-multiplexed by Servo.defaultBackend.multiplexer:
+    # call Servo.defaultBackend.multiplexer.start() (or refresh() every 5ms) such that
+    # each servo receives its pulses. The servo remains in the last
+    # commanded position when it does not receive any signal!
     #
     # Example usage:
     # >>> from Servo import Servo
     # >>> servo0=Servo(0)
-    # >>> servo16=Servo(16)
-    # >>> servo0.write(180) # the 2 servos move because they are connected to the same PWM channel
-    # >>> servo0.detach()   # detach servo0 in order to move servo16 independently
-    # >>> servo16.write(0)  # only servo16 moves, but not servo 0
-    # >>> servo16.detach()
-    # >>> servo0.attach()
-    # >>> servo0.write(90)  # now we only move servo0, servo16 holds its last commanded position
+    # >>> servo16=Servo(16) # GP0 and GP16 are multiplexed on PWM_A[0]
+    # >>> Servo.defaultBackend.multiplexer.start()
+    # >>> servo0.write(180) # only servo0 moves
+    # >>> servo16.write(0)  # only servo16 moves
+    # >>> servo16.detach()  # servo0 gets the PWM channel for itself
     def detach(self):
-        self.pin.deinit()
-        Pin(self.id).init(mode=Pin.IN)
+        if self._lazy:
+            return # never attached
+        self.backend.detach(self)
         self.enabled=False
-        
-    def move(self,angle,duration_ms=500):
+
+    # move(angle,duration_ms=500,profile=TriangularMotionProfile)
+    # move the servo smoothly to the specified angle
+    # profile is the motion profile class, e.g. TrapezoidalMotionProfile or SCurveMotionProfile
+    # blocks until the move is complete: use MotionScheduler.move()
+    # to move several servos together without blocking
+    def move(self,angle,duration_ms=500,profile=TriangularMotionProfile):
+        if not self.enabled and self._lazy:
+            self.write(self.initialPosition) # start from a known position
         if self.enabled:
             microseconds=self.angleToMicroseconds(angle)
-            trajectory=TriangularMotionProfile(self.microseconds,microseconds,duration_ms)
+            trajectory=profile(self.microseconds,microseconds,duration_ms)
             while trajectory.moveInProgress():
                 self.writeMicroseconds(int(trajectory.getValue()))
     
@@ -218,19 +363,19 @@ if __name__ == "__main__":
     servo.write(0)
     assert(servo.read()==0)
     assert(servo.readMicroseconds()==640)
-    sleep(1) # second
+    Hal.clock.sleep(1) # second
     
     # Move the servo to 90 degrees (center position)
     servo.write(90)
     assert(servo.read()==90)
     assert(servo.readMicroseconds()==1500)
-    sleep(1) # second
+    Hal.clock.sleep(1) # second
     
     # Move the servo to 180 degrees (max. position)
     servo.write(180)
     assert(servo.read()==180)
     assert(servo.readMicroseconds()==2400)
-    sleep(1) # second
+    Hal.clock.sleep(1) # second
     
     # Return to 0 degrees
     servo.write(90)
@@ -238,39 +383,62 @@ if __name__ == "__main__":
     # Servo trim
     servo.trim(50)
     assert(servo.getServoCenter()==1550)
-    sleep(1) # second
+    Hal.clock.sleep(1) # second
     
     servo.trim(-100)
     assert(servo.getServoCenter()==1450)
-    sleep(1) # second
+    Hal.clock.sleep(1) # second
     
     servo.trim(50)
     assert(servo.getServoCenter()==1500)
-    sleep(1) # second
+    Hal.clock.sleep(1) # second
     
     # Servo Min./Max.
     servo.setServoMax(2300)
-    sleep(1) # second
+    Hal.clock.sleep(1) # second
     servo.setServoMax(2400)
-    sleep(1) # second
+    Hal.clock.sleep(1) # second
     servo.setServoMin(700)
-    sleep(1) # second
+    Hal.clock.sleep(1) # second
     servo.setServoMax(640)
-    sleep(1) # second
+    Hal.clock.sleep(1) # second
     servo.setServoCenter(1600)
-    sleep(1) # second
+    Hal.clock.sleep(1) # second
     servo.setServoCenter(1500)
-    sleep(1) # second
+    Hal.clock.sleep(1) # second
     
     # Return to 90 degrees
     servo.restoreDefaults()
     servo.write(90)
-    
+
+    # Lookup table gives the same pulse widths on its grid
+    servo.enableLUT(0.5)
+    assert(servo.lutEnabled())
+    for i in range(361):
+        servo.write(i/2)
+        assert(servo.readMicroseconds()==servo.angleToMicroseconds(i/2))
+    # the table follows calibration changes
+    servo.setServoMax(2300)
+    servo.write(180)
+    assert(servo.readMicroseconds()==2300)
+    servo.restoreDefaults()
+    servo.write(180)
+    assert(servo.readMicroseconds()==2400)
+    servo.disableLUT()
+    assert(servo.lutEnabled()==False)
+    servo.write(90)
+
     # Detach the servo
     servo.detach()
     assert(servo.attached()==False)
     servo.write(0) # should not move
-    sleep(0.5)
+    Hal.clock.sleep(0.5)
     servo.attach()
     assert(servo.attached())
+
+    # a lazy servo is at its initial position until its first command
+    lazy=Servo(2,initialPosition=45,lazy=True)
+    assert(lazy.read()==45)
+    lazy.detach() # never attached: nothing to free
+    assert(not lazy.attached())
     
\ No newline at end of file
@@ -0,0 +1,179 @@
+# ServoGroup.py: Synchronized writes to a group of servos in MicroPython
+# Copyright (C) 2022 Vincent Mistler (YouMakeTech)
+
+from array import array
+from Hal import Hal
+from Log import Log
+from Servo import Servo
+from Instrumentation import Instrumentation
+
+class ServoGroup:
+    # ServoGroup(servos)
+    # servos is a list of Servo objects, in the order of the pose vectors
+    def __init__(self,servos):
+        self.servos=servos
+        # hardware of the servos, to send each pose in one batch per backend
+        self._backends=[]
+        for servo in servos:
+            if servo.backend not in self._backends:
+                self._backends.append(servo.backend)
+        # pulse widths in µs of the pose being written, preallocated
+        self._microseconds=array('H',(0 for servo in servos))
+        # backend taking whole poses with writePose() (e.g. PIOBackend) when it drives all the servos
+        self._poseBackend=None
+        if len(self._backends)==1 and hasattr(self._backends[0],'writePose'):
+            self._poseBackend=self._backends[0]
+        self._ids=array('b',(-1 for servo in servos)) # GPIO of each enabled servo for writePose(), -1 if disabled
+        # True while some lazy servos wait for their first command
+        self._lazy=False
+        for servo in servos:
+            if servo._lazy:
+                self._lazy=True
+
+    def __len__(self):
+        return len(self.servos)
+
+    def __getitem__(self,i):
+        return self.servos[i]
+
+    # write(angles,start=0)
+    # move all the servos of the group to a pose
+    # angles[start+i] is the angle in degrees of the i-th servo
+    # all the angles are limited and converted first, then
+    # the pulse widths are sent back to back to the servos
+    def write(self,angles,start=0):
+        if self._lazy:
+            self._attachLazyServos()
+        if Log.level>=Log.DEBUG:
+            print('ServoGroup.write('+str([angles[start+i] for i in range(len(self.servos))])+')')
+        microseconds=self._microseconds
+        i=0
+        for servo in self.servos:
+            if servo.enabled:
+                microseconds[i]=servo.positionToMicroseconds(angles[start+i])
+            i+=1
+        self._push(microseconds)
+
+    # writeMicroseconds(microseconds,start=0)
+    # send a pose of pulse widths in µs, microseconds[start+i] for the i-th servo
+    def writeMicroseconds(self,microseconds,start=0):
+        pulses=self._microseconds
+        i=0
+        for servo in self.servos:
+            pulse=microseconds[start+i]
+            if pulse<servo.servoMin:
+                pulse=servo.servoMin
+            elif pulse>servo.servoMax:
+                pulse=servo.servoMax
+            pulses[i]=pulse
+            i+=1
+        self._push(pulses)
+
+    # home()
+    # move all the servos to their initial position in one batched write
+    # e.g. to attach lazy servos together at startup
+    def home(self):
+        self.write([servo.initialPosition for servo in self.servos])
+
+    # (issued,suppressed)=writeCounts()
+    # returns the total number of pulse widths sent to the hardware by the servos
+    # of the group and of writes skipped because the pulse width did not change
+    def writeCounts(self):
+        issued=0
+        suppressed=0
+        for servo in self.servos:
+            issued+=servo.writesIssued
+            suppressed+=servo.writesSuppressed
+        return (issued,suppressed)
+
+    # angles=read()
+    # returns a list with the latest commanded position of each servo in degrees
+    def read(self):
+        return [servo.read() for servo in self.servos]
+
+    # send the pulse widths microseconds[start+i] to the hardware
+    # with as little work as possible between the first and the last servo
+    # backends such as the PCA9685 send the whole pose at once on flush()
+    def _push(self,microseconds,start=0):
+        if self._lazy:
+            self._attachLazyServos()
+        if Instrumentation.enabled:
+            t0=Hal.clock.ticks_us()
+        if self._poseBackend is not None:
+            self._pushPose(microseconds,start)
+            if Instrumentation.enabled:
+                Instrumentation.written(t0)
+            return
+        for backend in self._backends:
+            backend.begin()
+        deduplicate=Servo.deduplicate
+        i=start
+        # the PWMMultiplexer timer must not switch a channel between the check and the write
+        state=Hal.disable_irq()
+        for servo in self.servos:
+            if servo.enabled:
+                pulse=microseconds[i]
+                servo.microseconds=pulse
+                if servo._pwmActive:
+                    if pulse==servo._sentMicroseconds and deduplicate:
+                        servo.writesSuppressed+=1
+                    else:
+                        servo._sentMicroseconds=pulse
+                        servo.pin.duty_ns(1000*pulse)
+                        servo.writesIssued+=1
+            i+=1
+        Hal.enable_irq(state)
+        for backend in self._backends:
+            backend.flush()
+        if Instrumentation.enabled:
+            Instrumentation.written(t0)
+
+    # send a pose with a single writePose() of the backend
+    def _pushPose(self,microseconds,start):
+        ids=self._ids
+        deduplicate=Servo.deduplicate
+        i=0
+        for servo in self.servos:
+            if servo.enabled:
+                pulse=microseconds[start+i]
+                servo.microseconds=pulse
+                if pulse==servo._sentMicroseconds and deduplicate:
+                    servo.writesSuppressed+=1
+                else:
+                    servo._sentMicroseconds=pulse
+                    servo.writesIssued+=1
+                ids[i]=servo.id
+            else:
+                ids[i]=-1
+            i+=1
+        self._poseBackend.writePose(ids,microseconds,start)
+
+    # attach the lazy servos before their first pose
+    def _attachLazyServos(self):
+        for servo in self.servos:
+            if not servo.enabled and servo._lazy:
+                servo.attach()
+        self._lazy=False
+
+if __name__ == "__main__":
+    group=ServoGroup([Servo(0),Servo(1),Servo(2,positionMax=120)])
+    group.write((0,90,180))
+    assert(group[0].readMicroseconds()==640)
+    assert(group[1].readMicroseconds()==1500)
+    assert(group[2].read()==120) # limited to positionMax
+    group.write((1,2,90,90,90),start=2)
+    assert(group.read()==[90,90,90])
+    group.writeMicroseconds((640,2400,3000))
+    assert(group[2].readMicroseconds()==2400) # limited to servoMax
+
+    # unchanged pulse widths are not sent again
+    issued,suppressed=group.writeCounts()
+    group.write((0,180,120))
+    assert(group.writeCounts()==(issued+1,suppressed+2))
+
+    # lazy servos are attached by the first pose
+    group=ServoGroup([Servo(3,lazy=True,initialPosition=0),Servo(4,lazy=True)])
+    assert(not group[0].attached() and not group[1].attached())
+    group.home()
+    assert(group[0].attached() and group[1].attached())
+    assert(group[0].readMicroseconds()==640 and group[1].readMicroseconds()==1500)
@@ -0,0 +1,76 @@
+# TrapezoidalMotionProfile.py: Trapezoidal velocity profile generator in MicroPython
+# Used to smooth servo motions and trajectories
+# Copyright (C) 2022 Vincent Mistler (YouMakeTech)
+#
+# Constant acceleration, constant velocity, then constant deceleration.
+# The peak velocity is lower than with a triangular profile of the same
+# duration, which reduces the servo current and the mechanical shocks.
+
+from math import sqrt
+from MotionProfile import MotionProfile
+
+class TrapezoidalMotionProfile(MotionProfile):
+    # TrapezoidalMotionProfile(startValue,endValue,duration_ms,rampFraction=0.25)
+    # the acceleration and the deceleration last rampFraction*duration_ms each
+    # (0<rampFraction<=0.5, 0.5 gives a triangular profile)
+    #
+    # TrapezoidalMotionProfile(startValue,endValue,maxVelocity=v,maxAcceleration=a)
+    # the duration is the shortest one respecting the limits
+    # maxVelocity is in units/ms, maxAcceleration in units/ms²
+    def __init__(self,startValue,endValue,duration_ms=None,rampFraction=0.25, \
+                 maxVelocity=None,maxAcceleration=None):
+        distance=abs(endValue-startValue)
+        if duration_ms is None:
+            if maxVelocity is None or maxAcceleration is None:
+                raise ValueError('TrapezoidalMotionProfile: duration_ms or maxVelocity and maxAcceleration required')
+            velocity=maxVelocity
+            if velocity*velocity>distance*maxAcceleration:
+                # the maximum velocity cannot be reached
+                velocity=sqrt(distance*maxAcceleration)
+            if distance>0:
+                rampTime=velocity/maxAcceleration
+                duration_ms=distance/velocity+rampTime
+            else:
+                rampTime=0
+                duration_ms=0
+        else:
+            if rampFraction<=0 or rampFraction>0.5:
+                raise ValueError('TrapezoidalMotionProfile: rampFraction must be in ]0,0.5]')
+            rampTime=rampFraction*duration_ms
+            velocity=distance/(duration_ms-rampTime) if duration_ms>0 else 0
+        MotionProfile.__init__(self,startValue,endValue,duration_ms)
+
+        # coefficients of the move, computed once
+        if endValue<startValue:
+            velocity=-velocity
+        self._rampTime=rampTime                       # end of the acceleration
+        self._decelerationTime=duration_ms-rampTime   # beginning of the deceleration
+        self._velocity=velocity                       # cruise velocity in units/ms
+        self._halfAcceleration=0.5*velocity/rampTime if rampTime>0 else 0.0
+        self._rampValue=startValue+0.5*velocity*rampTime # value at the end of the acceleration
+
+    # velocity=maxVelocity()
+    # returns the cruise velocity in units/ms
+    def maxVelocity(self):
+        return abs(self._velocity)
+
+    def valueAt(self,t):
+        if t<self._rampTime:
+            return self._startValue+self._halfAcceleration*t*t
+        if t<self._decelerationTime:
+            return self._rampValue+self._velocity*(t-self._rampTime)
+        t=self._duration_ms-t
+        return self._endValue-self._halfAcceleration*t*t
+
+if __name__ == "__main__":
+    trajectory=TrapezoidalMotionProfile(500,2500,500)
+    assert(trajectory.valueAt(0)==500)
+    assert(abs(trajectory.valueAt(250)-1500)<1e-6)
+    assert(abs(trajectory.valueAt(499.999)-2500)<0.01)
+    trajectory.plot()
+
+    # 2000µs at 5µs/ms max. and 0.05µs/ms² max.: 100ms ramps and 300ms at full speed
+    trajectory=TrapezoidalMotionProfile(2500,500,maxVelocity=5,maxAcceleration=0.05)
+    assert(abs(trajectory.duration()-500)<1e-6)
+    assert(abs(trajectory.maxVelocity()-5)<1e-6)
+    trajectory.plot()
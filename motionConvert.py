@@ -0,0 +1,23 @@
+# motionConvert.py: convert the RavenMS motions to motion files, on the PC (CPython)
+# Copyright (C) 2022 Vincent Mistler (YouMakeTech)
+#
+# python motionConvert.py [directory]
+# writes walk.motion, lb_transform_human_heli.motion and lb_transform_heli_human.motion
+# to copy to the flash of the board, e.g. with mpremote cp *.motion :
+
+import sys
+from Hal import Hal
+from Log import Log
+from MotionFile import writeMotionFile
+from RavenMS import RavenMS, WALK, LB_TRANSFORM_HUMAN_HELI, LB_TRANSFORM_HELI_HUMAN
+
+directory=sys.argv[1] if len(sys.argv)>1 else '.'
+Log.setLevel(Log.OFF)
+Hal.simulate() # no hardware needed
+servoIds=[servo.id for servo in RavenMS().lowerBodyServos]
+
+for name,keyframes in (('walk',WALK),('lb_transform_human_heli',LB_TRANSFORM_HUMAN_HELI), \
+                       ('lb_transform_heli_human',LB_TRANSFORM_HELI_HUMAN)):
+    filename=directory+'/'+name+'.motion'
+    writeMotionFile(filename,keyframes,servoIds)
+    print(filename+': '+str(keyframes.frameCount())+' frames, '+str(keyframes.totalDuration())+' ms')
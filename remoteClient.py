@@ -0,0 +1,63 @@
+# remoteClient.py: drive a robot running RemoteServer from the PC (CPython + pyserial)
+# Copyright (C) 2022 Vincent Mistler (YouMakeTech)
+#
+# python remoteClient.py PORT query              print the state of the robot
+# python remoteClient.py PORT play MOTION        play a motion (0: walk, 1: human->heli, 2: heli->human)
+# python remoteClient.py PORT stop               stop the motion
+# python remoteClient.py PORT stream [SECONDS]   stream a generated walk at 50Hz
+# python remoteClient.py loopback                benchmark over an in-memory link, no robot needed
+
+import sys
+import time
+from Hal import Hal
+from Log import Log
+from RemoteControl import RemoteClient, OK, benchmark
+
+if len(sys.argv)<2:
+    print('usage: python remoteClient.py PORT query|play MOTION|stop|stream [SECONDS], or loopback')
+    sys.exit(1)
+if sys.argv[1]=='loopback':
+    benchmark()
+    sys.exit(0)
+
+import serial # pyserial
+client=RemoteClient(serial.Serial(sys.argv[1],115200,timeout=0))
+command=sys.argv[2] if len(sys.argv)>2 else 'query'
+
+if command=='query':
+    state=client.query()
+    if state is None:
+        print('no reply')
+    else:
+        print('playing: '+str(state[0])+', angles: '+str(state[1]))
+elif command=='play':
+    print('status: '+str(client.ack(client.play(int(sys.argv[3])))))
+elif command=='stop':
+    print('status: '+str(client.ack(client.stop())))
+elif command=='stream':
+    from RavenMS import RavenMS
+    from GaitGenerator import GaitGenerator
+    Log.setLevel(Log.OFF)
+    hostClock=Hal.clock
+    Hal.simulate() # the gait is computed with a model of the robot
+    gait=GaitGenerator(RavenMS(lazy=True))
+    Hal.setClock(hostClock)
+    duration=float(sys.argv[3]) if len(sys.argv)>3 else 5
+    sent=0
+    late=0
+    start=time.monotonic()
+    nextFrame=start
+    for pose in gait.frames():
+        if time.monotonic()-start>=duration:
+            break
+        client.setPose(pose)
+        sent+=1
+        if sent%50==0 and client.ack(client.sequence)!=OK:
+            late+=1
+        nextFrame+=gait.period_ms/1000
+        wait=nextFrame-time.monotonic()
+        if wait>0:
+            time.sleep(wait)
+    print(str(sent)+' poses sent in '+str(duration)+' s, '+str(late)+' acks missing or not OK')
+else:
+    print('unknown command '+command)
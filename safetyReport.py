@@ -0,0 +1,27 @@
+# safetyReport.py: check the RavenMS motions before copying them to the robot, on the PC (CPython)
+# Copyright (C) 2022 Vincent Mistler (YouMakeTech)
+#
+# python safetyReport.py [calibration]
+# lists the frames of walk, lb_transform_human_heli and lb_transform_heli_human
+# beyond the limits of the servos, too fast or with colliding joints,
+# with the limits of the calibration file (e.g. ravenms.cal copied from the board)
+# returns 1 if a motion is unsafe (too fast or colliding), e.g. for a pre-commit check
+
+import sys
+from Hal import Hal
+from Log import Log
+from RavenMS import RavenMS, WALK, LB_TRANSFORM_HUMAN_HELI, LB_TRANSFORM_HELI_HUMAN
+
+calibration=sys.argv[1] if len(sys.argv)>1 else None
+Log.setLevel(Log.OFF)
+Hal.simulate() # no hardware needed
+checker=RavenMS(lazy=True,calibration=calibration).setSafety()
+
+unsafe=0
+for name,keyframes in (('walk',WALK),('lb_transform_human_heli',LB_TRANSFORM_HUMAN_HELI), \
+                       ('lb_transform_heli_human',LB_TRANSFORM_HELI_HUMAN)):
+    checker.report(keyframes,name)
+    if not checker.isSafe(keyframes):
+        unsafe+=1
+print(str(unsafe)+' unsafe motions')
+sys.exit(1 if unsafe>0 else 0)
@@ -0,0 +1,208 @@
+# servoBenchmark.py: micro benchmarks of the Servo class in MicroPython
+# Copyright (C) 2022 Vincent Mistler (YouMakeTech)
+
+import gc
+from Hal import Hal
+from Servo import Servo
+from ServoGroup import ServoGroup
+from Log import Log
+
+# Stand-in for machine.PWM: the benchmarks measure
+# the Python code and not the hardware
+class BenchmarkPWM:
+    def __init__(self):
+        self.count=0
+        self.ns=0
+
+    def duty_ns(self,ns):
+        self.ns=ns
+        self.count+=1
+
+    def deinit(self):
+        pass
+
+# Stand-in for machine.PWM that remembers when duty_ns() was last called
+class TimestampPWM(BenchmarkPWM):
+    def duty_ns(self,ns):
+        self.time=Hal.clock.ticks_us()
+        self.ns=ns
+        self.count+=1
+
+# free=memFree()
+# returns the free heap in bytes, None under CPython
+def memFree():
+    if hasattr(gc,'mem_free'):
+        return gc.mem_free()
+    return None
+
+# report(name,iterations,elapsed_us,free)
+# print one line of benchmark results
+# free is the value of memFree() before the benchmark
+def report(name,iterations,elapsed_us,free):
+    if free is None:
+        allocated='n/a'
+    else:
+        allocated=str(int((free-memFree())/iterations))
+    print(name+': '+str(int(1000*elapsed_us/iterations))+' ns/call, ' \
+          +allocated+' bytes allocated/call')
+
+# angleConversion(iterations)
+# measures positionToMicroseconds(), the conversion used by write(),
+# without and with the lookup table
+def angleConversion(iterations=10000):
+    level=Log.level
+    Log.setLevel(Log.OFF) # the trace would dominate the measurements
+    servo=Servo(0)
+    angles=[i for i in range(181)]+[i+0.5 for i in range(180)]
+    for resolution in (None,0.5,0.1):
+        if resolution is None:
+            name='positionToMicroseconds'
+            servo.disableLUT()
+        else:
+            name='positionToMicroseconds, LUT '+str(resolution)+' deg'
+            servo.enableLUT(resolution)
+        gc.collect()
+        free=memFree()
+        t0=Hal.clock.ticks_us()
+        i=0
+        n=len(angles)
+        for k in range(iterations):
+            microseconds=servo.positionToMicroseconds(angles[i])
+            i+=1
+            if i==n:
+                i=0
+        elapsed=Hal.clock.ticks_diff(Hal.clock.ticks_us(),t0)
+        report(name,iterations,elapsed,free)
+    servo.detach()
+    Log.setLevel(level)
+
+# groupSkew(servoCount,iterations)
+# measures the time between the update of the first and the last joint
+# of a pose, with one write() per servo and with ServoGroup.write()
+def groupSkew(servoCount=10,iterations=100):
+    level=Log.level
+    Log.setLevel(Log.OFF) # the trace would dominate both measurements
+    servos=[]
+    for i in range(servoCount):
+        servo=Servo(i)
+        servo.pin=TimestampPWM()
+        servos.append(servo)
+    group=ServoGroup(servos)
+    poses=([45.0]*servoCount,[135.0]*servoCount)
+    for name in ('Servo.write','ServoGroup.write'):
+        skew=0
+        maxSkew=0
+        for k in range(iterations):
+            pose=poses[k%2]
+            if name=='Servo.write':
+                for i in range(servoCount):
+                    servos[i].write(pose[i])
+            else:
+                group.write(pose)
+            s=Hal.clock.ticks_diff(servos[-1].pin.time,servos[0].pin.time)
+            skew+=s
+            if s>maxSkew:
+                maxSkew=s
+        print(name+': '+str(servoCount)+' servos, skew first to last joint '+str(int(skew/iterations)) \
+              +' us average, '+str(maxSkew)+' us max')
+    for servo in servos:
+        servo.detach()
+    Log.setLevel(level)
+
+# gaitCurrent()
+# prints the estimated peak current of the RavenMS gaits
+# with the poses snapped and blended with each motion profile
+def gaitCurrent():
+    from RavenMS import WALK, LB_TRANSFORM_HUMAN_HELI, LB_TRANSFORM_HELI_HUMAN
+    from TriangularMotionProfile import TriangularMotionProfile
+    from TrapezoidalMotionProfile import TrapezoidalMotionProfile
+    from SCurveMotionProfile import SCurveMotionProfile
+    print('gait,snap_mA,triangular_mA,trapezoidal_mA,scurve_mA')
+    for name,gait in (('walk',WALK),('lb_transform_human_heli',LB_TRANSFORM_HUMAN_HELI), \
+                      ('lb_transform_heli_human',LB_TRANSFORM_HELI_HUMAN)):
+        print(name+','+str(gait.peakCurrent())+','+str(gait.peakCurrent(TriangularMotionProfile))+',' \
+              +str(gait.peakCurrent(TrapezoidalMotionProfile))+','+str(gait.peakCurrent(SCurveMotionProfile)))
+
+# bootTime()
+# profiles the startup of RavenMS: import time, construction time
+# and time until the first pose is sent, with eager and lazy servos
+# the modules of the robot (Servo, Hal, Log...) are imported again as at boot,
+# then the modules already loaded are restored
+def bootTime():
+    import sys
+    saved=dict(sys.modules)
+    file=sys.modules['Servo'].__file__
+    directory=file[:file.rfind('/')+1]
+    for name in saved:
+        if name!='__main__' and getattr(saved[name],'__file__','').startswith(directory):
+            del sys.modules[name]
+    gc.collect()
+    t0=Hal.clock.ticks_us()
+    from RavenMS import RavenMS
+    import_us=Hal.clock.ticks_diff(Hal.clock.ticks_us(),t0)
+    print('import RavenMS: '+str(import_us)+' us')
+    sys.modules['Log'].Log.setLevel(Log.OFF) # the trace would dominate the measurements
+    for lazy in (False,True):
+        t0=Hal.clock.ticks_us()
+        ravenms=RavenMS(lazy=lazy)
+        construction_us=Hal.clock.ticks_diff(Hal.clock.ticks_us(),t0)
+        if lazy:
+            ravenms.home()
+        pose_us=Hal.clock.ticks_diff(Hal.clock.ticks_us(),t0)
+        print('RavenMS(lazy='+str(lazy)+'): construction '+str(construction_us)+' us, first pose after ' \
+              +str(pose_us)+' us')
+        for servo in ravenms.lowerBodyServos:
+            servo.detach()
+    for name in list(sys.modules):
+        if name not in saved:
+            del sys.modules[name]
+    sys.modules.update(saved)
+
+# deduplication()
+# plays the RavenMS motions without delays on the PWM and on a PCA9685
+# with and without Servo.deduplicate and prints the hardware writes
+def deduplication():
+    from Hal import FakeI2C
+    from PCA9685 import PCA9685
+    from RavenMS import RavenMS, WALK, LB_TRANSFORM_HUMAN_HELI, LB_TRANSFORM_HELI_HUMAN
+    level=Log.level
+    Log.setLevel(Log.OFF)
+    deduplicate=Servo.deduplicate
+    for backendName in ('PWM','PCA9685'):
+        for Servo.deduplicate in (False,True):
+            i2c=FakeI2C()
+            if backendName=='PWM':
+                ravenms=RavenMS(lazy=True)
+            else:
+                pca=PCA9685(i2c)
+                pca.deduplicate=Servo.deduplicate
+                ravenms=RavenMS(lazy=True,backend=pca)
+            ravenms.home()
+            if backendName=='PWM':
+                for servo in ravenms.lowerBodyServos:
+                    servo.pin=BenchmarkPWM()
+            i2c.transactions=0
+            i2c.bytes=0
+            issued,suppressed=ravenms.lowerBodyGroup.writeCounts()
+            t0=Hal.clock.ticks_us()
+            for keyframes in (WALK,LB_TRANSFORM_HUMAN_HELI,LB_TRANSFORM_HELI_HUMAN):
+                keyframes.play(ravenms.lowerBodyGroup,lambda ms: None)
+            elapsed=Hal.clock.ticks_diff(Hal.clock.ticks_us(),t0)
+            issued2,suppressed2=ravenms.lowerBodyGroup.writeCounts()
+            line=backendName+(' deduplicated: ' if Servo.deduplicate else ': ')+str(issued2-issued) \
+                 +' writes issued, '+str(suppressed2-suppressed)+' suppressed, '+str(elapsed)+' us'
+            if backendName=='PCA9685':
+                line+=', '+str(i2c.transactions)+' I2C transactions, '+str(i2c.bytes)+' bytes, ' \
+                      +str(pca.writesSuppressed)+' channel updates suppressed by the driver'
+            print(line)
+            for servo in ravenms.lowerBodyServos:
+                servo.detach()
+    Servo.deduplicate=deduplicate
+    Log.setLevel(level)
+
+if __name__ == "__main__":
+    bootTime()
+    deduplication()
+    angleConversion()
+    groupSkew()
+    gaitCurrent()